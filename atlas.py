@@ -0,0 +1,234 @@
+############################################################
+#
+# Sprite atlas
+#
+# Packs the sprites of the game into one picture, so that starting
+# it reads and decodes a single file instead of opening every GIF
+# in sprites/ (and most of them several times):
+#
+#   python atlas.py [--out sprites/atlas.json] [--width 512]
+#
+# writes sprites/atlas.png with all the sprites side by side, and
+# sprites/atlas.json, the index of where each one went:
+#
+#   {"image": "atlas.png",
+#    "regions": {"sprites/ash.gif": [0, 0, 48, 48], ...},
+#    "sources": {"sprites/ash.gif": 356, ...}}
+#
+# (x, y, width, height of the region in pixels, and the size of the
+# GIF it came from). The game picks the atlas up by itself (see
+# load_atlas in pizza_quest.py) and goes back to the GIFs if the
+# index is missing or older than any of them, so run this again
+# after changing a sprite.
+#
+# The packed sprites are those of lvl.SPRITES, the direction tables
+# of Player, Llama, Fireball, Spitball and Vortex, and the sprites
+# of a single look (ash, doors, pizza, ...). It's plain Python: the
+# GIFs are decoded here and the atlas is written as a PNG (with the
+# transparency of the GIFs), which Tk 8.6 reads natively.
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import zlib
+import struct
+import argparse
+
+os.environ['PIZZA_HEADLESS'] = '1'
+
+import pizza_quest as pq
+lvl = pq.lvl
+
+# the sprites with only one look
+SINGLES = (
+    'sprites/ash.gif',
+    'sprites/V_door.gif',
+    'sprites/V_barricade.gif',
+    'sprites/bigger_pizza.gif',
+    'sprites/other_felix.gif',
+)
+
+
+# every sprite file the game shows, sorted
+def sprite_names ():
+    names = set(lvl.SPRITES.values())
+    for cls in (pq.Player,pq.Llama):
+        names.update(cls._DIR_IMGS.values())
+    for cls in (pq.Fireball,pq.Spitball):
+        for table in cls._POWER_IMGS:
+            names.update(table.values())
+    names.update(pq.Vortex._IMGS.values())
+    names.update(SINGLES)
+    names.add(pq.FLAMES)
+    return sorted(names)
+
+
+# the pixels of the codes in data, an LZW stream of a GIF image
+def lzw_decode (data,min_size):
+    clear = 1 << min_size
+    end = clear + 1
+    table = [bytearray([i]) for i in range(clear)] + [None,None]
+    size = min_size + 1
+    out = bytearray()
+    prev = None
+    bits = nbits = 0
+    for byte in data:
+        bits |= byte << nbits
+        nbits += 8
+        while nbits >= size:
+            code = bits & ((1 << size) - 1)
+            bits >>= size
+            nbits -= size
+            if code == clear:
+                del table[clear+2:]
+                size = min_size + 1
+                prev = None
+                continue
+            if code == end:
+                return out
+            if code < len(table):
+                entry = table[code]
+                if prev is not None and len(table) < 4096:
+                    table.append(prev + entry[:1])
+            else:
+                entry = prev + prev[:1]
+                table.append(entry)
+            out += entry
+            prev = entry
+            if len(table) == 1 << size and size < 12:
+                size += 1
+    return out
+
+
+# the first frame of a GIF file: (width, height, RGBA bytearray)
+def read_gif (path):
+    with open(path,'rb') as f:
+        data = bytearray(f.read())
+    if data[:3] != b'GIF':
+        raise ValueError('%s is not a GIF' % path)
+    width,height,flags = struct.unpack('<HHB',bytes(data[6:11]))
+    pos = 13
+    palette = None
+    if flags & 0x80:
+        n = 3 << ((flags & 7) + 1)
+        palette = data[pos:pos+n]
+        pos += n
+    transparent = None
+    while pos < len(data):
+        block = data[pos]
+        if block == 0x21:                   # extension
+            if data[pos+1] == 0xf9 and data[pos+3] & 1:
+                transparent = data[pos+6]
+            pos += 2
+            while data[pos]:
+                pos += data[pos] + 1
+            pos += 1
+        elif block == 0x2c:                 # image
+            left,top,w,h,iflags = struct.unpack('<HHHHB',bytes(data[pos+1:pos+10]))
+            pos += 10
+            if iflags & 0x80:
+                n = 3 << ((iflags & 7) + 1)
+                palette = data[pos:pos+n]
+                pos += n
+            min_size = data[pos]
+            pos += 1
+            stream = bytearray()
+            while data[pos]:
+                stream += data[pos+1:pos+1+data[pos]]
+                pos += data[pos] + 1
+            indices = lzw_decode(stream,min_size)
+            rows = list(range(h))
+            if iflags & 0x40:               # interlaced
+                rows = (list(range(0,h,8)) + list(range(4,h,8)) +
+                        list(range(2,h,4)) + list(range(1,h,2)))
+            rgba = bytearray(4 * width * height)
+            for i,row in enumerate(rows):
+                y = top + row
+                for x in range(w):
+                    k = i * w + x
+                    if k >= len(indices) or indices[k] == transparent:
+                        continue
+                    c = 3 * indices[k]
+                    o = 4 * (y * width + left + x)
+                    rgba[o:o+4] = palette[c:c+3] + bytearray([255])
+            return width,height,rgba
+        else:
+            break
+    raise ValueError('%s has no image' % path)
+
+
+# positions for rectangles of the given sizes, in rows of at most
+# `width` pixels (the tallest go first); returns ([(x, y)], height)
+def pack (sizes,width):
+    order = sorted(range(len(sizes)),key=lambda i: (-sizes[i][1],-sizes[i][0]))
+    places = [None] * len(sizes)
+    x = y = row = 0
+    for i in order:
+        w,h = sizes[i]
+        if x + w > width and x > 0:
+            x,y,row = 0,y+row,0
+        places[i] = (x,y)
+        x += w
+        row = max(row,h)
+    return places,y+row
+
+
+def png_chunk (kind,data):
+    return (struct.pack('>I',len(data)) + kind + data +
+            struct.pack('>I',zlib.crc32(kind+data) & 0xffffffff))
+
+
+def write_png (path,width,height,rgba):
+    stride = 4 * width
+    raw = b''.join(b'\0' + bytes(rgba[y*stride:(y+1)*stride]) for y in range(height))
+    with open(path,'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR',struct.pack('>IIBBBBB',width,height,8,6,0,0,0)))
+        f.write(png_chunk(b'IDAT',zlib.compress(raw,9)))
+        f.write(png_chunk(b'IEND',b''))
+
+
+# pack the sprite files `names` into an atlas; writes the image
+# next to the index and returns the index
+def build (names,index_path,width=512):
+    pictures = [read_gif(name) for name in names]
+    width = max([width] + [w for w,h,rgba in pictures])
+    places,height = pack([(w,h) for w,h,rgba in pictures],width)
+    atlas = bytearray(4 * width * height)
+    regions = {}
+    for name,(w,h,rgba),(x,y) in zip(names,pictures,places):
+        for row in range(h):
+            o = 4 * ((y + row) * width + x)
+            atlas[o:o+4*w] = rgba[4*w*row:4*w*(row+1)]
+        regions[name] = [x,y,w,h]
+    image = os.path.splitext(os.path.basename(index_path))[0] + '.png'
+    write_png(os.path.join(os.path.dirname(index_path),image),width,height,atlas)
+    index = {
+        'image': image,
+        'regions': regions,
+        'sources': dict((name,os.path.getsize(name)) for name in names),
+    }
+    with open(index_path,'w') as f:
+        json.dump(index,f,indent=1,sort_keys=True)
+    return index
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='pack the sprites into one atlas image')
+    parser.add_argument('--out',default=pq.ATLAS_INDEX,metavar='FILE',
+                        help='the index to write (the image goes next to it)')
+    parser.add_argument('--width',type=int,default=512,help='width of the atlas in pixels')
+    args = parser.parse_args()
+
+    names = sprite_names()
+    index = build(names,args.out,args.width)
+    image = os.path.join(os.path.dirname(args.out),index['image'])
+    print('packed %d sprites into %s (%d bytes), index in %s' %
+          (len(names),image,os.path.getsize(image),args.out))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+############################################################
+#
+# Batch runner for many headless games
+#
+# Plays thousands of seeded level 0 sessions (random or scripted
+# player input) in a multiprocessing pool, one process per core,
+# and streams one JSON line per finished run to a results file:
+#
+#   {"run": 17, "seed": 1017, "ticks": 4000, "health": 2,
+#    "llamas_killed": 1, "pizza": false, "vortex": false,
+#    "died": false, "seconds": 0.05}
+#
+# At the end it prints the aggregate throughput and outcomes.
+#
+#   python batch.py [--runs 1000] [--ticks 5000] [--workers N]
+#                   [--seed 0] [--rate 0.2] [--script FILE]
+#                   [--out results.jsonl]
+#
+# Runs only exchange a few numbers with the parent process, so
+# throughput scales with the number of cores.
+#
+
+from __future__ import print_function
+
+import json
+import time
+import argparse
+import multiprocessing
+
+import simulate
+
+
+# play one session and describe how it went
+def play (job):
+    run,seed,ticks,rate,script = job
+    if script:
+        inputs = simulate.ScriptedInput(script)
+    else:
+        inputs = simulate.RandomInput(seed,rate)
+    scr = simulate.make_world(seed)
+    stats = simulate.run(scr,ticks,inputs)
+    p = scr._player
+    return {
+        'run': run,
+        'seed': seed,
+        'ticks': stats['ticks'],
+        'health': p._health,
+        'llamas_killed': len(scr.ded_llamas),
+        'pizza': not any(t.is_pizza() for t in scr._things),
+        'vortex': stats['done'] and not stats['lost'],
+        'died': stats['lost'],
+        'seconds': stats['seconds'],
+    }
+
+
+def summarize (results,elapsed,workers):
+    n = len(results)
+    ticks = sum(r['ticks'] for r in results)
+    print('%d runs on %d workers in %.2f s' % (n,workers,elapsed))
+    print('throughput:       %.1f runs/s, %.0f ticks/s' % (n/elapsed,ticks/elapsed))
+    if not n:
+        return
+    print('mean ticks:       %.0f' % (float(ticks)/n))
+    print('died:             %d' % sum(r['died'] for r in results))
+    print('llamas killed:    %d' % sum(r['llamas_killed'] for r in results))
+    print('pizza eaten:      %d' % sum(r['pizza'] for r in results))
+    print('vortex reached:   %d' % sum(r['vortex'] for r in results))
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='run many headless level 0 sessions in parallel')
+    parser.add_argument('--runs',type=int,default=1000)
+    parser.add_argument('--ticks',type=int,default=5000,help='tick limit per run')
+    parser.add_argument('--workers',type=int,default=multiprocessing.cpu_count())
+    parser.add_argument('--seed',type=int,default=0,help='run i uses seed+i')
+    parser.add_argument('--rate',type=float,default=0.2,
+                        help='fraction of ticks with a random key press')
+    parser.add_argument('--script',help="play this '<tick> <key>' script in every run")
+    parser.add_argument('--out',default='results.jsonl')
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        script = sorted(simulate.ScriptedInput.load(args.script)._keys.items())
+    jobs = [(i,args.seed+i,args.ticks,args.rate,script) for i in range(args.runs)]
+
+    results = []
+    start = time.time()
+    pool = multiprocessing.Pool(args.workers)
+    try:
+        with open(args.out,'w') as out:
+            chunk = max(1,min(16,args.runs // (4*args.workers)))
+            for result in pool.imap_unordered(play,jobs,chunk):
+                out.write(json.dumps(result,sort_keys=True)+'\n')
+                out.flush()
+                results.append(result)
+    finally:
+        pool.close()
+        pool.join()
+
+    summarize(results,time.time()-start,args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+############################################################
+#
+# Benchmark regression gate
+#
+# Runs the engine benchmarks (see benchmarks.py) and compares the
+# medians with a baseline saved earlier. A benchmark regressed if
+# its median got slower than the baseline's by more than its
+# tolerance; then the tool prints the table of differences and
+# exits with status 1, so it can gate a change:
+#
+#   python bench_compare.py --baseline bench_baseline.json
+#
+#   benchmark                         baseline    current  change  spread
+#   queue.enqueue n=1000                 21.40      22.10     +3%      4%  ok
+#   screen.shift_viewport things=0      342.80     512.00    +49%      6%  SLOWER
+#
+# Record (or refresh) the baseline on the same machine with
+#
+#   python bench_compare.py --baseline bench_baseline.json --update
+#
+# Tolerances are fractions of the baseline median: --tolerance 0.2
+# sets the default, and --tolerance NAME=0.5 the one for every
+# benchmark whose label starts with NAME (e.g. queue.dequeue or
+# 'queue.dequeue n=10'). A baseline may also carry its own, as
+# {"tolerances": {"queue.dequeue": 0.5}}; the command line wins.
+#
+# Each benchmark runs --repeat times and medians are compared. The
+# spread column (max - min of the runs, relative to the median)
+# shows how noisy the machine was. To not fail on noise alone, a
+# benchmark only counts as SLOWER if even its fastest run is over
+# the tolerance; if just the median is, it's marked 'noisy'.
+
+
+from __future__ import print_function
+
+import sys
+import json
+import argparse
+
+import benchmarks
+
+DEFAULT_TOLERANCE = 0.25
+
+
+# the tolerance for a result: the longest matching prefix wins
+def tolerance (tolerances,default,label):
+    best = None
+    for prefix in tolerances:
+        if label.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return tolerances[best] if best is not None else default
+
+
+# compare results; returns [(label, baseline r, current r, tol, verdict)]
+def compare (baseline,current,tolerances,default):
+    old = dict((benchmarks.label(r),r) for r in baseline['results'])
+    rows = []
+    for r in current['results']:
+        name = benchmarks.label(r)
+        tol = tolerance(tolerances,default,name)
+        b = old.pop(name,None)
+        if b is None:
+            verdict = 'new'
+        else:
+            limit = b['us_per_op'] * (1 + tol)
+            if r['us_per_op'] > limit:
+                verdict = 'SLOWER' if min(r['samples']) > limit else 'noisy'
+            elif r['us_per_op'] < b['us_per_op'] / (1 + tol):
+                verdict = 'faster'
+            else:
+                verdict = 'ok'
+        rows.append((name,b,r,tol,verdict))
+    # (only those of the benchmark groups that ran)
+    groups = set(r.get('group') for r in current['results'])
+    for name,b in sorted(old.items()):
+        if b.get('group') in groups:
+            rows.append((name,b,None,None,'missing'))
+    return rows
+
+
+def show (rows,out=sys.stdout):
+    print('%-40s %10s %10s %7s %7s %5s' % ('benchmark','baseline','current',
+                                         'change','spread','tol'),file=out)
+    for name,b,r,tol,verdict in rows:
+        base = '%10.2f' % b['us_per_op'] if b else '%10s' % '-'
+        cur = '%10.2f' % r['us_per_op'] if r else '%10s' % '-'
+        if b and r:
+            change = '%+6.0f%%' % (100.0*(r['us_per_op']-b['us_per_op'])/b['us_per_op'])
+        else:
+            change = '%7s' % '-'
+        spread = '%6.0f%%' % (100*r['spread']) if r else '%7s' % '-'
+        tol = '%4.0f%%' % (100*tol) if tol is not None else '%5s' % '-'
+        print('%-40s %s %s %s %s %s  %s' % (name,base,cur,change,spread,tol,verdict),file=out)
+
+
+def parse_tolerances (specs):
+    default = None
+    tolerances = {}
+    for spec in specs or []:
+        if '=' in spec:
+            name,value = spec.rsplit('=',1)
+            tolerances[name] = float(value)
+        else:
+            default = float(spec)
+    return default,tolerances
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='compare the engine benchmarks with a baseline')
+    benchmarks.add_arguments(parser)
+    parser.add_argument('--baseline',required=True,metavar='FILE')
+    parser.add_argument('--update',action='store_true',
+                        help='save the results as the new baseline instead of comparing')
+    parser.add_argument('--tolerance',action='append',metavar='[NAME=]FRACTION',
+                        help='allowed slowdown, default %g' % DEFAULT_TOLERANCE)
+    parser.add_argument('--out',metavar='FILE',help='also save the current results as JSON')
+    parser.set_defaults(repeat=7)
+    args = parser.parse_args()
+
+    only = args.only.split(',') if args.only else None
+    current = benchmarks.run(only,args.repeat,args.seed)
+    if args.out:
+        benchmarks.save(args.out,current)
+
+    if args.update:
+        try:
+            with open(args.baseline) as f:
+                current['tolerances'] = json.load(f).get('tolerances',{})
+        except (IOError,ValueError):
+            pass
+        benchmarks.save(args.baseline,current)
+        print('saved %d results to %s' % (len(current['results']),args.baseline))
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    default,tolerances = parse_tolerances(args.tolerance)
+    if default is None:
+        default = DEFAULT_TOLERANCE
+    tolerances = dict(baseline.get('tolerances',{}),**tolerances)
+    if baseline.get('python') != current['python']:
+        print('note: baseline ran on Python %s, this is %s' % (baseline.get('python'),current['python']))
+
+    rows = compare(baseline,current,tolerances,default)
+    show(rows)
+    slower = [row for row in rows if row[4] == 'SLOWER']
+    if slower:
+        print('%d of %d benchmarks regressed' % (len(slower),len(rows)))
+        sys.exit(1)
+    print('no regressions in %d benchmarks' % len(rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+############################################################
+#
+# Benchmark: per-object vs. batched llama AI
+#
+# Fills level 0 with N llamas of mixed intelligence and times
+# how long one round of AI takes when every llama is its own
+# event on the queue, and when a single LlamaHerd thinks for
+# all of them. Runs headless (see simulate.py).
+#
+#   python bench_llama_ai.py [--sizes 100,1000,10000] [--rounds 5]
+#
+
+from __future__ import print_function
+
+import os
+import argparse
+import random
+import time
+
+os.environ['PIZZA_HEADLESS'] = '1'
+
+import pizza_quest as pq
+
+FREQ = 100
+
+
+def build (window,n,seed):
+    rng = random.Random(seed)
+    level = pq.Level(0)
+    q = pq.EventQueue()
+    p = pq.Player('bench','Right',3,3,10,0)
+    px,py = pq.LEVEL_WIDTH//2, pq.LEVEL_HEIGHT//2
+    scr = pq.Screen(level,window,q,p,px,py)
+    p.materialize(scr,px,py)
+
+    llamas = []
+    while len(llamas) < n:
+        x = rng.randrange(pq.LEVEL_WIDTH)
+        y = rng.randrange(pq.LEVEL_HEIGHT)
+        if level.tile(x,y) in pq.lvl.UNWALKABLES:
+            continue
+        l = pq.Llama(rng.choice(pq.FACINGS),rng.randrange(3),3,x,y)
+        llamas.append(l.materialize(scr,x,y))
+    return scr,q,llamas
+
+
+# run `rounds` AI rounds and return the seconds spent ticking; an
+# event registered with freq first fires on tick freq (counting
+# from 0), and then once every freq ticks
+def run_rounds (q,rounds):
+    start = time.time()
+    for t in range(rounds*FREQ+1):
+        q.dequeue_if_ready()
+    return time.time() - start
+
+
+def bench_per_object (window,n,rounds,seed):
+    random.seed(seed)
+    scr,q,llamas = build(window,n,seed)
+    for l in llamas:
+        l.register(q,FREQ)
+    return run_rounds(q,rounds)
+
+
+def bench_batched (window,n,rounds,seed):
+    scr,q,llamas = build(window,n,seed)
+    herd = pq.LlamaHerd(scr,seed)
+    for l in llamas:
+        herd.add(l)
+    herd.register(q,FREQ)
+    return run_rounds(q,rounds)
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='per-object vs. batched llama AI')
+    parser.add_argument('--sizes',default='100,1000,10000')
+    parser.add_argument('--rounds',type=int,default=5)
+    parser.add_argument('--seed',type=int,default=0)
+    args = parser.parse_args()
+
+    pq.DEBUG = False
+    window = pq.GraphWin('bench',pq.WINDOW_WIDTH,pq.WINDOW_HEIGHT,autoflush=False)
+
+    if pq.numpy is None:
+        print('NumPy not available: the batched mode falls back to per-llama think()')
+
+    print('%8s %14s %14s %8s' % ('llamas','per-object ms','batched ms','speedup'))
+    for n in [int(s) for s in args.sizes.split(',')]:
+        single = bench_per_object(window,n,args.rounds,args.seed)
+        batch = bench_batched(window,n,args.rounds,args.seed)
+        print('%8d %14.2f %14.2f %7.1fx' % (n, 1000*single/args.rounds,
+                                            1000*batch/args.rounds, single/batch))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+############################################################
+#
+# Benchmarks for the engine's hot paths
+#
+# Times, headless and with fixed seeds:
+#
+#   queue.enqueue         EventQueue.enqueue into queues of n events
+#   queue.dequeue         one EventQueue.dequeue_if_ready tick with
+#                         n events waiting
+#   screen.shift_viewport one player step worth of scrolling, with n
+#                         extra things on the level
+#   thing.facing_object   Thing.facing_object with n things around
+#   character.move        Character.move with n rats about
+#   projectile.move_or_stop
+#                         one step of a fireball in flight
+#   screen.build          Screen.__init__ for level 0
+#   level.transition      LevelManager.enter, stepping through the
+#                         vortex to level 1 (a made-up level), with
+#                         and without it preloaded
+#   level.reenter         LevelManager.enter back into a dormant level
+#   graphics.sprite_image sprite_image() for the level's sprites,
+#                         from the GIFs (atlas=0) or from the atlas
+#                         of atlas.py (atlas=1); with --window only,
+#                         since headless Images never read a file
+#
+# Every benchmark runs --repeat times. The table on stdout shows
+# the median time in microseconds per operation and the spread of
+# the runs (max - min, relative to the median), and --out saves
+# all of it as JSON to track the numbers over time (bench_compare.py
+# checks them against a baseline):
+#
+#   {"python": "3.11.7", "graphics": "headless", "seed": 0,
+#    "repeat": 5,
+#    "results": [{"name": "queue.enqueue", "params": {"n": 1000},
+#                 "group": "queue", "ops": 1000,
+#                 "us_per_op": 21.4, "spread": 0.08,
+#                 "samples": [21.4, 20.9, ...]}, ...]}
+#
+# The runs are interleaved -- the whole suite runs once, then again,
+# and so on -- so when a shared machine has a slow moment it costs
+# every benchmark at most a sample or two, which the median ignores.
+#
+#   python benchmarks.py [--only queue,screen] [--repeat 5]
+#                        [--seed 0] [--window] [--out results.json]
+#
+# Everything runs headless (see headless.py), unless --window picks
+# the real graphics.py; the results say which ("graphics").
+#
+
+from __future__ import print_function
+
+import gc
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+
+if '--window' not in sys.argv:
+    os.environ['PIZZA_HEADLESS'] = '1'
+
+import pizza_quest as pq
+import simulate
+import levelgen
+
+HEADLESS = bool(os.environ.get('PIZZA_HEADLESS'))
+
+clock = getattr(time,'perf_counter',time.time)
+
+BENCHMARKS = []
+
+
+def benchmark (fn):
+    BENCHMARKS.append(fn)
+    return fn
+
+
+# time per operation in `repeat` runs of work(), each after a
+# fresh setup() (which isn't timed) and doing `ops` operations
+def measure (setup,work,ops,repeat):
+    samples = []
+    for i in range(repeat):
+        state = setup()
+        # (like timeit, keep the garbage collector out of it)
+        gc.disable()
+        try:
+            start = clock()
+            work(state)
+            samples.append(1e6 * (clock() - start) / ops)
+        finally:
+            gc.enable()
+    return samples
+
+
+def median (values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid-1] + values[mid]) / 2.0
+
+
+def result (name,params,ops,samples):
+    us = median(samples)
+    return {'name': name, 'params': params, 'ops': ops, 'us_per_op': us,
+            'spread': (max(samples) - min(samples)) / us if us else 0.0,
+            'samples': samples}
+
+
+# 'queue.enqueue n=1000', naming a result in tables and baselines
+def label (r):
+    params = ' '.join('%s=%s' % kv for kv in sorted(r['params'].items()))
+    return (r['name']+' '+params).strip()
+
+
+# an event that comes back every `freq` ticks
+class Nop (object):
+    def __init__ (self,freq):
+        self._freq = freq
+
+    def event (self,q):
+        q.enqueue(self._freq,self)
+
+
+# level 0 with n more rats standing around (not moving by themselves)
+def world (seed,n=0):
+    random.seed(seed)
+    rng = random.Random(seed)
+    scr = simulate.make_world(seed)
+    level = scr._level
+    rats = []
+    while len(rats) < n:
+        x = rng.randrange(pq.LEVEL_WIDTH)
+        y = rng.randrange(pq.LEVEL_HEIGHT)
+        if level.tile(x,y) in pq.lvl.UNWALKABLES or scr.things_at(x,y):
+            continue
+        rat = pq.Rat('Rat','a bench rat')
+        rat._facing = rng.choice(pq.FACINGS)
+        rats.append(rat.materialize(scr,x,y))
+    return scr,rats
+
+
+@benchmark
+def queue (seed,repeat):
+    results = []
+    for n in (10,100,1000,10000):
+        def setup ():
+            rng = random.Random(seed)
+            q = pq.EventQueue()
+            # (what n enqueue() calls would make, only faster)
+            q._contents = sorted([[rng.randrange(1,100),Nop(rng.randrange(1,100))]
+                                  for i in range(n)],key=lambda entry: entry[0])
+            return q,[rng.randrange(1,100) for i in range(1000)]
+        def work (state):
+            q,delays = state
+            nop = Nop(1)
+            for d in delays:
+                q.enqueue(d,nop)
+        results.append(result('queue.enqueue',{'n': n},1000,
+                              measure(setup,work,1000,repeat)))
+
+        ticks = min(100,100000 // n)
+        def work (state):
+            q,delays = state
+            for t in range(ticks):
+                q.dequeue_if_ready()
+        results.append(result('queue.dequeue',{'n': n},ticks,
+                              measure(setup,work,ticks,repeat)))
+    return results
+
+
+@benchmark
+def screen (seed,repeat):
+    results = []
+    for n in (0,1000):
+        steps = 50
+        def setup ():
+            return world(seed,n)[0]
+        def work (scr):
+            for i in range(steps):
+                scr.shift_viewport(1 if i % 2 else -1,0)
+        results.append(result('screen.shift_viewport',{'things': n},steps,
+                              measure(setup,work,steps,repeat)))
+
+    builds = 5
+    def setup ():
+        return pq.GraphWin('bench',pq.WINDOW_WIDTH,pq.WINDOW_HEIGHT,autoflush=False)
+    def work (window):
+        for i in range(builds):
+            p = pq.Player('bench','Right',3,3,10,0)
+            pq.Screen(pq.Level(0),window,pq.EventQueue(),p,4,10)
+    results.append(result('screen.build',{'level': 0},builds,
+                          measure(setup,work,builds,repeat)))
+    return results
+
+
+@benchmark
+def things (seed,repeat):
+    results = []
+    for n in (100,1000):
+        def setup ():
+            return world(seed,n)[1]
+        rounds = 20
+        def work (rats):
+            for i in range(rounds):
+                for r in rats:
+                    r.facing_object()
+        results.append(result('thing.facing_object',{'things': n},rounds*n,
+                              measure(setup,work,rounds*n,repeat)))
+
+        def work (rats):
+            rng = random.Random(seed)
+            for i in range(rounds):
+                for r in rats:
+                    dx,dy = rng.choice(pq.STEPS)
+                    r.move(dx,dy)
+        results.append(result('character.move',{'things': n},rounds*n,
+                              measure(setup,work,rounds*n,repeat)))
+    return results
+
+
+@benchmark
+def projectiles (seed,repeat):
+    flights = 200
+    def setup ():
+        scr,rats = world(seed)
+        rng = random.Random(seed)
+        level = scr._level
+        starts = []
+        while len(starts) < flights:
+            x = rng.randrange(pq.LEVEL_WIDTH)
+            y = rng.randrange(pq.LEVEL_HEIGHT)
+            if level.tile(x,y) not in pq.lvl.UNWALKABLES and not scr.things_at(x,y):
+                starts.append((x,y,rng.choice(pq.FACINGS)))
+        return scr,starts,[0]
+    def work (state):
+        scr,starts,steps = state
+        for x,y,facing in starts:
+            fb = scr._projectiles.acquire(pq.Fireball,facing,20,0).materialize(scr,x,y)
+            steps[0] += 1
+            while not fb.move_or_stop():
+                steps[0] += 1
+    # (the number of steps is the same every run)
+    state = setup()
+    work(state)
+    steps = state[2][0]
+    return [result('projectile.move_or_stop',{'flights': flights},steps,
+                   measure(setup,work,steps,repeat))]
+
+
+@benchmark
+def levels (seed,repeat):
+    results = []
+    for preloaded in (0,1):
+        def setup ():
+            scr = world(seed)[0]
+            levelgen._generated.clear()     # (so its map is made again)
+            if preloaded:
+                scr._next = pq.LevelLoader(1).start()
+                scr._next.level()
+                while scr._next.warm():
+                    pass
+            return scr
+        def work (scr):
+            pq.LevelManager(scr._window,seed).enter(scr,1)
+        results.append(result('level.transition',{'preloaded': preloaded},1,
+                              measure(setup,work,1,repeat)))
+
+    def setup ():
+        scr = world(seed)[0]
+        levels = pq.LevelManager(scr._window,seed)
+        levels._dormant[0] = scr.snapshot()
+        return levels,scr
+    def work (state):
+        levels,scr = state
+        levels.enter(scr,0)
+    results.append(result('level.reenter',{},1,measure(setup,work,1,repeat)))
+    return results
+
+
+@benchmark
+def graphics (seed,repeat):
+    if HEADLESS:
+        return []
+    images = 1000
+    pics = sorted(set(pq.lvl.SPRITES.values()))
+    results = []
+    saved = pq._atlas
+    try:
+        for atlas in (0,1):
+            # (a fresh atlas each run, so its first read is timed too)
+            def setup ():
+                pq._atlas = pq.load_atlas() if atlas else None
+                return pq._atlas
+            if atlas and setup() is None:
+                continue    # no atlas built: run atlas.py
+            def work (state):
+                p = pq.Point(pq.TILE_SIZE/2,pq.TILE_SIZE/2)
+                for i in range(images):
+                    pq.sprite_image(p,pics[i % len(pics)])
+            results.append(result('graphics.sprite_image',{'atlas': atlas},images,
+                                  measure(setup,work,images,repeat)))
+    finally:
+        pq._atlas = saved
+    return results
+
+
+# run the benchmark groups in `only` (default: all) `repeat` times
+# over and return the results document; progress(r) is called with
+# each finished result
+def run (only=None,repeat=5,seed=0,progress=None):
+    pq.DEBUG = False
+    groups = [fn for fn in BENCHMARKS if not only or fn.__name__ in only]
+    samples = {}
+    first = []
+    for i in range(repeat):
+        for fn in groups:
+            for r in fn(seed,1):
+                name = label(r)
+                if name not in samples:
+                    r['group'] = fn.__name__
+                    first.append(r)
+                    samples[name] = []
+                samples[name].extend(r['samples'])
+    results = []
+    for r in first:
+        r = dict(r,**result(r['name'],r['params'],r['ops'],samples[label(r)]))
+        if progress:
+            progress(r)
+        results.append(r)
+    return {
+        'python': platform.python_version(),
+        'graphics': 'headless' if HEADLESS else 'window',
+        'seed': seed,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def add_arguments (parser):
+    parser.add_argument('--only',help='comma-separated groups: '+
+                        ','.join(fn.__name__ for fn in BENCHMARKS))
+    parser.add_argument('--repeat',type=int,default=5,help='run every benchmark this many times')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--window',action='store_true',
+                        help='use the real graphics (Tk), not headless.py')
+
+
+def save (path,doc):
+    with open(path,'w') as f:
+        json.dump(doc,f,indent=2,sort_keys=True)
+
+
+def main ():
+    parser = argparse.ArgumentParser(description="benchmark the engine's hot paths")
+    add_arguments(parser)
+    parser.add_argument('--out',metavar='FILE',help='save the results as JSON')
+    args = parser.parse_args()
+
+    def show (r):
+        print('%-40s %12.2f %7.0f%%' % (label(r),r['us_per_op'],100*r['spread']))
+        sys.stdout.flush()
+
+    print('%-40s %12s %8s' % ('benchmark','us/op','spread'))
+    doc = run(args.only.split(',') if args.only else None,args.repeat,args.seed,show)
+    if args.out:
+        save(args.out,doc)
+
+if __name__ == '__main__':
+    main()
@@ -807,6 +807,37 @@ class Entry(GraphicsObject):
             self.entry.config(fg=color)
 
 
+class Atlas:
+
+    """Many pictures packed into one image file. regions maps the name
+    of each picture to its (x, y, width, height) in the file. The file
+    is read the first time a picture is needed, and every picture is
+    cut out of it once: Images made from an atlas share their photo
+    image, so clone() one before changing its pixels."""
+
+    def __init__(self, filename, regions):
+        self.filename = filename
+        self.regions = regions
+        self.img = None
+        self.photos = {}
+
+    def __contains__(self, name):
+        return name in self.regions
+
+    def photo(self, name):
+        """Returns the tk photoimage of the named picture"""
+        photo = self.photos.get(name)
+        if photo is None:
+            if self.img is None:
+                self.img = tk.PhotoImage(file=self.filename, master=_root)
+            x, y, width, height = self.regions[name]
+            photo = tk.PhotoImage(master=_root, width=width, height=height)
+            photo.tk.call(photo, 'copy', self.img,
+                          '-from', x, y, x+width, y+height)
+            self.photos[name] = photo
+        return photo
+
+
 class Image(GraphicsObject):
 
     idCount = 0
@@ -819,6 +850,9 @@ class Image(GraphicsObject):
         Image.idCount = Image.idCount + 1
         if len(pixmap) == 1: # file name provided
             self.img = tk.PhotoImage(file=pixmap[0], master=_root)
+        elif isinstance(pixmap[0], Atlas): # atlas and picture name provided
+            atlas, name = pixmap
+            self.img = atlas.photo(name)
         else: # width and height provided
             width, height = pixmap
             self.img = tk.PhotoImage(master=_root, width=width, height=height)
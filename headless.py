@@ -0,0 +1,357 @@
+# headless.py
+"""Window-less stand-in for the parts of graphics.py the game uses.
+
+Pizza Quest only needs a handful of things from graphics.py: a
+GraphWin to draw into, Points, Rectangles, Text and Images. This
+module provides the same classes with the same methods, but keeps
+everything in plain Python objects instead of a Tk canvas, so the
+game logic can run without a display, without Tk, and as fast as
+the CPU allows.
+
+Nothing is ever rendered and image files are never opened.
+Drawn objects still get canvas ids and are tracked in
+GraphWin.items (and Image.imageCache), so code that counts or
+inspects them behaves the same as with the real library.
+
+Select it by setting PIZZA_HEADLESS=1 before importing
+pizza_quest (simulate.py does this for you).
+"""
+
+
+class GraphicsError(Exception):
+    """Generic error class for graphics module exceptions."""
+    pass
+
+OBJ_ALREADY_DRAWN = "Object currently drawn"
+UNSUPPORTED_METHOD = "Object doesn't support operation"
+BAD_OPTION = "Illegal option value"
+
+
+def update():
+    pass
+
+
+class GraphWin(object):
+
+    """A window-less GraphWin. Input is fed by setting lastKey."""
+
+    headless = True
+
+    def __init__(self, title="Graphics Window",
+                 width=200, height=200, autoflush=True):
+        self.title = title
+        self.width = width
+        self.height = height
+        self.autoflush = autoflush
+        self.items = []
+        self.closed = False
+        self.lastKey = ""
+        self.trans = None
+        self._canvas_items = {}     # canvas id -> drawn object
+        self._next_id = 1
+        self.flushes = 0
+
+    def __checkOpen(self):
+        if self.closed:
+            raise GraphicsError("window is closed")
+
+    def _onKey(self, evnt):
+        self.lastKey = evnt.keysym
+
+    # canvas bookkeeping, standing in for the tk.Canvas methods
+
+    def _create(self, obj):
+        cid = self._next_id
+        self._next_id += 1
+        self._canvas_items[cid] = obj
+        return cid
+
+    def delete(self, cid):
+        if cid == 'all':
+            self._canvas_items.clear()
+        else:
+            self._canvas_items.pop(cid, None)
+
+    def move(self, cid, dx, dy):
+        pass
+
+    def tag_raise(self, cid, above=None):
+        pass
+
+    def tag_lower(self, cid, below=None):
+        pass
+
+    def itemconfig(self, cid, *args, **kw):
+        pass
+
+    def find_all(self):
+        return tuple(self._canvas_items)
+
+    # the GraphWin API
+
+    def setBackground(self, color):
+        self.__checkOpen()
+
+    def setCoords(self, x1, y1, x2, y2):
+        raise GraphicsError(UNSUPPORTED_METHOD)
+
+    def close(self):
+        self.closed = True
+
+    def isClosed(self):
+        return self.closed
+
+    def isOpen(self):
+        return not self.closed
+
+    def update(self):
+        self.flushes += 1
+
+    def update_idletasks(self):
+        self.flushes += 1
+
+    def flush(self):
+        self.__checkOpen()
+        self.flushes += 1
+
+    def getMouse(self):
+        raise GraphicsError(UNSUPPORTED_METHOD)
+
+    def checkMouse(self):
+        return None
+
+    def getKey(self):
+        """Return the pending key, or 'Return' rather than block."""
+        if self.isClosed(): raise GraphicsError("getKey in closed window")
+        key = self.lastKey or "Return"
+        self.lastKey = ""
+        return key
+
+    def checkKey(self):
+        """Return last key fed or "" if none since last call"""
+        if self.isClosed():
+            raise GraphicsError("checkKey in closed window")
+        self.update()
+        key = self.lastKey
+        self.lastKey = ""
+        return key
+
+    def getHeight(self):
+        return self.height
+
+    def getWidth(self):
+        return self.width
+
+    def toScreen(self, x, y):
+        return x, y
+
+    def toWorld(self, x, y):
+        return x, y
+
+    def addItem(self, item):
+        self.items.append(item)
+
+    def delItem(self, item):
+        self.items.remove(item)
+
+
+class GraphicsObject(object):
+
+    """Generic base class for all of the drawable objects"""
+
+    def __init__(self, options):
+        self.canvas = None
+        self.id = None
+        self.config = dict.fromkeys(options)
+
+    def setFill(self, color):
+        self._reconfig("fill", color)
+
+    def setOutline(self, color):
+        self._reconfig("outline", color)
+
+    def setWidth(self, width):
+        self._reconfig("width", width)
+
+    def draw(self, graphwin):
+        if self.canvas and not self.canvas.isClosed(): raise GraphicsError(OBJ_ALREADY_DRAWN)
+        if graphwin.isClosed(): raise GraphicsError("Can't draw to closed window")
+        self.canvas = graphwin
+        self.id = graphwin._create(self)
+        graphwin.addItem(self)
+
+    def undraw(self):
+        if not self.canvas: return
+        if not self.canvas.isClosed():
+            self.canvas.delete(self.id)
+            self.canvas.delItem(self)
+        self.canvas = None
+        self.id = None
+
+    def move(self, dx, dy):
+        self._move(dx, dy)
+
+    def _reconfig(self, option, setting):
+        if option not in self.config:
+            raise GraphicsError(UNSUPPORTED_METHOD)
+        self.config[option] = setting
+
+    def _move(self, dx, dy):
+        pass
+
+
+class Point(GraphicsObject):
+    def __init__(self, x, y):
+        GraphicsObject.__init__(self, ["outline", "fill"])
+        self.x = x
+        self.y = y
+
+    def _move(self, dx, dy):
+        self.x = self.x + dx
+        self.y = self.y + dy
+
+    def clone(self):
+        return Point(self.x, self.y)
+
+    def getX(self): return self.x
+    def getY(self): return self.y
+
+
+class _BBox(GraphicsObject):
+    def __init__(self, p1, p2, options=["outline","width","fill"]):
+        GraphicsObject.__init__(self, options)
+        self.p1 = p1.clone()
+        self.p2 = p2.clone()
+
+    def _move(self, dx, dy):
+        self.p1.x = self.p1.x + dx
+        self.p1.y = self.p1.y + dy
+        self.p2.x = self.p2.x + dx
+        self.p2.y = self.p2.y + dy
+
+    def getP1(self): return self.p1.clone()
+
+    def getP2(self): return self.p2.clone()
+
+    def getCenter(self):
+        p1 = self.p1
+        p2 = self.p2
+        return Point((p1.x+p2.x)/2.0, (p1.y+p2.y)/2.0)
+
+
+class Rectangle(_BBox):
+    def __init__(self, p1, p2):
+        _BBox.__init__(self, p1, p2)
+
+    def clone(self):
+        other = Rectangle(self.p1, self.p2)
+        other.config = self.config.copy()
+        return other
+
+
+class Text(GraphicsObject):
+    def __init__(self, p, text):
+        GraphicsObject.__init__(self, ["justify","fill","text","font"])
+        self.setText(text)
+        self.anchor = p.clone()
+
+    def _move(self, dx, dy):
+        self.anchor.move(dx, dy)
+
+    def clone(self):
+        other = Text(self.anchor, self.config['text'])
+        other.config = self.config.copy()
+        return other
+
+    def setText(self, text):
+        self._reconfig("text", text)
+
+    def getText(self):
+        return self.config["text"]
+
+    def getAnchor(self):
+        return self.anchor.clone()
+
+    def setFace(self, face):
+        pass
+
+    def setSize(self, size):
+        if 5 <= size <= 36:
+            pass
+        else:
+            raise GraphicsError(BAD_OPTION)
+
+    def setStyle(self, style):
+        pass
+
+    def setTextColor(self, color):
+        self.setFill(color)
+
+
+class Atlas(object):
+
+    """Same as graphics.Atlas; the file counts as one load."""
+
+    def __init__(self, filename, regions):
+        self.filename = filename
+        self.regions = regions
+        self.img = None
+        self.photos = {}
+
+    def __contains__(self, name):
+        return name in self.regions
+
+    def photo(self, name):
+        if self.img is None:
+            self.img = self.filename
+            Image.loads = Image.loads + 1
+        return self.photos.setdefault(name, name)
+
+
+class Image(GraphicsObject):
+
+    idCount = 0
+    imageCache = {} # mirrors graphics.Image.imageCache
+    loads = 0       # image files that would have been opened
+
+    def __init__(self, p, *pixmap):
+        GraphicsObject.__init__(self, [])
+        self.anchor = p.clone()
+        self.imageId = Image.idCount
+        Image.idCount = Image.idCount + 1
+        if len(pixmap) == 1: # file name provided
+            self.img = pixmap[0]
+            Image.loads = Image.loads + 1
+        elif isinstance(pixmap[0], Atlas): # atlas and picture name provided
+            atlas, name = pixmap
+            self.img = atlas.photo(name)
+        else: # width and height provided
+            self.img = pixmap
+
+    def draw(self, graphwin):
+        GraphicsObject.draw(self, graphwin)
+        self.imageCache[self.imageId] = self.img
+
+    def _move(self, dx, dy):
+        self.anchor.move(dx, dy)
+
+    def undraw(self):
+        try:
+            del self.imageCache[self.imageId]
+        except KeyError:
+            pass
+        GraphicsObject.undraw(self)
+
+    def getAnchor(self):
+        return self.anchor.clone()
+
+    def clone(self):
+        other = Image(Point(0,0), 0, 0)
+        other.img = self.img
+        other.anchor = self.anchor.clone()
+        other.config = self.config.copy()
+        return other
+
+
+def color_rgb(r,g,b):
+    return "#%02x%02x%02x" % (r,g,b)
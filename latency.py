@@ -0,0 +1,174 @@
+############################################################
+#
+# Input-to-display latency
+#
+# A LatencyProbe watches a graphics.py window and times every key
+# press through three points:
+#
+#   key       the key event arrives from Tk (GraphWin._onKey)
+#   dispatch  the game reads it (checkKey() returns it, which is
+#             when CheckInput.event acts on it)
+#   flush     the first window update after that, which puts the
+#             result on the screen
+#
+# and reports percentiles of key -> dispatch (waiting for the next
+# poll), dispatch -> flush (the game's work) and key -> flush (what
+# the player feels) for the session. It also counts the presses
+# that never got dispatched because another key arrived first and
+# overwrote the single-slot lastKey.
+#
+# Under Tk the key handler only runs inside an update() -- most
+# often the one in checkKey itself -- so the time it runs at isn't
+# when the key came in. The probe takes that from the event's X
+# server timestamp (ms) instead, mapped onto clock() with the
+# smallest gap seen so far between a timestamp and its handler
+# running: the fastest delivered key counts as having waited no
+# time at all, so the waits are, if anything, a little short (and
+# the first few presses, before a fast one has been seen, may be
+# shorter still).
+#
+# The probe only wraps the window's methods, the game code doesn't
+# know about it:
+#
+#   python pizza_quest.py --latency latency.json
+#   python turning_the_arrow.py
+#
+# print the report at exit (and save it as JSON):
+#
+#   latency over 57 key presses (2 overwritten, 0 taken by getKey)
+#                         p50     p90     p99     max  (ms)
+#   key -> dispatch       4.8     9.1    10.2    10.3
+#   dispatch -> flush     1.9     3.7     8.0     8.4
+#   key -> flush          6.9    12.0    17.9    18.2
+#
+
+from __future__ import print_function
+
+import sys
+import json
+import time
+import atexit
+
+clock = getattr(time,'perf_counter',time.time)
+
+SPANS = (('key -> dispatch','key','dispatch'),
+         ('dispatch -> flush','dispatch','flush'),
+         ('key -> flush','key','flush'))
+
+
+def percentile (values,q):
+    values = sorted(values)
+    return values[min(len(values)-1,int(q*len(values)))]
+
+
+class LatencyProbe (object):
+    def __init__ (self):
+        self._arrived = None        # clock() when the pending key came in
+        self._dispatched = None     # clock() when the game read it
+        self._presses = []          # {'key': .., 'dispatch': .., 'flush': ..}
+        self._overwritten = 0
+        self._taken = 0             # swallowed by getKey()
+        self._offset = None         # clock() - X server time, at its smallest
+        self._server = None         # the last X server time seen
+
+    # wrap window's key handler, checkKey, getKey and update
+    def install (self,window):
+        self._window = window
+        on_key = window._onKey
+        check_key = window.checkKey
+        get_key = window.getKey
+        update = window.update
+
+        def _onKey (event):
+            self.arrived(getattr(event,'time',None))
+            on_key(event)
+
+        def checkKey ():
+            key = check_key()
+            if key:
+                self.dispatched()
+            return key
+
+        def getKey ():
+            key = get_key()
+            if self._arrived is not None:
+                self._taken += 1
+                self._arrived = None
+            return key
+
+        def flushed ():
+            update()
+            if self._dispatched is not None:
+                self.flushed()
+
+        if hasattr(window,'bind_all'):
+            window.bind_all('<Key>',_onKey)
+        window._onKey = _onKey
+        window.checkKey = checkKey
+        window.getKey = getKey
+        window.update = flushed
+        return self
+
+    # (server_ms is the X server timestamp of the key event, if any)
+    def arrived (self,server_ms=None):
+        if self._arrived is not None:
+            self._overwritten += 1
+        now = clock()
+        if not server_ms:
+            self._arrived = now
+            return
+        server = server_ms / 1000.0
+        if self._server is not None and server < self._server:
+            self._offset = None     # the server clock wrapped around
+        self._server = server
+        if self._offset is None or now - server < self._offset:
+            self._offset = now - server
+        self._arrived = server + self._offset
+
+    def dispatched (self):
+        # (without Tk, keys show up without arriving first)
+        self._dispatched = clock()
+        if self._arrived is None:
+            self._arrived = self._dispatched
+
+    def flushed (self):
+        self._presses.append({'key': self._arrived,'dispatch': self._dispatched,
+                              'flush': clock()})
+        self._arrived = None
+        self._dispatched = None
+
+    def summary (self):
+        spans = {}
+        for name,start,end in SPANS:
+            ms = [1000*(p[end]-p[start]) for p in self._presses]
+            if ms:
+                spans[name] = {'p50': percentile(ms,0.5),'p90': percentile(ms,0.9),
+                               'p99': percentile(ms,0.99),'max': max(ms)}
+        return {
+            'presses': len(self._presses),
+            'overwritten': self._overwritten,
+            'taken_by_getkey': self._taken,
+            'ms': spans,
+        }
+
+    def table (self):
+        s = self.summary()
+        lines = ['latency over %d key presses (%d overwritten, %d taken by getKey)' %
+                 (s['presses'],s['overwritten'],s['taken_by_getkey'])]
+        if s['ms']:
+            lines.append('%-18s %7s %7s %7s %7s  (ms)' % ('','p50','p90','p99','max'))
+            for name,start,end in SPANS:
+                p = s['ms'][name]
+                lines.append('%-18s %7.1f %7.1f %7.1f %7.1f' % (name,p['p50'],p['p90'],
+                                                                p['p99'],p['max']))
+        return '\n'.join(lines)
+
+    def report (self,path=None,out=sys.stderr):
+        print(self.table(),file=out)
+        if path:
+            with open(path,'w') as f:
+                json.dump(self.summary(),f,indent=2,sort_keys=True)
+
+    def report_at_exit (self,path=None):
+        atexit.register(self.report,path)
+        return self
@@ -0,0 +1,395 @@
+############################################################
+#
+# Procedural levels
+#
+# Makes levels of any size from a seed, to load the engine with
+# more than the 50x50 map of levels.py:
+#
+#   python levelgen.py [--width 2000] [--height 2000] [--seed 0]
+#                      [--density tr=0.06 --density bu=0.04 ...]
+#                      [--llamas 0.0001] [--enclosures 0.1]
+#                      [--check] [--ticks 1000]
+#
+# prints how long making the map took and what's on it; --check
+# also walks it to make sure the pizza can be reached and every
+# door has llamas to open it, and --ticks plays it headless for a
+# while (see simulate.py).
+#
+# A level is laid out like this:
+#
+#   - every tile is drawn at random, each of lvl.SPRITES with its
+#     own density (--density TILE=FRACTION, in 1/256ths)
+#   - paths run along every BLOCK-th row and column, so all of
+#     them are connected
+#   - some of the blocks between them hold a walled enclosure (of
+#     walls or of barricades) with a BarricadeDoor, a path from the
+#     door to the paths outside and llamas guarding it: killing
+#     them opens the door
+#   - the player starts where the paths cross nearest the middle,
+#     the pizza is in the enclosure farthest from there (or where
+#     the paths cross farthest from there, if there's none)
+#   - llamas of every intelligence tier wander about (--llamas is
+#     how many per tile, for each tier)
+#
+# So the start is always connected to the pizza, doors aside.
+# generate() returns a Layout; script(layout) is the function
+# building its level, like the ones in LEVEL_SCRIPTS, and
+# generated() makes the levels of the game listed in
+# GENERATED_LEVELS.
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import random
+import argparse
+import binascii
+
+# (the command line only plays headless)
+if __name__ == '__main__':
+    os.environ['PIZZA_HEADLESS'] = '1'
+
+import pizza_quest as pq
+lvl = pq.lvl
+
+# tile codes: the index in TILES (0 is no tile)
+TILES = [0] + sorted(lvl.SPRITES)
+CODE = dict((tile,code) for code,tile in enumerate(TILES))
+
+DENSITY = {'tr': 0.06, 'bu': 0.04, 'fl': 0.04}
+
+BLOCK = 24              # paths every BLOCK rows and columns
+LLAMAS = 0.0001         # wandering llamas per tile, for each tier
+ENCLOSURES = 0.1        # fraction of the blocks with an enclosure
+GUARDS = (1,3)          # llamas in each enclosure, at least/most
+
+FACINGS = ['Left','Right','Up','Down']
+
+# walls of the enclosure styles: corners (top left, top right,
+# bottom right, bottom left), then horizontal and vertical walls
+STYLES = {
+    'house': ('c1','c2','c3','c4','hw','vw'),
+    'fortress': ('vb','vb','vb','vb','hb','vb'),
+}
+
+
+class Layout (object):
+    def __init__ (self,width,height,tiles,start,pizza):
+        self.width = width
+        self.height = height
+        self.tiles = tiles          # the map, as in lvl.LEVELS
+        self.start = start          # (x, y) of the player
+        self.pizza = pizza          # (x, y) of the pizza
+        self.doors = []             # (x, y) of each enclosure's door
+        self.llamas = []            # (x, y, facing, tier, enclosure or None)
+
+    def level (self,num=0):
+        return pq.Level(num,list(self.tiles),self.width,self.height)
+
+
+# a bytearray of n random tile codes, drawn with the given densities
+def scatter (rng,n,density):
+    table = bytearray(256)
+    used = 0
+    for tile in sorted(density):
+        k = int(round(density[tile] * 256))
+        if used + k > 256:
+            raise ValueError('the densities add up to more than 1')
+        table[used:used+k] = bytearray([CODE[tile]]) * k
+        used += k
+    noise = binascii.unhexlify('%0*x' % (2*n,rng.getrandbits(8*n)))
+    return bytearray(noise.translate(bytes(table)))
+
+
+def generate (width,height,seed=0,density=DENSITY,llamas=LLAMAS,
+              enclosures=ENCLOSURES,block=BLOCK):
+    if width < 8 or height < 8:
+        raise ValueError('a level needs at least 8x8 tiles')
+    rng = random.Random(seed)
+    codes = scatter(rng,width*height,density)
+    pa = bytearray([CODE['pa']])
+
+    # the paths
+    for y in range(0,height,block):
+        codes[y*width:(y+1)*width] = pa * width
+    for x in range(0,width,block):
+        codes[x::width] = pa * height
+
+    cx,cy = width//2,height//2
+    crossings = [(x,y) for y in range(0,height,block) for x in range(0,width,block)]
+    start = min(crossings,key=lambda c: (abs(c[0]-cx)+abs(c[1]-cy),c))
+    def distance (x,y):
+        return abs(x-start[0]) + abs(y-start[1])
+
+    # the enclosures, in whole blocks
+    rooms = []
+    for by in range(0,height-block,block):
+        for bx in range(0,width-block,block):
+            if rng.random() < enclosures:
+                rooms.append(enclose(rng,codes,width,bx,by,block))
+
+    # ... and what's in them
+    pizza = max(crossings,key=lambda c: (distance(*c),c))
+    if rooms:
+        pizza = max((room[4] for room in rooms),key=lambda c: (distance(*c),c))
+    taken = set([start,pizza])
+    layout = Layout(width,height,None,start,pizza)
+    for x0,y0,x1,y1,middle,door in rooms:
+        taken.add(door)
+        inside = [(x,y) for y in range(y0+1,y1) for x in range(x0+1,x1) if (x,y) not in taken]
+        guards = rng.sample(inside,min(rng.randint(*GUARDS),len(inside)))
+        if not guards:
+            continue    # no room for a guard: no door either
+        i = len(layout.doors)
+        layout.doors.append(door)
+        for x,y in guards:
+            taken.add((x,y))
+            layout.llamas.append((x,y,rng.choice(FACINGS),rng.randrange(3),i))
+
+    # the wanderers, on empty tiles (not in a doorway)
+    for tier in range(3):
+        for k in range(int(round(llamas*width*height))):
+            for tries in range(10):
+                x,y = rng.randrange(width),rng.randrange(height)
+                if not codes[x+y*width] and (x,y) not in taken:
+                    taken.add((x,y))
+                    layout.llamas.append((x,y,rng.choice(FACINGS),tier,None))
+                    break
+
+    layout.tiles = list(map(TILES.__getitem__,codes))
+    return layout
+
+
+# wall in part of the block at (bx, by): returns the enclosure's
+# corners, middle and door
+def enclose (rng,codes,width,bx,by,block):
+    top_left,top_right,bottom_right,bottom_left,h,v = [
+        bytearray([CODE[tile]]) for tile in STYLES[rng.choice(sorted(STYLES))]]
+    x0 = bx + rng.randint(2,block//3)
+    y0 = by + rng.randint(2,block//3)
+    x1 = bx + block - rng.randint(2,block//3)
+    y1 = by + block - rng.randint(2,block//3)
+    def pos (x,y):
+        return x + y*width
+
+    codes[pos(x0,y0)] = top_left[0]
+    codes[pos(x1,y0)] = top_right[0]
+    codes[pos(x1,y1)] = bottom_right[0]
+    codes[pos(x0,y1)] = bottom_left[0]
+    for y in (y0,y1):
+        codes[pos(x0+1,y):pos(x1,y)] = h * (x1-x0-1)
+    for x in (x0,x1):
+        codes[pos(x,y0+1):pos(x,y1):width] = v * (y1-y0-1)
+    for y in range(y0+1,y1):
+        codes[pos(x0+1,y):pos(x1,y)] = bytearray(x1-x0-1)
+
+    # the door, and a path from it to the paths outside
+    pa = CODE['pa']
+    side = rng.choice(FACINGS)
+    if side in ('Left','Right'):
+        dx,dy = (x0 if side == 'Left' else x1),rng.randint(y0+1,y1-1)
+        outside = range(bx+1,x0) if side == 'Left' else range(x1+1,bx+block)
+        for x in outside:
+            codes[pos(x,dy)] = pa
+    else:
+        dx,dy = rng.randint(x0+1,x1-1),(y0 if side == 'Up' else y1)
+        outside = range(by+1,y0) if side == 'Up' else range(y1+1,by+block)
+        for y in outside:
+            codes[pos(dx,y)] = pa
+    codes[pos(dx,dy)] = 0
+    return x0,y0,x1,y1,((x0+x1)//2,(y0+y1)//2),(dx,dy)
+
+
+# the doors no llama guards (which never open)
+def unguarded (layout):
+    guarded = set(l[4] for l in layout.llamas)
+    return [door for i,door in enumerate(layout.doors) if i not in guarded]
+
+
+# can the player walk from the start to the pizza? (through the
+# doors, which open once their llamas are dead -- so not through
+# an unguarded one)
+def connected (layout):
+    width,height = layout.width,layout.height
+    tiles = layout.tiles
+    blocked = set(lvl.UNWALKABLES)
+    goal = layout.pizza[0] + layout.pizza[1]*width
+    seen = bytearray(width*height)
+    for x,y in unguarded(layout):
+        seen[x + y*width] = 1
+    todo = [layout.start[0] + layout.start[1]*width]
+    seen[todo[0]] = 1
+    while todo:
+        ind = todo.pop()
+        if ind == goal:
+            return True
+        x = ind % width
+        for n,ok in ((ind-width,ind >= width),(ind+width,ind < len(seen)-width),
+                     (ind-1,x > 0),(ind+1,x < width-1)):
+            if ok and not seen[n] and tiles[n] not in blocked:
+                seen[n] = 1
+                todo.append(n)
+    return False
+
+
+# the function building layout's level, like build_level_0 (back
+# is the level the vortex at the pizza leads to, by default num+1)
+def script (layout,num=0,back=None):
+    def build_level (window,seed=0,recorder=None,level=None,player=None,dormant=None):
+        if level is None:
+            level = layout.level(num)
+        pq.log("level generated")
+
+        q = pq.EventQueue()
+
+        p = player or pq.Player("...what's your name, bub?...", 'Right', 3, 3, 10, 0)
+        px,py = layout.start
+
+        scr = pq.Screen(level,window,q,p,px,py,seed)
+        pq.log("screen created")
+
+        doors = dict(('enclosure %d' % i,door) for i,door in enumerate(layout.doors))
+        if dormant is None:
+            for group,(x,y) in sorted(doors.items()):
+                pq.BarricadeDoor("the door of a llama hideout").materialize(scr,x,y)
+            for x,y,facing,tier,i in layout.llamas:
+                l = pq.Llama(facing,tier,1+tier,x,y)
+                l.register(q,100).materialize(scr,x,y)
+                if i is not None:
+                    scr._bus.join(l,'enclosure %d' % i)
+
+        # Killing the llamas of an enclosure opens its door
+        def enclosure_falls (llama):
+            if llama._group in doors and not scr._bus.alive(llama._group):
+                x,y = doors[llama._group]
+                for thing in list(scr.things_at(x,y)):
+                    if thing.is_barricade_door():
+                        thing.dematerialize()
+        scr._bus.subscribe('entity-died',enclosure_falls)
+
+        if dormant is None:
+            pq.Pizza('You take back the stolen slice of pizza. You feel your powers increasing.').materialize(scr,*layout.pizza)
+
+        # Eating it opens the way to another level, where it was
+        def pizza_eaten (pizza):
+            scr.show_text('A swirling vortex appears nearby, and you can smell a hint of pepperoni...')
+            pq.Vortex(back).register(q,20).materialize(scr,*layout.pizza)
+            scr._checkpoint_due = True
+        scr._bus.subscribe('pizza-eaten',pizza_eaten)
+
+        pq.create_panel(window)
+
+        p.materialize(scr,px,py)
+
+        scr._lod = pq.LlamaLOD(scr).register(q)
+        scr._fire = pq.FireSpread(scr).register(q)
+
+        q.enqueue(1,pq.CheckInput(window,p,recorder))
+
+        if dormant is not None:
+            scr.restore_state(dormant)
+
+        return scr
+    return build_level
+
+
+# a made-up level of the game (see pizza_quest.GENERATED_LEVELS):
+# the layout is generated the first time it's needed, which is on
+# the LevelLoader's thread if the level was preloaded
+class Generated (object):
+    def __init__ (self,num,back=None,**kwargs):
+        self._num = num
+        self._back = back
+        self._kwargs = kwargs       # for generate()
+        self._layout = None
+
+    def layout (self):
+        if self._layout is None:
+            self._layout = generate(**self._kwargs)
+        return self._layout
+
+    def level (self):
+        return self.layout().level(self._num)
+
+    def build (self,window,seed=0,recorder=None,level=None,player=None,dormant=None):
+        return script(self.layout(),self._num,self._back)(window,seed,recorder,level,player,dormant)
+
+_generated = {}
+
+# the Generated for level num (the same one every time, so a level
+# is generated once)
+def generated (num,**kwargs):
+    if num not in _generated:
+        _generated[num] = Generated(num,**kwargs)
+    return _generated[num]
+
+
+def parse_density (specs):
+    density = dict(DENSITY)
+    for spec in specs or []:
+        tile,value = spec.split('=')
+        if tile not in lvl.SPRITES:
+            raise SystemExit('no tile %r (there are %s)' % (tile,', '.join(sorted(lvl.SPRITES))))
+        density[tile] = float(value)
+    return density
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='make a random level of any size')
+    parser.add_argument('--width',type=int,default=2000)
+    parser.add_argument('--height',type=int,default=2000)
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--density',action='append',metavar='TILE=FRACTION',
+                        help='how much of the map is TILE (default %s)' %
+                        ', '.join('%s=%g' % d for d in sorted(DENSITY.items())))
+    parser.add_argument('--llamas',type=float,default=LLAMAS,
+                        help='wandering llamas per tile, for each tier')
+    parser.add_argument('--enclosures',type=float,default=ENCLOSURES,
+                        help='fraction of the blocks with an enclosure')
+    parser.add_argument('--check',action='store_true',help='make sure the pizza can be reached')
+    parser.add_argument('--ticks',type=int,default=0,help='then play it headless for this long')
+    args = parser.parse_args()
+
+    started = time.time()
+    layout = generate(args.width,args.height,args.seed,parse_density(args.density),
+                      args.llamas,args.enclosures)
+    print('%dx%d level generated in %.3f s' % (args.width,args.height,time.time()-started))
+
+    counts = {}
+    for tile in layout.tiles:
+        counts[tile] = counts.get(tile,0) + 1
+    size = float(args.width*args.height)
+    print('tiles:   ' + ', '.join('%s %.1f%%' % (tile,100*counts[tile]/size)
+                                  for tile in TILES[1:] if tile in counts))
+    tiers = [sum(1 for l in layout.llamas if l[3] == tier) for tier in range(3)]
+    print('llamas:  %d dumb, %d average, %d smart (%d guarding)' %
+          tuple(tiers + [sum(1 for l in layout.llamas if l[4] is not None)]))
+    print('start %s, pizza %s, %d enclosures' % (layout.start,layout.pizza,len(layout.doors)))
+
+    if args.check:
+        started = time.time()
+        doors = unguarded(layout)
+        if doors:
+            print('doors with no llama to open them: %s' % ', '.join(map(str,doors)))
+        ok = connected(layout)
+        print('pizza %s from the start (%.1f s)' % ('reachable' if ok else 'NOT reachable',
+                                                    time.time()-started))
+        if doors or not ok:
+            sys.exit(1)
+
+    if args.ticks:
+        import simulate
+        pq.DEBUG = False
+        window = pq.GraphWin("Pizza Quest (headless)",
+                             pq.WINDOW_WIDTH+pq.WINDOW_RIGHTPANEL, pq.WINDOW_HEIGHT,
+                             autoflush=False)
+        started = time.time()
+        scr = script(layout)(window,args.seed)
+        print('level built in %.3f s' % (time.time()-started))
+        simulate.report(simulate.run(scr,args.ticks,simulate.RandomInput(args.seed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+############################################################
+#
+# Logging
+#
+# A small logger that stays out of the game loop's way. Messages
+# are %-format strings with their arguments,
+#
+#   LOG.debug('%s moving to %d,%d', thing, x, y)
+#
+# and are only formatted if their level is enabled, so a disabled
+# call costs a comparison. Enabled records go to a sink:
+#
+#   ThreadSink   hands them to a background thread that prints
+#                them, so the game never waits on the terminal
+#                (the thread starts with the first record and
+#                prints what's left at exit)
+#   RingSink     keeps the last N of them in memory, to dump()
+#                after something went wrong
+#
+
+from __future__ import print_function
+
+import sys
+import time
+import atexit
+import threading
+import collections
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+
+# a record is (time, level, message)
+def format_record (record):
+    when,level,message = record
+    return '%s %-7s %s' % (time.strftime('[%H:%M:%S]',time.localtime(when)),
+                           NAMES.get(level,level),message)
+
+
+class RingSink (object):
+    def __init__ (self,size=1000):
+        self._records = collections.deque(maxlen=size)
+
+    def write (self,record):
+        self._records.append(record)
+
+    def records (self):
+        return list(self._records)
+
+    def dump (self,out=None):
+        out = out or sys.stdout
+        for record in self._records:
+            print(format_record(record),file=out)
+
+
+class ThreadSink (object):
+    def __init__ (self,out=None):
+        self._out = out
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def write (self,record):
+        if self._thread is None:
+            self.start()
+        self._queue.put(record)
+
+    def start (self):
+        self._thread = threading.Thread(target=self.run,name='log writer')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def run (self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            print(format_record(record),file=self._out or sys.stdout)
+
+    # print whatever is still queued and stop the thread (the
+    # sentinel goes in last, so the writer drains all of it first)
+    def close (self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+class Logger (object):
+    def __init__ (self,level=INFO,sink=None):
+        self.level = level
+        self.sink = sink if sink is not None else ThreadSink()
+
+    def enabled (self,level):
+        return level >= self.level
+
+    def log (self,level,message,*args):
+        if level < self.level:
+            return
+        if args:
+            message = message % args
+        self.sink.write((time.time(),level,message))
+
+    def debug (self,message,*args):
+        if DEBUG >= self.level:
+            self.log(DEBUG,message,*args)
+
+    def info (self,message,*args):
+        if INFO >= self.level:
+            self.log(INFO,message,*args)
+
+    def warning (self,message,*args):
+        if WARNING >= self.level:
+            self.log(WARNING,message,*args)
+
+    def error (self,message,*args):
+        self.log(ERROR,message,*args)
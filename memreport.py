@@ -0,0 +1,198 @@
+############################################################
+#
+# Memory report
+#
+# Builds the world of level 0 headless (see simulate.py), plays it
+# with random input, and every --every ticks takes stock of what
+# the world holds on to:
+#
+#   tiles            the tile images of the level (Screen._map_elts)
+#   <Class>          things on the screen, by class, with sprites
+#   pooled <Class>   stopped projectiles kept by the ProjectilePool
+#   inventory        things the player carries, and their panel text
+#   entity store     the typed arrays of ENTITIES
+#   queue entries    events waiting in the EventQueue
+#   canvas items     everything drawn (GraphWin.items)
+#   images           pictures pinned in Image.imageCache
+#   orphaned images  ... of which no drawn Image uses any more
+#
+# with a count and an estimate of the bytes held by each (the
+# objects, with their __dict__s or __slots__, sprites included;
+# Tk's own copies of the pictures aren't visible from Python). On
+# Python 3 it also traces every allocation with tracemalloc, and
+# reports the total and the source lines whose memory grew the
+# most over the run.
+#
+# The first --every ticks are the warm-up (pools fill, pictures get
+# loaded): a row whose count kept growing after it -- it grew, and
+# never went down -- is flagged, and so are orphaned images, which
+# are leaks.
+#
+#   python memreport.py [--ticks 5000] [--every 1000] [--seed 0]
+#                       [--rate 0.2] [--json report.json]
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import argparse
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+import simulate
+pq = simulate.pq
+
+
+# bytes held by an object and its attribute dict
+def sizeof (obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj,'__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+# ... and for a drawn object, its points and options too
+def sprite_size (sprite):
+    size = sizeof(sprite) + sys.getsizeof(sprite.config)
+    for name in ('anchor','p1','p2'):
+        point = getattr(sprite,name,None)
+        if point is not None:
+            size += sizeof(point)
+    return size
+
+
+def thing_size (thing):
+    return sizeof(thing) + sprite_size(thing.sprite())
+
+
+# {category: [count, bytes]} for the world of scr
+def take_stock (scr):
+    stock = {}
+    def add (category,n,size):
+        entry = stock.setdefault(category,[0,0])
+        entry[0] += n
+        entry[1] += size
+
+    tiles = [elt for ind,elt in scr._map_elts.items() if ind >= 0]
+    add('tiles',len(tiles),sum(sprite_size(elt) for elt in tiles))
+
+    for t in scr._things:
+        add(type(t).__name__,1,thing_size(t))
+    for idle in scr._projectiles._idle.values():
+        for p in idle:
+            add('pooled '+type(p).__name__,1,thing_size(p))
+    p = scr._player
+    for t in p._inventory:
+        add('inventory',1,sizeof(t))
+    for elt in p._inventory_elts.values():
+        add('inventory',0,sprite_size(elt))
+
+    store = pq.ENTITIES
+    columns = (store.x,store.y,store.flags,store.facing,store.health,store.kind,store.screen)
+    add('entity store',len(store._refs),
+        sum(sys.getsizeof(a) for a in columns) + sys.getsizeof(store._refs))
+
+    q = scr._q
+    add('queue entries',len(q._contents),
+        sys.getsizeof(q._contents) + sum(sys.getsizeof(e) for e in q._contents))
+
+    window = scr._window
+    add('canvas items',len(window.items),sys.getsizeof(window.items))
+
+    cache = pq.Image.imageCache
+    add('images',len(cache),sys.getsizeof(cache))
+    drawn = set(item.imageId for item in window.items if isinstance(item,pq.Image))
+    orphans = [i for i in cache if i not in drawn]
+    add('orphaned images',len(orphans),0)
+    return stock
+
+
+# a tracemalloc snapshot of the game's memory (not ours or its own)
+def trace ():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False,tracemalloc.__file__),
+        tracemalloc.Filter(False,__file__)))
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='memory held by a running level 0, by category')
+    parser.add_argument('--ticks',type=int,default=5000)
+    parser.add_argument('--every',type=int,default=1000,help='ticks between stock-takings')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--rate',type=float,default=0.2,
+                        help='fraction of ticks with a random key press')
+    parser.add_argument('--top',type=int,default=10,help='allocation sites to show')
+    parser.add_argument('--json',metavar='FILE',help='save the report as JSON')
+    args = parser.parse_args()
+
+    if tracemalloc:
+        tracemalloc.start()
+    scr = simulate.make_world(args.seed)
+    inputs = simulate.RandomInput(args.seed,args.rate)
+
+    stocks = [(0,take_stock(scr))]
+    traces = [trace()] if tracemalloc else []
+    while stocks[-1][0] < args.ticks and not scr._DONE:
+        simulate.run(scr,min(args.every,args.ticks-stocks[-1][0]),inputs)
+        stocks.append((scr._q.tick(),take_stock(scr)))
+        if tracemalloc:
+            traces.append(trace())
+    # (growth is counted after the warm-up)
+    since = min(1,len(stocks)-1)
+
+    # the table: one count and size per stock-taking
+    categories = sorted(set(c for tick,stock in stocks for c in stock),
+                        key=lambda c: -stocks[-1][1].get(c,[0,0])[1])
+    print('%-20s' % 'tick' + ''.join('%16d' % tick for tick,stock in stocks))
+    flagged = []
+    for c in categories:
+        cells = []
+        for tick,stock in stocks:
+            n,size = stock.get(c,[0,0])
+            cells.append('%6d %7.1fK ' % (n,size/1024.0))
+        counts = [stock.get(c,[0,0])[0] for tick,stock in stocks[since:]]
+        flag = ''
+        if c == 'orphaned images' and counts[-1]:
+            flag = '  <- LEAK'
+        elif counts[-1] > counts[0] and counts == sorted(counts):
+            flag = '  <- grew'
+        if flag:
+            flagged.append(c)
+        print('%-20s' % c + ''.join(cells) + flag)
+
+    report = {
+        'seed': args.seed,
+        'ticks': [tick for tick,stock in stocks],
+        'categories': dict((c,[stock.get(c,[0,0]) for tick,stock in stocks]) for c in categories),
+        'since': stocks[since][0],
+        'flagged': flagged,
+    }
+
+    if tracemalloc:
+        total = [sum(stat.size for stat in snap.statistics('filename')) for snap in traces]
+        print('\ntraced Python memory: '+', '.join('%.1f MB' % (t/1048576.0) for t in total))
+        growth = traces[-1].compare_to(traces[since],'lineno')
+        print('grew most since tick %d:' % stocks[since][0])
+        top = []
+        for stat in growth[:args.top]:
+            frame = stat.traceback[0]
+            where = '%s:%d' % (os.path.basename(frame.filename),frame.lineno)
+            print('  %+9.1fK %+7d blocks  %s' % (stat.size_diff/1024.0,stat.count_diff,where))
+            top.append({'where': where,'size_diff': stat.size_diff,'count_diff': stat.count_diff})
+        report['traced_bytes'] = total
+        report['growth'] = top
+    else:
+        print('\n(no tracemalloc on this Python: only the counts above)')
+
+    if args.json:
+        with open(args.json,'w') as f:
+            json.dump(report,f,indent=2,sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,14 +11,57 @@
 # Add sound effects
 # 
 
+from __future__ import print_function
+
+import os
+import sys
+import json
 import time
+import zlib
+import array
 import random
+import weakref
+import hashlib
+import itertools
+import threading
+try:  # the C pickler on Python 2
+    import cPickle as pickle
+except ImportError:
+    import pickle
 import levels as lvl
-from graphics import * 
+import logger
+import profiler
+
+# Run without a window? (see headless.py and simulate.py)
+if os.environ.get('PIZZA_HEADLESS'):
+    from headless import *
+else:
+    from graphics import * 
+
+# NumPy is only needed for the batched llama AI (LlamaHerd)
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Print debugging logs?
 DEBUG = True
 
+# Where the event profile is saved at exit once 'p' switched it on
+# (see profiler.py)
+PROFILE_FILE = 'profile.json'
+
+# Real time of one tick of the event queue
+TICK_SECONDS = 0.01
+
+# Tiles of the level built per tick after the first frame (see
+# Screen.build_tiles)
+TILE_SLICE = 40
+
+# Plan projectile flights ahead instead of stepping them every few
+# ticks? (see Projectile.plan)
+ANALYTIC_PROJECTILES = False
+
 # Tile size of the level
 LEVEL_WIDTH = 50
 LEVEL_HEIGHT = 50
@@ -37,6 +80,52 @@ WINDOW_HEIGHT = TILE_SIZE * VIEWPORT_HEIGHT
 # Pixel size of the panel on the right where you can display stuff
 WINDOW_RIGHTPANEL = 200
 
+# Index of the sprite atlas built by atlas.py
+ATLAS_INDEX = 'sprites/atlas.json'
+
+
+#
+# Sprites
+#
+# If atlas.py packed the sprites into an atlas, their images are cut
+# out of that one picture (read once, the first time a sprite is
+# shown) instead of opening a GIF for every Image. Without an atlas,
+# or if one of its sprites changed since it was built, the GIFs are
+# used as before.
+#
+_atlas = False      # not looked for yet
+
+# the Atlas described by the index at path, or None if there's no
+# usable one
+def load_atlas (path=ATLAS_INDEX):
+    try:
+        with open(path) as f:
+            index = json.load(f)
+        built = os.path.getmtime(path)
+        for name,size in index['sources'].items():
+            st = os.stat(name)
+            if st.st_size != size or st.st_mtime > built:
+                log('sprite atlas %s is out of date (%s changed)',path,name)
+                return None
+    except (IOError,OSError,ValueError,KeyError):
+        return None
+    image = os.path.join(os.path.dirname(path),index['image'])
+    return Atlas(image,dict((name,tuple(r)) for name,r in index['regions'].items()))
+
+# the Atlas in use, or None
+def sprite_atlas ():
+    global _atlas
+    if _atlas is False:
+        _atlas = load_atlas()
+    return _atlas
+
+# a new Image of the sprite file pic at p
+def sprite_image (p,pic):
+    atlas = sprite_atlas()
+    if atlas is not None and pic in atlas:
+        return Image(p,atlas,pic)
+    return Image(p,pic)
+
 #############################################################
 # 
 # The class hierarchy for objects that you can interact with
@@ -51,6 +140,8 @@ WINDOW_RIGHTPANEL = 200
 # The root object
 #
 class Root (object):
+    __slots__ = ()
+
     # default predicates
 
     # is this object a Thing?
@@ -89,6 +180,189 @@ class Root (object):
         return False
 
 
+#
+# Entity storage
+#
+# The hot attributes of every Thing -- position, walkable/takable/
+# flammable/burnt flags, facing and health -- don't live in the
+# object (whose other attributes are __slots__, see Thing) but in
+# parallel typed arrays, one slot per entity id (the thing's _eid). Thing reads and writes them through
+# properties, so the rest of the code still says self._x. Questions
+# about the whole world ("which things are burnt?", "which llamas
+# are in this box?") are then scans over a few flat arrays, done by
+# NumPy when it's available (see EntityStore.select).
+#
+# An id goes back to the free list when its Thing is garbage
+# collected.
+#
+# There is one store, ENTITIES, for the whole process: every Screen
+# (every level, dormant ones too) keeps its things in it, and the
+# store's screen column tells them apart (see Screen._sid).
+#
+FACINGS = ('Left','Right','Up','Down')
+FACING_INDEX = dict((f,i) for i,f in enumerate(FACINGS))
+
+NO_VALUE = -0x80000000  # marks an attribute that was never set
+
+# a weak reference that knows the entity id of its target
+class EntityRef (weakref.ref):
+    __slots__ = ('eid',)
+
+class EntityStore (object):
+    # flag bits
+    WALKABLE = 1
+    TAKABLE = 2
+    FLAMMABLE = 4
+    BURNT = 8
+
+    # kinds
+    THING = 0
+    LLAMA = 1
+    PLAYER = 2
+    PROJECTILE = 3
+
+    def __init__ (self):
+        self.x = array.array('i')
+        self.y = array.array('i')
+        self.flags = array.array('B')
+        self.facing = array.array('b')    # index into FACINGS, -1 if unset
+        self.health = array.array('i')
+        self.kind = array.array('B')
+        self.screen = array.array('I')    # id of the Screen showing it, 0 if none
+        self._refs = []
+        self._free = []
+
+    # allocate an entity id for thing
+    def new (self,thing,kind):
+        if self._free:
+            eid = self._free.pop()
+        else:
+            eid = len(self._refs)
+            self.x.append(NO_VALUE)
+            self.y.append(NO_VALUE)
+            self.flags.append(0)
+            self.facing.append(-1)
+            self.health.append(NO_VALUE)
+            self.kind.append(kind)
+            self.screen.append(0)
+            self._refs.append(None)
+        self.kind[eid] = kind
+        ref = self._refs[eid] = EntityRef(thing,self.release)
+        ref.eid = eid
+        return eid
+
+    # called when a thing is garbage collected
+    def release (self,ref):
+        self.free(ref.eid)
+
+    def free (self,eid):
+        self.x[eid] = NO_VALUE
+        self.y[eid] = NO_VALUE
+        self.flags[eid] = 0
+        self.facing[eid] = -1
+        self.health[eid] = NO_VALUE
+        self.screen[eid] = 0
+        self._refs[eid] = None
+        self._free.append(eid)
+
+    # number of live entities
+    def __len__ (self):
+        return len(self._refs) - len(self._free)
+
+    def thing (self,eid):
+        ref = self._refs[eid]
+        return ref() if ref else None
+
+    # a NumPy view of a column; don't hold on to it, the array
+    # can't grow while a view exists
+    def column (self,name):
+        col = getattr(self,name)
+        return numpy.frombuffer(col,dtype=col.typecode) if len(col) else numpy.zeros(0,col.typecode)
+
+    # the things shown on the screen with id sid that have all the
+    # given flags, are of the given kind and lie in the box
+    # (x0,y0,x1,y1), bounds included
+    def select (self,sid,flags=0,kind=None,box=None):
+        if numpy is not None:
+            mask = self.column('screen') == sid
+            if flags:
+                mask &= (self.column('flags') & flags) == flags
+            if kind is not None:
+                mask &= self.column('kind') == kind
+            if box:
+                x0,y0,x1,y1 = box
+                x = self.column('x')
+                y = self.column('y')
+                mask &= (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+            eids = numpy.flatnonzero(mask).tolist()
+        else:
+            eids = []
+            for eid in range(len(self._refs)):
+                if self.screen[eid] != sid or self.flags[eid] & flags != flags:
+                    continue
+                if kind is not None and self.kind[eid] != kind:
+                    continue
+                if box and not (box[0] <= self.x[eid] <= box[2] and box[1] <= self.y[eid] <= box[3]):
+                    continue
+                eids.append(eid)
+        things = [self.thing(eid) for eid in eids]
+        return [t for t in things if t is not None]
+
+ENTITIES = EntityStore()
+
+# Thing properties backed by the store
+
+def stored_int (col,name):
+    def get (self):
+        v = col[self._eid]
+        if v == NO_VALUE:
+            raise AttributeError(name)
+        return v
+    def set (self,v):
+        col[self._eid] = v
+    return property(get,set)
+
+# a coordinate; moving a thing also moves it in its screen's
+# spatial index
+def stored_coord (col,name):
+    def get (self):
+        v = col[self._eid]
+        if v == NO_VALUE:
+            raise AttributeError(name)
+        return v
+    def set (self,v):
+        scr = self._indexed_by
+        if scr is None:
+            col[self._eid] = v
+        else:
+            scr.unindex(self)
+            col[self._eid] = v
+            scr.index(self)
+    return property(get,set)
+
+def stored_flag (bit):
+    flags = ENTITIES.flags
+    def get (self):
+        return bool(flags[self._eid] & bit)
+    def set (self,v):
+        if v:
+            flags[self._eid] |= bit
+        else:
+            flags[self._eid] &= ~bit
+    return property(get,set)
+
+def stored_facing ():
+    col = ENTITIES.facing
+    def get (self):
+        i = col[self._eid]
+        if i < 0:
+            raise AttributeError('_facing')
+        return FACINGS[i]
+    def set (self,v):
+        col[self._eid] = FACING_INDEX[v]
+    return property(get,set)
+
+
 # A thing is something that can be interacted with and by default
 # is not moveable or walkable over
 #
@@ -99,7 +373,26 @@ class Root (object):
 # assign it a specific sprite (see the OlinStatue below).
 # 
 class Thing (Root):
+    # no __dict__: what a thing holds is listed here and in the
+    # __slots__ of its subclass (see pure_state)
+    __slots__ = ('_eid','_indexed_by','_seq','_uid','_name','_description',
+                 '_sprite','_screen','_freq','_group','__weakref__')
+    _uids = itertools.count()   # stable ids, see Screen.snapshot
+    _kind = EntityStore.THING
+
+    # kept in ENTITIES, see EntityStore
+    _x = stored_coord(ENTITIES.x,'_x')
+    _y = stored_coord(ENTITIES.y,'_y')
+    _walkable = stored_flag(EntityStore.WALKABLE)
+    _takable = stored_flag(EntityStore.TAKABLE)
+    _flammable = stored_flag(EntityStore.FLAMMABLE)
+    _burnt = stored_flag(EntityStore.BURNT)
+    _facing = stored_facing()
+    _health = stored_int(ENTITIES.health,'_health')
+
     def __init__ (self,name,desc):
+        self.new_entity()
+        self._uid = next(Thing._uids)
         self._name = name
         self._description = desc
         self._walkable = False
@@ -107,11 +400,30 @@ class Thing (Root):
         self._flammable = False
         self._burnt = False
         self._sprite = Text(Point(TILE_SIZE/2,TILE_SIZE/2),"?")
-        log("Thing.__init__ for "+str(self))
+        log('Thing.__init__ for %s',self)
 
     def __str__ (self):
         return "<"+self.name()+">"
 
+    # give this thing a (fresh) slot in the entity store
+    def new_entity (self):
+        self._eid = ENTITIES.new(self,self._kind)
+        self._indexed_by = None     # Screen whose spatial index lists it
+        self._seq = 0               # when it was added to that screen
+        self._group = None          # see EventBus.join
+
+    # the image file showing this thing in its current state
+    # (None if its sprite isn't an image)
+    def sprite_file (self):
+        return None
+
+    # a fresh, undrawn sprite for this thing's current state
+    def new_sprite (self):
+        pic = 'sprites/ash.gif' if self._burnt else self.sprite_file()
+        if pic is None:
+            return Text(Point(TILE_SIZE/2,TILE_SIZE/2),"?")
+        return sprite_image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+
     def raise_sprite (self):
         self._sprite.canvas.tag_raise(self._sprite.id)
 
@@ -155,31 +467,23 @@ class Thing (Root):
         ty = self._y + dy
 
         # Am I facing a Thing?
-        for thing in self._screen._things:
-            if (thing.position() == (tx,ty)):
-                return thing
-
-        return False
+        return self._screen.thing_at(tx,ty)
 
     def on_object (self):
         # Am I on a Thing?
-        for thing in self._screen._things:
-            if (thing.position() == (self._x,self._y)):
-                return thing
-
-        return False
+        return self._screen.thing_at(self._x,self._y)
 
     # creating a thing does not put it in play -- you have to 
     # call materialize, passing in the screen and the position
     # where you want it to appear
     def materialize (self,screen,x,y,cx=-1,cy=-1):
+        self._screen = screen
+        self._x = x
+        self._y = y
         if (cx != -1) and (cy != -1):
             screen.add(self,x,y,cx,cy)
         else:
             screen.add(self,x,y)
-        self._screen = screen
-        self._x = x
-        self._y = y
 
         if self.is_player():
             # display health indicator
@@ -200,10 +504,13 @@ class Thing (Root):
         # llama stuff...
         
 
+        # Fire spreads from things that were flammable (see FireSpread)
+        spreads = self._flammable and self._screen._fire
+
         # Change sprite to ash pile
         pic = 'sprites/ash.gif'
         self._sprite.undraw()
-        self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+        self._sprite = sprite_image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
         p = self._screen._player
         self._sprite.move((self._x-(p._x-(VIEWPORT_WIDTH-1)/2))*TILE_SIZE,
                            (self._y-(p._y-(VIEWPORT_HEIGHT-1)/2))*TILE_SIZE)
@@ -217,6 +524,10 @@ class Thing (Root):
         self._name = "{}'s ashes".format(self._name)
         self._description = 'what used to be {}'.format(self._description)
 
+        if spreads:
+            self._screen._fire.ignite(self._x,self._y)
+        self._screen.changed(self._x,self._y)
+
         # Pull player sprite to top
         p.raise_sprite()
         
@@ -238,7 +549,90 @@ class Thing (Root):
     def is_barricade_door (self):
         return False
 
+#
+# Collisions
+#
+# What a projectile does when it meets something is looked up in a
+# table rather than spelled out in code. Tiles have category bits
+# by tile value (Level._bits) and things by kind and flags
+# (THING_BITS); a projectile looks at the tile ahead of it and the
+# tile it's on, each together with the first thing there.
+#
+# A kind of projectile declares its rules, in order, as
+#
+#   (where, has, lacks, action, why)
+#
+# meaning: if the tile `where` ('ahead' or 'here') has all the
+# `has` bits and none of the `lacks` bits, do `action`:
+#
+#   PASS       fly on
+#   STOP       stop
+#   BURN       stop and burn the thing here
+#   DAMAGE     stop and hit the thing here
+#   BURN_TILE  stop and burn the tile here
+#
+# The first rule that matches wins. A projectile that stops for
+# any other reason (border, range) still does what its 'here'
+# rules say, or nothing if that is PASS. collision_table() turns
+# the rules into one lookup table per target, indexed by bits.
+#
+
+# category bits of tiles...
+TILE_SOLID = 1      # can't be walked through
+TILE_FUEL = 2       # burns
+# ... and of things
+BLOCKS = 4          # can't be walked through
+FUEL = 8            # burns
+LLAMA = 16          # a live llama
+PLAYER = 32
+ASH = 64            # burnt
+CATEGORY_BITS = 7
+
+PASS, STOP, BURN, DAMAGE, BURN_TILE = range(5)
+
+def tile_bits (tile):
+    bits = 0
+    if tile in lvl.UNWALKABLES:
+        bits |= TILE_SOLID
+    if tile in lvl.FLAMMABLES:
+        bits |= TILE_FUEL
+    return bits
+
+def thing_bits (kind,flags):
+    bits = 0
+    if not flags & EntityStore.WALKABLE:
+        bits |= BLOCKS
+    if flags & EntityStore.FLAMMABLE:
+        bits |= FUEL
+    if flags & EntityStore.BURNT:
+        bits |= ASH
+    elif kind == EntityStore.LLAMA:
+        bits |= LLAMA
+    if kind == EntityStore.PLAYER:
+        bits |= PLAYER
+    return bits
+
+# category bits of a thing, indexed by (kind << 4) | flags in ENTITIES
+THING_BITS = [thing_bits(i >> 4, i & 15) for i in range(64)]
+
+# returns (ahead, here): lists of (action, why) indexed by bits
+def collision_table (rules):
+    def match (where,bits):
+        for w,has,lacks,action,why in rules:
+            if w == where and bits & has == has and not bits & lacks:
+                return (action,why)
+        return (PASS,None)
+    size = 1 << CATEGORY_BITS
+    return ([match('ahead',bits) for bits in range(size)],
+            [match('here',bits) for bits in range(size)])
+
+
 class Projectile (Thing):
+    __slots__ = ('_dx','_dy','_range','_power','_due','_launch','_impact','_reason','_watched')
+    _kind = EntityStore.PROJECTILE
+    _collisions = collision_table([])   # see "Collisions" above
+    _raise_player = True    # pull the player's sprite above it when moving
+
     def __init__ (self, facing, mrange, power):
         Thing.__init__(self,'Projectile','A projectile')
         self._facing = facing
@@ -246,11 +640,17 @@ class Projectile (Thing):
         self._range = mrange
         self._power = power
         self._walkable = True
+        self.reset_flight()
 
-
+    def register (self,q,freq):
+        self._due = q.tick() + freq     # when the next event is for real
+        return Thing.register(self,q,freq)
 
     def event (self,q):
-        log("event for "+str(self))
+        log('event for %s',self)
+        if ANALYTIC_PROJECTILES:
+            self.fly(q)
+            return
         if self._range > 0:
             self._range -= 1
             done = self.move_or_stop()
@@ -258,74 +658,87 @@ class Projectile (Thing):
                 # Re-register event with same frequency
                 self.register(q,self._freq)
         else:
-            log(str(self)+' stopping at max range')
+            log('%s stopping at max range',self)
             self.stop()
 
+    # make a pooled projectile as good as new (see ProjectilePool)
+    def reset (self,mrange):
+        self._uid = next(Thing._uids)
+        self._range = mrange
+        self.reset_flight()
+
+    # hand the projectile back to the pool instead of throwing it away
+    def dematerialize (self):
+        self._screen._projectiles.release(self)
+        return self
+
     def stop (self):
-        # Just stops projectile and undraws it
-        # If it needs to do more, overwrite this in a subclass
-        # print 'stopping'
+        # Do whatever the collision rules say to the tile we're on,
+        # then vanish
         self._range = 0
+        o_obj = self.on_object()
+        action,why = self._collisions[1][self.bits_at(self._x,self._y,o_obj)]
+        if action == BURN:
+            o_obj.burn()
+        elif action == DAMAGE:
+            o_obj.hit(self._power)
+        elif action == BURN_TILE:
+            self._screen.set_fire(self._x,self._y)
+
+        # Dematerialize projectile
         self.dematerialize()
         self._screen._window.update()
 
-    def move_or_stop (self):
-        def stop_now():
-            self.stop()
-            return True
-
-        # Reached the border?
-        if self._x == 0 and self._dx == -1:
-            log(str(self)+' stopping at left border')
-            return stop_now()        
-        if self._x == LEVEL_WIDTH-1 and self._dx == 1:
-            log(str(self)+' stopping at right border')
-            return stop_now()
-        if self._y == 0 and self._dy == -1:
-            log(str(self)+' stopping at top border')
-            return stop_now()
-        if self._y == LEVEL_HEIGHT-1 and self._dy == 1:
-            log(str(self)+' stopping at bottom border')
-            return stop_now()
-
-        # Reached an unwalkable and unflammable tile?
-        f_tile = self._screen._level._pos(self._x+self._dx,self._y+self._dy)
-        tile_val = self._screen._level._map[f_tile]
-        if tile_val in lvl.UNWALKABLES and tile_val not in lvl.FLAMMABLES:
-            log(str(self)+' stopping at unwalkable, unflammable tile')
-            return stop_now()
-
-        # On a flammable tile?
-        o_tile = self._screen._level._pos(self._x, self._y)
-        if self._screen._level._map[o_tile] in lvl.FLAMMABLES:
-            log(str(self)+' stopping on flammable tile')
-            return stop_now()
-
-        # Reached an unwalkable, unflammable, nonLlama Thing?
-        f_obj = self.facing_object()
-        if f_obj and not f_obj.is_walkable() and not f_obj.is_flammable() and not f_obj.is_llama():
-            log(str(self)+' stopping at unwalkable, unflammable Thing')
-            return stop_now()
+    # the thing on_object() would find if the projectile were at (x,y)
+    def object_at (self,x,y):
+        if (x,y) == (self._x,self._y):
+            return self.on_object()
+        at = self._screen.things_at(x,y)
+        if at and at[0]._seq < self._seq:
+            return at[0]
+        return self
 
-        # On an alive Llama?
-        o_obj = self.on_object()
-        if o_obj and o_obj.is_llama() and not o_obj.is_burnt():
-            log(str(self)+' stopping on Llama')
-            return stop_now()
+    # the category bits of tile (x,y) with thing on it
+    def bits_at (self,x,y,thing):
+        level = self._screen._level
+        bits = level._bits[x + y*level._width]
+        if thing:
+            eid = thing._eid
+            bits |= THING_BITS[(ENTITIES.kind[eid] << 4) | ENTITIES.flags[eid]]
+        return bits
 
-        # On a flammable Thing?
-        if o_obj and o_obj.is_flammable():
-            log(str(self)+' stopping on flammable Thing')
-            return stop_now()
+    # why the projectile would stop at (x,y) rather than fly on
+    # (None if it wouldn't)
+    def stop_reason (self,x,y):
+        # Reached the border?
+        nx,ny = x+self._dx,y+self._dy
+        level = self._screen._level
+        if not (0 <= nx < level._width and 0 <= ny < level._height):
+            return 'at border'
+
+        ahead,here = self._collisions
+        action,why = ahead[self.bits_at(nx,ny,self._screen.thing_at(nx,ny))]
+        if action:
+            return why
+        action,why = here[self.bits_at(x,y,self.object_at(x,y))]
+        if action:
+            return why
+        return None
 
+    def move_or_stop (self):
+        reason = self.stop_reason(self._x,self._y)
+        if reason:
+            log('%s stopping %s',self,reason)
+            self.stop()
+            return True
 
         # Else, move
-        log(str(self)+' moving')
+        log('%s moving',self)
         self._x = self._x + self._dx
         self._y = self._y + self._dy
         
         # Shift sprite
-        self.shift(self._dx*TILE_SIZE,self._dy*TILE_SIZE)
+        self.shift(self._dx*TILE_SIZE,self._dy*TILE_SIZE,self._raise_player)
         
         # Update window so changes are visible
         self._screen._window.update()
@@ -333,169 +746,307 @@ class Projectile (Thing):
         # Not done moving yet
         return False
 
+    #
+    # Analytic flight (if ANALYTIC_PROJECTILES is set)
+    #
+    # Instead of waking up every _freq ticks to look around and take
+    # one step, the projectile works out at launch where it's going
+    # to stop, using stop_reason() on every tile of its straight
+    # path, and only wakes up again for the impact. Until then it
+    # stays at its launch tile as far as the game is concerned; its
+    # sprite is moved along by ProjectilePool.tween() for display.
+    #
+    # The screen tells it when something moves onto, off or burns
+    # on one of the tiles it's watching (see Screen.changed), and it
+    # plans again from wherever it would be by now. Other projectiles
+    # in flight are taken to be where they were launched. A
+    # superseded impact event is recognized by not being at _due.
+    #
+
+    def reset_flight (self):
+        self._launch = None     # tick of the first event
+        self._impact = 0        # the event that will stop it (1 = first)
+        self._reason = None
+        self._watched = []
+        self._due = None
+
+    def fly (self,q):
+        if q.tick() != self._due:
+            return
+        if self._launch is None:
+            self._launch = q.tick()
+            self._screen._projectiles.launched(self)
+            self.plan(True)
+        else:
+            self.land()
+
+    # the tile the projectile is on right before event j
+    def step_tile (self,j):
+        return (self._x+(j-1)*self._dx, self._y+(j-1)*self._dy)
+
+    # the first event that hasn't happened by now
+    def next_event (self):
+        passed = self._screen._q.tick() - self._launch
+        return 1 + max(0, -(-passed // self._freq))
+
+    def plan (self,launching=False):
+        q = self._screen._q
+        j = self.next_event()
+        k = j
+        x,y = self.step_tile(k)
+        while k <= self._range:
+            reason = self.stop_reason(x,y)
+            if reason:
+                break
+            k += 1
+            x,y = x+self._dx, y+self._dy
+        else:
+            reason = 'at max range'
+        self._impact = k
+        self._reason = reason
+        self.watch_path()
+
+        due = self._launch + (k-1)*self._freq
+        if due == q.tick() and launching:
+            # stopping right where it was launched
+            self._due = due
+            self.land()
+        elif due != self._due:
+            self._due = due
+            q.enqueue(due-q.tick(),self)
+
+    # have the screen tell us about changes on the rest of the path
+    def watch_path (self):
+        j = self.next_event()
+        cells = [self.step_tile(i) for i in range(j,self._impact+2)]
+        level = self._screen._level
+        self._screen.watch(self,[(x,y) for (x,y) in cells
+                                 if 0 <= x < level._width and 0 <= y < level._height])
+
+    def replan (self):
+        self._screen.unwatch(self)
+        self.plan()
+
+    def land (self):
+        self._due = None
+        self._screen.unwatch(self)
+        steps = self._impact-1
+        self._screen._projectiles.landed(self,steps)
+        self._x = self._x + steps*self._dx
+        self._y = self._y + steps*self._dy
+        log('%s stopping %s',self,self._reason)
+        self.stop()
+
 
 class Fireball (Projectile):
+    __slots__ = ()
+    _collisions = collision_table([
+        ('ahead', TILE_SOLID, TILE_FUEL,  STOP,      'at unwalkable, unflammable tile'),
+        ('ahead', BLOCKS,     FUEL|LLAMA, STOP,      'at unwalkable, unflammable Thing'),
+        ('here',  ASH|TILE_FUEL, 0,       STOP,      'on flammable tile'),
+        ('here',  FUEL,       0,          BURN,      'on flammable Thing'),
+        ('here',  LLAMA,      0,          DAMAGE,    'on Llama'),
+        ('here',  TILE_FUEL,  0,          BURN_TILE, 'on flammable tile'),
+    ])
+    _POWER_IMGS = [{'Left': 'sprites/W_fireball.gif','Right': 'sprites/E_fireball.gif','Up' : 'sprites/N_fireball.gif','Down' : 'sprites/S_fireball.gif'},
+        {'Left': 'sprites/W_big_fireball.gif','Right': 'sprites/E_big_fireball.gif','Up' : 'sprites/N_big_fireball.gif','Down' : 'sprites/S_big_fireball.gif'}
+    ]
+
     def __init__ (self, facing, mrange, power):
         Projectile.__init__(self, facing, mrange, power)
-        imgs = [{'Left': 'sprites/W_fireball.gif','Right': 'sprites/E_fireball.gif','Up' : 'sprites/N_fireball.gif','Down' : 'sprites/S_fireball.gif'},
-            {'Left': 'sprites/W_big_fireball.gif','Right': 'sprites/E_big_fireball.gif','Up' : 'sprites/N_big_fireball.gif','Down' : 'sprites/S_big_fireball.gif'}
-        ]
-        self._DIR_IMGS = imgs[power]
         self._facing = facing
-        pic = self._DIR_IMGS[self._facing]
-        self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
-
-
-    def stop (self):
-        # Burn the thing if possible
-        # print 'stopping'
-        self._range = 0
-        o_obj = self.on_object()
-        o_tile = self._screen.tile(self._x,self._y)
-        if not o_obj.is_burnt():
-            if o_obj and o_obj.is_flammable():
-                o_obj.burn()
-            elif o_obj and o_obj.is_llama():
-                o_obj.hit(self._power)
-            elif o_tile in lvl.FLAMMABLES:
-                elt = self._screen.tile_object(self._x,self._y)
-                elt.undraw()
-                pic = 'sprites/ash.gif'
-                elt = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
-                elt.move((self._x-(self._screen._player._x-(VIEWPORT_WIDTH-1)/2))*TILE_SIZE,
-                         (self._y-(self._screen._player._y-(VIEWPORT_HEIGHT-1)/2))*TILE_SIZE)
-                elt.draw(self._screen._window)
-
-                tile_pos = self._screen._level._pos(self._x,self._y)
-                self._screen._level._map[tile_pos] = 0000
-                self._screen._map_elts[tile_pos] = elt
+        self._sprite = self.new_sprite()
 
-                self._screen._player.raise_sprite()
-
-        # Dematerialize projectile
-        self.dematerialize()
-        self._screen._window.update()   
+    def sprite_file (self):
+        return self._POWER_IMGS[self._power][self._facing]
 
 class Spitball (Projectile):
+    __slots__ = ()
+    _raise_player = False
+    _collisions = collision_table([
+        ('ahead', TILE_SOLID, 0,      STOP,   'at unwalkable tile'),
+        ('ahead', BLOCKS,     PLAYER, STOP,   'at unwalkable, nonPlayer Thing'),
+        ('here',  PLAYER,     0,      DAMAGE, 'on Player'),
+    ])
+    _POWER_IMGS = [{'Left': 'sprites/W_spit.gif','Right': 'sprites/E_spit.gif','Up' : 'sprites/N_spit.gif','Down' : 'sprites/S_spit.gif'},
+        {'Left': 'sprites/W_spit.gif','Right': 'sprites/E_spit.gif','Up' : 'sprites/N_spit.gif','Down' : 'sprites/S_spit.gif'}
+    ]
+
     def __init__ (self, facing, mrange, power):
         Projectile.__init__(self, facing, mrange, power)
-        imgs = [{'Left': 'sprites/W_spit.gif','Right': 'sprites/E_spit.gif','Up' : 'sprites/N_spit.gif','Down' : 'sprites/S_spit.gif'},
-            {'Left': 'sprites/W_spit.gif','Right': 'sprites/E_spit.gif','Up' : 'sprites/N_spit.gif','Down' : 'sprites/S_spit.gif'}
-        ]
-        self._DIR_IMGS = imgs[power]
         self._facing = facing
-        pic = self._DIR_IMGS[self._facing]
-        self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
-
+        self._sprite = self.new_sprite()
 
-    def move_or_stop (self):
-        def stop_now():
-            self.stop()
-            return True
-
-        # Reached the border?
-        if self._x == 0 and self._dx == -1:
-            log(str(self)+' stopping at left border')
-            return stop_now()        
-        if self._x == LEVEL_WIDTH-1 and self._dx == 1:
-            log(str(self)+' stopping at right border')
-            return stop_now()
-        if self._y == 0 and self._dy == -1:
-            log(str(self)+' stopping at top border')
-            return stop_now()
-        if self._y == LEVEL_HEIGHT-1 and self._dy == 1:
-            log(str(self)+' stopping at bottom border')
-            return stop_now()
-
-        # Reached an unwalkable tile?
-        f_tile = self._screen._level._pos(self._x+self._dx,self._y+self._dy)
-        tile_val = self._screen._level._map[f_tile]
-        if tile_val in lvl.UNWALKABLES:
-            log(str(self)+' stopping at unwalkable tile')
-            return stop_now()
-
-        # Reached an unwalkable and nonPlayer Thing?
-        f_obj = self.facing_object()
-        if f_obj and not f_obj.is_walkable() and not f_obj.is_player():
-            log(str(self)+' stopping at unwalkable, nonPlayer Thing')
-            return stop_now()
+    def sprite_file (self):
+        return self._POWER_IMGS[self._power][self._facing]
 
-        # On Player?
-        o_obj = self.on_object()
-        if o_obj and o_obj.is_player():
-            log(str(self)+' stopping on Player')
-            return stop_now()
-
-
-        # Else, move
-        log(str(self)+' moving')
-        self._x = self._x + self._dx
-        self._y = self._y + self._dy
-        
-        # Shift sprite
-        self.shift(self._dx*TILE_SIZE,self._dy*TILE_SIZE,False)
-        
-        # Update window so changes are visible
+#
+# Projectiles live for a few ticks, and building one means a new
+# object, a placeholder Text and an Image read from a GIF file. A
+# ProjectilePool keeps stopped projectiles around with their
+# sprites still on the canvas, just hidden, and hands them out
+# again for the next shot of the same kind, facing and power (so
+# the sprite already shows the right picture).
+#
+#   pool.acquire(Fireball,facing,range,power)
+#
+# returns a projectile ready to be registered and materialized;
+# dematerialize() puts it back.
+#
+class ProjectilePool (object):
+    def __init__ (self,screen):
+        self._screen = screen
+        self._idle = {}         # (class,facing,power) -> stopped projectiles
+        self._flying = {}       # analytic flights -> steps shown by tween()
+        self.created = 0
+        self.reused = 0
+        self.in_flight = 0
+        self.peak = 0
+
+    def acquire (self,cls,facing,mrange,power):
+        idle = self._idle.get((cls,facing,power))
+        if idle:
+            p = idle.pop()
+            p.reset(mrange)
+            self.reused += 1
+        else:
+            p = cls(facing,mrange,power)
+            self.created += 1
+        self.in_flight += 1
+        self.peak = max(self.peak,self.in_flight)
+        return p
+
+    def release (self,p):
+        self._screen.hide(p)
+        self._idle.setdefault((type(p),p._facing,p._power),[]).append(p)
+        self.in_flight -= 1
+
+    # Analytic flights: the sprite of a flying projectile is moved
+    # along its path by tween(), which the game loop calls once a
+    # tick. (Headless runs don't bother.)
+
+    def launched (self,p):
+        self._flying[p] = 0
+
+    # p lands after `steps` steps: catch its sprite up with it
+    def landed (self,p,steps):
+        shown = self._flying.pop(p,0)
+        p.sprite().move((steps-shown)*p._dx*TILE_SIZE,(steps-shown)*p._dy*TILE_SIZE)
+
+    def tween (self):
+        if not self._flying:
+            return
+        last = self._screen._q.tick() - 1     # the tick that just ran
+        px = self._screen._player._x
+        for p,shown in self._flying.items():
+            steps = min(p._impact-1,(last-p._launch) // p._freq + 1)
+            if steps != shown:
+                self._flying[p] = steps
+                p.sprite().move((steps-shown)*p._dx*TILE_SIZE,(steps-shown)*p._dy*TILE_SIZE)
+                if p._x+steps*p._dx - px > (VIEWPORT_WIDTH-1)/2:
+                    p.lower_sprite()
+                else:
+                    p.raise_sprite()
         self._screen._window.update()
 
-        # Not done moving yet
-        return False
+    # put flying sprites back on their projectiles' tiles (before a restore)
+    def settle (self):
+        for p,shown in self._flying.items():
+            p.sprite().move(-shown*p._dx*TILE_SIZE,-shown*p._dy*TILE_SIZE)
+
+    # pick up the projectiles of a restored screen
+    def restored (self):
+        projectiles = [t for t in self._screen._things if isinstance(t,Projectile)]
+        self.in_flight = len(projectiles)
+        self._flying = {}
+        for p in projectiles:
+            p._watched = []
+            if p._launch is not None:
+                self._flying[p] = 0
+                p.watch_path()
+
+    def stats (self):
+        return {
+            'created': self.created,
+            'reused': self.reused,
+            'in_flight': self.in_flight,
+            'idle': sum(len(idle) for idle in self._idle.values()),
+            'peak': self.peak,
+        }
 
-    def stop (self):
-        # Hit the player if possible
-        self._range = 0
-        o_obj = self.on_object()
-        o_tile = self._screen.tile(self._x,self._y)
-        if o_obj and o_obj.is_player():
-            o_obj.hit(self._power)
-        
-        # Dematerialize projectile
-        self.dematerialize()
-        self._screen._window.update() 
 
 class Door (Thing):
+    __slots__ = ()
+
     def __init__ (self,description):
         Thing.__init__(self,'Door',description)
-        pic = 'sprites/V_door.gif'
-        self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+        self._sprite = self.new_sprite()
         self._flammable = True
 
+    def sprite_file (self):
+        return 'sprites/V_door.gif'
+
 class BarricadeDoor(Thing):
+    __slots__ = ()
+
     def __init__ (self,description):
         Thing.__init__(self,"Barricade Door",description)
-        pic = 'sprites/V_barricade.gif'
-        self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+        self._sprite = self.new_sprite()
+
+    def sprite_file (self):
+        return 'sprites/V_barricade.gif'
 
     def is_barricade_door (self):
         return True
 
 class Pizza (Thing):
+    __slots__ = ()
+
     def __init__ (self,description):
         Thing.__init__(self,"Pizza Slice",description)
-        pic = 'sprites/bigger_pizza.gif'
-        self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+        self._sprite = self.new_sprite()
+
+    def sprite_file (self):
+        return 'sprites/bigger_pizza.gif'
 
     def is_pizza (self):
         return True
 
 class Vortex (Thing):
-    def __init__ (self):
+    __slots__ = ('_state','_to')
+    _IMGS = {
+        0: 'sprites/1_vortex.gif',
+        1: 'sprites/2_vortex.gif',
+        2: 'sprites/3_vortex.gif',
+        3: 'sprites/4_vortex.gif'
+    }
+
+    # (to is the number of the level it leads to, by default the next)
+    def __init__ (self,to=None):
         Thing.__init__(self,"Vortex",'Where does it lead?')
-        self._IMGS = {
-            0: 'sprites/1_vortex.gif',
-            1: 'sprites/2_vortex.gif',
-            2: 'sprites/3_vortex.gif',
-            3: 'sprites/4_vortex.gif'
-        }
         self._state = 0;
-        pic = self._IMGS[0]
-        self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+        self._to = to
+        self._sprite = self.new_sprite()
+
+    def sprite_file (self):
+        return self._IMGS[self._state]
 
     def is_vortex (self):
         return True
 
+    def leads_to (self):
+        if self._to is None:
+            return self._screen._level._num + 1
+        return self._to
+
+    # (so the level it leads to can start loading)
+    def materialize (self,screen,x,y,cx=-1,cy=-1):
+        Thing.materialize(self,screen,x,y,cx,cy)
+        screen._bus.publish('vortex-opened',self)
+        return self
+
     def event (self,q):
-        log("event for "+str(self))
+        log('event for %s',self)
 
         # cycle amongst the 4 states
         self._state = (self._state+1) % 4
@@ -503,8 +1054,7 @@ class Vortex (Thing):
         # draw new state
         p = self._screen._player
         self._sprite.undraw()
-        pic = self._IMGS[self._state]
-        self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+        self._sprite = self.new_sprite()
         self._sprite.move((self._x-(p._x-(VIEWPORT_WIDTH-1)/2))*TILE_SIZE,
                            (self._y-(p._y-(VIEWPORT_HEIGHT-1)/2))*TILE_SIZE)
         self._sprite.draw(self._screen._window)
@@ -522,10 +1072,14 @@ class Vortex (Thing):
 # (here, a rather boring gray rectangle.)
 #
 class Felix (Thing):
+    __slots__ = ()
+
     def __init__ (self,description):
         Thing.__init__(self,"Felix",description)
-        pic = 'sprites/other_felix.gif'
-        self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+        self._sprite = self.new_sprite()
+
+    def sprite_file (self):
+        return 'sprites/other_felix.gif'
 
 
 #
@@ -533,9 +1087,11 @@ class Felix (Thing):
 # about possibly proactively
 #
 class Character (Thing):
+    __slots__ = ()
+
     def __init__ (self,name,desc):
         Thing.__init__(self,name,desc)
-        log("Character.__init__ for "+str(self))
+        log('Character.__init__ for %s',self)
         self._walkable = False
         rect = Rectangle(Point(1,1),
                          Point(TILE_SIZE-1,TILE_SIZE-1))
@@ -543,6 +1099,15 @@ class Character (Thing):
         rect.setOutline("red")
         self._sprite = rect
 
+    def new_sprite (self):
+        if self._burnt or self.sprite_file():
+            return Thing.new_sprite(self)
+        rect = Rectangle(Point(1,1),
+                         Point(TILE_SIZE-1,TILE_SIZE-1))
+        rect.setFill("red")
+        rect.setOutline("red")
+        return rect
+
     def turn (self,dx,dy):
         return False
 
@@ -560,7 +1125,8 @@ class Character (Thing):
             return
 
         # Trying to go out of bounds?
-        if not (tx >= 0 and ty >= 0 and tx < LEVEL_WIDTH and ty < LEVEL_HEIGHT):
+        level = self._screen._level
+        if not (tx >= 0 and ty >= 0 and tx < level._width and ty < level._height):
             return
 
         # Trying to walk through an unwalkable tile?
@@ -569,8 +1135,8 @@ class Character (Thing):
             return
 
         # Trying to walk through a Thing that is unwalkable?
-        for thing in self._screen._things:
-            if (thing.position() == (tx,ty)) and (not thing.is_walkable()):
+        for thing in self._screen.things_at(tx,ty):
+            if not thing.is_walkable():
                 return
 
         # Update character location
@@ -587,10 +1153,19 @@ class Character (Thing):
         return True
 
 class Llama (Character):
+    __slots__ = ('_ax','_ay','_intelligence','_fb_range','_fb_speed','_wander_range','_herd')
+    _DIR_IMGS = {
+        'Left': 'sprites/W_llama.gif',
+        'Right': 'sprites/E_llama.gif',
+        'Up' : 'sprites/N_llama.gif',
+        'Down' : 'sprites/S_llama.gif'
+    }
+    _kind = EntityStore.LLAMA
+
     def __init__ (self,facing,intelligence,health,ax,ay):
         words = {0: 'dumb', 1: 'average', 2: 'smart'}
         Character.__init__(self,'Llama','a {} llama'.format(words[intelligence]))
-        log("Llama.__init__ for "+str(self))
+        log('Llama.__init__ for %s',self)
         self._ax = ax; # Anchor locations
         self._ay = ay;
         self._health = health # Stats
@@ -598,64 +1173,77 @@ class Llama (Character):
         self._fb_range = 2
         self._fb_speed = 15
         self._wander_range = 7
-        self._DIR_IMGS = {
-            'Left': 'sprites/W_llama.gif',
-            'Right': 'sprites/E_llama.gif',
-            'Up' : 'sprites/N_llama.gif',
-            'Down' : 'sprites/S_llama.gif'
-        }
         self._facing = facing
-        pic = self._DIR_IMGS[self._facing]
-        self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+        self._sprite = self.new_sprite()
 
+    def new_entity (self):
+        Character.new_entity(self)
+        self._herd = None   # LlamaHerd doing this llama's thinking, if any
+
+    def sprite_file (self):
+        return self._DIR_IMGS[self._facing]
 
     def is_llama (self):
         return True
 
     def hit (self, power):
-        log(str(self)+' gets hit for '+str(power+1))   
+        log('%s gets hit for %d',self,power+1)
         self._health -= (power + 1)
 
         if self._health <= 0:
             self._screen.ded_llamas.append(self)
             self.burn()
-            if set(self._screen.initial_llamas) == set(self._screen.ded_llamas):
-                for thing in self._screen._things:
-                    if thing.is_barricade_door():
-                        thing.dematerialize()
+            if self._herd:
+                self._herd.died(self)
+            self._screen._bus.publish('entity-died',self)
 
     def event (self,q):
-        log("event for "+str(self))
+        log('event for %s',self)
 
         if not self.is_burnt():
-            if self._intelligence == 0:
-                # If dumb llama: stand in place, spit if player 
-                # is in front of you and within range.
-                if random.randrange(4) == 0:
-                    self.face_player()
-                elif random.randrange(3) == 0:
-                    self.shoot_at_player()
-            elif self._intelligence == 1:
-                # If average llama: move randomly within range, 
-                # spit if player is in front of you and within range.
-                if random.randrange(3) == 0:
-                    dx,dy = random.choice(MOVE.values())
-                    if abs(self._x+dx-self._ax) < self._wander_range and abs(self._y+dy-self._ay) < self._wander_range:
-                        # If still within wander range, move
-                        self.move(dx,dy)
-                elif random.randrange(3) == 0:
-                    self.shoot_at_player()
-            elif self._intelligence == 2:
-                # If smart llama: move towards player if they get 
-                # within <x> tiles of you, spit if player is in 
-                #front of you and within range.
-                if random.randrange(3) == 0:
-                    self.move_towards_player()
-                elif random.randrange(2) == 0:
-                    self.shoot_at_player()
-
-            # Re-register event with same frequency if not a pile of ashes
-            self.register(q,self._freq)
+            # Far away from the player? Let the LOD scheduler decide
+            # how soon (if at all) this llama thinks again
+            delay = self._freq
+            lod = self._screen._lod
+            if lod:
+                delay = lod.delay(self)
+                if delay is None:
+                    # Dormant -- the scheduler wakes it up later
+                    return
+
+            self.think()
+
+            # Re-register event if not a pile of ashes
+            q.enqueue(delay,self)
+
+    # one round of AI decisions (see LlamaHerd for the batched version)
+    def think (self):
+        rng = self._screen.rng('llama')
+        if self._intelligence == 0:
+            # If dumb llama: stand in place, spit if player 
+            # is in front of you and within range.
+            if rng.randrange(4) == 0:
+                self.face_player()
+            elif rng.randrange(3) == 0:
+                self.shoot_at_player()
+        elif self._intelligence == 1:
+            # If average llama: move randomly within range, 
+            # spit if player is in front of you and within range.
+            if rng.randrange(3) == 0:
+                dx,dy = rng.choice(STEPS)
+                if abs(self._x+dx-self._ax) < self._wander_range and abs(self._y+dy-self._ay) < self._wander_range:
+                    # If still within wander range, move
+                    self.move(dx,dy)
+            elif rng.randrange(3) == 0:
+                self.shoot_at_player()
+        elif self._intelligence == 2:
+            # If smart llama: move towards player if they get 
+            # within <x> tiles of you, spit if player is in 
+            #front of you and within range.
+            if rng.randrange(3) == 0:
+                self.move_towards_player()
+            elif rng.randrange(2) == 0:
+                self.shoot_at_player()
 
     def turn (self,dx,dy):
         fdx,fdy = MOVE[self._facing]
@@ -665,8 +1253,7 @@ class Llama (Character):
             key = DIRECTIONS[(dx,dy)]
             self._facing = key
             self._sprite.undraw()
-            pic = self._DIR_IMGS[self._facing]
-            self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+            self._sprite = self.new_sprite()
             self._sprite.move((self._x-(p._x-(VIEWPORT_WIDTH-1)/2))*TILE_SIZE,
                                (self._y-(p._y-(VIEWPORT_HEIGHT-1)/2))*TILE_SIZE)
             self._sprite.draw(self._screen._window)
@@ -695,7 +1282,7 @@ class Llama (Character):
             if disty:
                 choices.append((0,sign(disty)))
             if choices:
-                dx,dy = random.choice(choices)
+                dx,dy = self._screen.rng('llama').choice(choices)
                 self.move(dx,dy)
 
 
@@ -722,8 +1309,7 @@ class Llama (Character):
         if self._facing != new_facing:
             self._facing = new_facing
             self._sprite.undraw()
-            pic = self._DIR_IMGS[self._facing]
-            self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+            self._sprite = self.new_sprite()
             self._sprite.move((self._x-(px-(VIEWPORT_WIDTH-1)/2))*TILE_SIZE,
                                (self._y-(py-(VIEWPORT_HEIGHT-1)/2))*TILE_SIZE)
             self._sprite.draw(self._screen._window)
@@ -742,7 +1328,8 @@ class Llama (Character):
         if (abs(px-lx) < self._fb_range+3) and (abs(py-ly) < self._fb_range+3):
             # Am I facing the border?
             dx,dy = MOVE[self._facing]
-            if not (self._x+dx >= 0 and self._x+dx <= LEVEL_WIDTH-1 and self._y+dy >= 0 and self._y+dy <= LEVEL_HEIGHT-1):
+            level = self._screen._level
+            if not (self._x+dx >= 0 and self._x+dx <= level._width-1 and self._y+dy >= 0 and self._y+dy <= level._height-1):
                 return
 
             # Am I facing an unwalkable tile?
@@ -756,27 +1343,303 @@ class Llama (Character):
                 return
 
             # Else, shoot spitball
-            Spitball(
-                self._facing, self._fb_range, 0).register(
+            self._screen._projectiles.acquire(
+                Spitball, self._facing, self._fb_range, 0).register(
                 self._screen._q, self._fb_speed).materialize(
                 self._screen, self._x+dx, self._y+dy, px, py
             )
 
+#
+# Level-of-detail scheduling for llama AI
+#
+# A llama far away from the player can't be seen and can't spit
+# at anyone, so thinking at full speed is wasted work. LlamaLOD
+# sorts llamas into three tiers by their distance to the player:
+#
+#   near    (distance <= near)   AI at the llama's own frequency
+#   far     (distance <= far)    AI at 1/slowdown of that frequency
+#   dormant (anything beyond)    off the event queue entirely
+#
+# Distance is measured to the llama's territory: for average
+# llamas the box of _wander_range around their anchor (_ax,_ay),
+# which they never leave, and for the others their current tile.
+# Dormant llamas don't move, so they're kept in a coarse grid of
+# buckets keyed by territory center. Every few ticks the scheduler
+# only looks at the buckets around the player and wakes whoever
+# is back in range, so the per-tick cost depends on the number of
+# llamas near the player, not the number of llamas in the level.
+#
+class LlamaLOD (object):
+    def __init__ (self,screen,near=(VIEWPORT_WIDTH-1)//2+2,far=None,slowdown=4,cell=8):
+        self._screen = screen
+        self._near = near
+        self._far = far if far is not None else 2*near
+        self._slowdown = slowdown
+        self._cell = cell
+        self._dormant = {}      # bucket -> list of dormant llamas
+        self._num_dormant = 0
+        self._reach = 0         # largest territory radius of a dormant llama
+        self._last = None       # player position at the last wake-up check
+
+    def register (self,q,freq=10):
+        self._freq = freq
+        q.enqueue(freq,self)
+        return self
+
+    def territory (self,llama):
+        if llama._intelligence == 1:
+            r = llama._wander_range
+            return (llama._ax,llama._ay,r)
+        return (llama._x,llama._y,0)
+
+    # Chebyshev distance from the player to the llama's territory
+    def distance (self,llama):
+        p = self._screen._player
+        cx,cy,r = self.territory(llama)
+        return max(abs(p._x-cx),abs(p._y-cy)) - r
+
+    # how long until the llama should think again (None = dormant)
+    def delay (self,llama):
+        d = self.distance(llama)
+        if d > self._far + 2:
+            # a little hysteresis so llamas on the edge don't flap
+            self.sleep(llama)
+            return None
+        if d > self._near:
+            return llama._freq * self._slowdown
+        return llama._freq
+
+    def sleep (self,llama):
+        log('%s goes dormant',llama)
+        cx,cy,r = self.territory(llama)
+        key = (cx // self._cell, cy // self._cell)
+        self._dormant.setdefault(key,[]).append(llama)
+        self._num_dormant += 1
+        self._reach = max(self._reach,r)
+        # force a wake-up check even if the player stands still
+        self._last = None
+
+    def num_dormant (self):
+        return self._num_dormant
+
+    # for Screen.snapshot/restore
+    def snapshot_state (self):
+        return [l._uid for bucket in self._dormant.values() for l in bucket]
+
+    def restore_state (self,state,objs):
+        self._dormant = {}
+        self._num_dormant = 0
+        self._reach = 0
+        for uid in state:
+            self.sleep(objs[uid])
+
+    def wake_near (self,q,px,py):
+        c = self._cell
+        r = self._far + self._reach
+        woken = 0
+        for bx in range((px-r) // c, (px+r) // c + 1):
+            for by in range((py-r) // c, (py+r) // c + 1):
+                bucket = self._dormant.get((bx,by))
+                if not bucket:
+                    continue
+                asleep = []
+                for llama in bucket:
+                    if llama.is_burnt():
+                        self._num_dormant -= 1
+                    elif self.distance(llama) <= self._far:
+                        # stagger wake-ups so they don't all think at once
+                        q.enqueue(1 + woken % llama._freq,llama)
+                        self._num_dormant -= 1
+                        woken += 1
+                    else:
+                        asleep.append(llama)
+                if asleep:
+                    self._dormant[(bx,by)] = asleep
+                else:
+                    del self._dormant[(bx,by)]
+        if woken:
+            log('LOD woke up %d llamas',woken)
+
+    def event (self,q):
+        p = self._screen._player
+        if self._num_dormant and (p._x,p._y) != self._last:
+            self._last = (p._x,p._y)
+            self.wake_near(q,p._x,p._y)
+        q.enqueue(self._freq,self)
+
+#
+# Batched llama AI
+#
+# Instead of every llama sitting on the event queue and rolling its
+# own dice, a LlamaHerd registers once and decides for all of its
+# llamas in one go. Positions, facings, intelligence tiers and
+# anchors are held in NumPy arrays, the dice rolls and distance
+# checks are vectorized, and only the llamas that actually turn,
+# move or spit touch their Llama objects and sprites.
+#
+# The decisions follow Llama.think() exactly, tier by tier. If the
+# screen has a LlamaLOD, llamas outside its far radius are skipped.
+# Without NumPy the herd simply calls think() on every llama.
+#
+class LlamaHerd (object):
+    # chance of the first (turn/move) and second (spit) action per tier
+    P_FIRST = (1.0/4, 1.0/3, 1.0/3)
+    P_SECOND = (1.0/3, 1.0/3, 1.0/2)
+
+    def __init__ (self,screen,seed=None):
+        self._screen = screen
+        self._llamas = []
+        if seed is None:
+            seed = screen.seed_for('herd')
+        self._rng = numpy.random.RandomState(seed) if numpy else None
+        self._stale = True
+
+    # add a llama to the herd (instead of registering it on the queue)
+    def add (self,llama):
+        llama._herd = self
+        self._llamas.append(llama)
+        self._stale = True
+        return llama
+
+    def register (self,q,freq):
+        self._freq = freq
+        q.enqueue(freq,self)
+        return self
+
+    # for Screen.snapshot/restore
+    def snapshot_state (self):
+        rng = self._rng.get_state() if self._rng else None
+        if rng:
+            rng = (rng[0],rng[1].tolist()) + tuple(rng[2:])
+        return ([l._uid for l in self._llamas],rng)
+
+    def restore_state (self,state,objs):
+        uids,rng = state
+        self._llamas = []
+        for uid in uids:
+            self.add(objs[uid])
+        if rng and self._rng:
+            self._rng.set_state((rng[0],numpy.array(rng[1],dtype=numpy.uint32)) + tuple(rng[2:]))
+
+    def died (self,llama):
+        if not self._stale:
+            self._alive[self._llamas.index(llama)] = False
+
+    def size (self):
+        return len(self._llamas)
+
+    # (re)build the arrays from the Llama objects
+    def gather (self):
+        llamas = self._llamas
+        self._eids = numpy.array([l._eid for l in llamas],dtype=int)
+        self._x = ENTITIES.column('x')[self._eids].astype(int)
+        self._y = ENTITIES.column('y')[self._eids].astype(int)
+        self._facing = ENTITIES.column('facing')[self._eids].astype(int)
+        self._tier = numpy.array([l._intelligence for l in llamas],dtype=int)
+        self._ax = numpy.array([l._ax for l in llamas],dtype=int)
+        self._ay = numpy.array([l._ay for l in llamas],dtype=int)
+        self._wander = numpy.array([l._wander_range for l in llamas],dtype=int)
+        self._fb_range = numpy.array([l._fb_range for l in llamas],dtype=int)
+        self._alive = (ENTITIES.column('flags')[self._eids] & EntityStore.BURNT) == 0
+        self._p_first = numpy.array(self.P_FIRST)[self._tier]
+        self._p_second = numpy.array(self.P_SECOND)[self._tier]
+        self._stale = False
+
+    # copy back position and facing of llamas that acted
+    def scatter (self,idx):
+        eids = self._eids[idx]
+        self._x[idx] = ENTITIES.column('x')[eids]
+        self._y[idx] = ENTITIES.column('y')[eids]
+        self._facing[idx] = ENTITIES.column('facing')[eids]
+
+    def event (self,q):
+        log('event for %s',self)
+        self.update()
+        q.enqueue(self._freq,self)
+
+    def update (self):
+        if numpy is None:
+            for l in self._llamas:
+                if not l.is_burnt():
+                    l.think()
+            return
+
+        if self._stale:
+            self.gather()
+        n = len(self._llamas)
+        if not n:
+            return
+
+        p = self._screen._player
+        px,py = p._x,p._y
+        x,y = self._x,self._y
+        distx = px - x
+        disty = py - y
+
+        active = self._alive.copy()
+        lod = self._screen._lod
+        if lod:
+            active &= numpy.maximum(abs(distx),abs(disty)) <= lod._far
+
+        # Roll all the dice at once
+        rolls = self._rng.random_sample((2,n))
+        first = active & (rolls[0] < self._p_first)
+        second = active & ~first & (rolls[1] < self._p_second)
+        tier = self._tier
+
+        # Dumb llamas turn to face the player
+        facing = numpy.where(abs(distx) > abs(disty),
+                             numpy.where(distx > 0, 1, 0),
+                             numpy.where(disty > 0, 3, 2))
+        turn = first & (tier == 0) & (facing != self._facing)
+
+        # Average llamas take a random step within their wander range
+        step = self._rng.randint(4,size=n)
+        sdx = numpy.array((-1,1,0,0))[step]
+        sdy = numpy.array((0,0,-1,1))[step]
+        wander = (first & (tier == 1)
+                  & (abs(x+sdx-self._ax) < self._wander)
+                  & (abs(y+sdy-self._ay) < self._wander))
+
+        # Smart llamas step towards the player if within wander range
+        chase = (first & (tier == 2)
+                 & (abs(distx) < self._wander) & (abs(disty) < self._wander)
+                 & ((distx != 0) | (disty != 0)))
+        along_x = (disty == 0) | ((distx != 0) & (self._rng.randint(2,size=n) == 0))
+        cdx = numpy.where(along_x, numpy.sign(distx), 0)
+        cdy = numpy.where(along_x, 0, numpy.sign(disty))
+
+        # Anyone can spit if the player is close enough
+        spit = second & (abs(distx) < self._fb_range+3) & (abs(disty) < self._fb_range+3)
+
+        # Apply the resulting actions
+        llamas = self._llamas
+        for i in numpy.flatnonzero(turn):
+            llamas[i].face_player()
+        for i in numpy.flatnonzero(wander):
+            llamas[i].move(int(sdx[i]),int(sdy[i]))
+        for i in numpy.flatnonzero(chase):
+            llamas[i].move(int(cdx[i]),int(cdy[i]))
+        for i in numpy.flatnonzero(spit):
+            llamas[i].shoot_at_player()
+
+        self.scatter(numpy.flatnonzero(turn | wander | chase))
+
+    def __str__ (self):
+        return "<herd of "+str(len(self._llamas))+" llamas>"
+
 # 
 # A Rat is an example of a character which defines an event that makes
 # the rat move, so that it can be queued into the event queue to enable
 # that behavior. (Which is right now unfortunately not implemented.)
 #
 class Rat (Character):
+    __slots__ = ('_restlessness',)
+
     def __init__ (self,name,desc):
         Character.__init__(self,name,desc)
-        log("Rat.__init__ for "+str(self))
-        rect = Rectangle(Point(0,0),
-                         Point(TILE_SIZE,TILE_SIZE))
-        rect.setFill("red")
-        rect.setOutline("red")
-        self._sprite = rect
-        self._direction = random.randrange(4)
+        log('Rat.__init__ for %s',self)
+        self._sprite = self.new_sprite()
         self._restlessness = 5
         self._flammable = True
         self._takable = True
@@ -793,20 +1656,29 @@ class Rat (Character):
     # this gets called from event queue when the time is right
 
     def event (self,q):
-        log("event for "+str(self))
+        log('event for %s',self)
 
         if not self.is_burnt():
             # Should I move this time?
-            if random.randrange(self._restlessness) == 0:
+            if self._screen.rng('rat').randrange(self._restlessness) == 0:
                 self.move_somewhere()   
 
             # Re-register event with same frequency if not a pile of ashes
             self.register(q,self._freq)
 
     def move_somewhere (self):
-        dx,dy = random.choice(MOVE.values())
+        dx,dy = self._screen.rng('rat').choice(STEPS)
         self.move(dx,dy)
 
+    def new_sprite (self):
+        if self._burnt:
+            return Thing.new_sprite(self)
+        rect = Rectangle(Point(0,0),
+                         Point(TILE_SIZE,TILE_SIZE))
+        rect.setFill("red")
+        rect.setOutline("red")
+        return rect
+
 
 
 
@@ -814,19 +1686,21 @@ class Rat (Character):
 # The Player character
 #
 class Player (Character):
+    __slots__ = ('_fb_power','_fb_range','_fb_speed','_h_obj','_inventory','_inventory_elts','_max_health')
+    _DIR_IMGS = {
+        'Left': 'sprites/W_smaller_duck.gif',
+        'Right': 'sprites/E_smaller_duck.gif',
+        'Up' : 'sprites/N_smaller_duck.gif',
+        'Down' : 'sprites/S_smaller_duck.gif'
+    }
+    _kind = EntityStore.PLAYER
+
     def __init__ (self,name,facing,health,fb_range,fb_speed,fb_power):
         Character.__init__(self,name,"Yours truly")
-        log("Player.__init__ for "+str(self))
+        log('Player.__init__ for %s',self)
 
-        self._DIR_IMGS = {
-            'Left': 'sprites/W_smaller_duck.gif',
-            'Right': 'sprites/E_smaller_duck.gif',
-            'Up' : 'sprites/N_smaller_duck.gif',
-            'Down' : 'sprites/S_smaller_duck.gif'
-        }
         self._facing = facing
-        pic = self._DIR_IMGS[self._facing]
-        self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+        self._sprite = self.new_sprite()
         
         self._inventory = []
         self._inventory_elts = {}
@@ -846,6 +1720,9 @@ class Player (Character):
         #     config[option] = DEFAULT_CONFIG[option]
         # self.config = config
 
+    def sprite_file (self):
+        return self._DIR_IMGS[self._facing]
+
     def is_player (self):
         return True
 
@@ -854,16 +1731,13 @@ class Player (Character):
 
     def die (self):
         log('Player died, game is lost')
-        t = Text(Point(WINDOW_WIDTH/2,WINDOW_HEIGHT/2),'YOU LOST!')
-        t.setSize(36)
-        t.setTextColor('red')
-        t.draw(self._screen._window)
-        self._screen._window.getKey()
-        time.sleep(.5)
-        exit(0)
+        # the game loop shows the bad news at the end of this tick
+        self._screen._LOST = True
+        self._screen._DONE = True
+        self._screen._bus.publish('entity-died',self)
 
     def hit (self, power):
-        log(str(self)+' gets hit for '+str(power+1))   
+        log('%s gets hit for %d',self,power+1)
         self._health -= (power + 1)
 
         self.update_health()
@@ -874,7 +1748,8 @@ class Player (Character):
     def shoot (self):
         # Am I facing the border?
         dx,dy = MOVE[self._facing]
-        if not (self._x+dx >= 0 and self._x+dx <= LEVEL_WIDTH-1 and self._y+dy >= 0 and self._y+dy <= LEVEL_HEIGHT-1):
+        level = self._screen._level
+        if not (self._x+dx >= 0 and self._x+dx <= level._width-1 and self._y+dy >= 0 and self._y+dy <= level._height-1):
             return
 
         # Am I facing an unwalkable and unflammable tile?
@@ -888,8 +1763,8 @@ class Player (Character):
             return
 
         # Else, shoot fireball
-        Fireball(
-            self._facing, self._fb_range, self._fb_power).register(
+        self._screen._projectiles.acquire(
+            Fireball, self._facing, self._fb_range, self._fb_power).register(
             self._screen._q, self._fb_speed).materialize(
             self._screen, self._x+dx, self._y+dy, self._x, self._y
         )
@@ -905,8 +1780,7 @@ class Player (Character):
             key = DIRECTIONS[(dx,dy)]
             self._facing = key
             self._sprite.undraw()
-            pic = self._DIR_IMGS[self._facing]
-            self._sprite = Image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+            self._sprite = self.new_sprite()
             self._sprite.move((self._x-(self._x-(VIEWPORT_WIDTH-1)/2))*TILE_SIZE,
                                (self._y-(self._y-(VIEWPORT_HEIGHT-1)/2))*TILE_SIZE)
             self._sprite.draw(self._screen._window)
@@ -916,7 +1790,8 @@ class Player (Character):
             return
 
         # Trying to go out of bounds?
-        if not (tx >= 0 and ty >= 0 and tx < LEVEL_WIDTH and ty < LEVEL_HEIGHT):
+        level = self._screen._level
+        if not (tx >= 0 and ty >= 0 and tx < level._width and ty < level._height):
             return
 
         # Trying to walk through an unwalkable tile?
@@ -925,8 +1800,8 @@ class Player (Character):
             return
 
         # Trying to walk through a Thing that is unwalkable?
-        for thing in self._screen._things:
-            if (thing.position() == (tx,ty)) and (not thing.is_walkable()):
+        for thing in self._screen.things_at(tx,ty):
+            if not thing.is_walkable():
                 return
 
         # Update player location
@@ -947,15 +1822,29 @@ class Player (Character):
         # Can I take the thing I'm facing?
         thing = self.facing_object()
         if thing and thing.is_takable():
-            inv_num = len(self._inventory)
-            self._inventory.append(thing)
             thing.dematerialize()
+            self.add_to_inventory(thing)
+            self._screen._bus.publish('item-taken',thing)
 
-            fg = Text(Point(WINDOW_WIDTH+100,90+25*inv_num),thing.name())
-            fg.setSize(16)
-            fg.setFill('white')
-            fg.draw(self._screen._window)
-            self._inventory_elts[inv_num] = fg
+    # carry exactly these things (and list them in the panel)
+    def set_inventory (self,things):
+        for elt in self._inventory_elts.values():
+            elt.undraw()
+        self._inventory = []
+        self._inventory_elts = {}
+        for thing in things:
+            self.add_to_inventory(thing)
+
+    # put a thing in the inventory and list it in the side panel
+    def add_to_inventory (self,thing):
+        inv_num = len(self._inventory)
+        self._inventory.append(thing)
+
+        fg = Text(Point(WINDOW_WIDTH+100,90+25*inv_num),thing.name())
+        fg.setSize(16)
+        fg.setFill('white')
+        fg.draw(self._screen._window)
+        self._inventory_elts[inv_num] = fg
 
     def interact (self):
         # Am I facing a Thing?
@@ -981,17 +1870,124 @@ class Player (Character):
                 self._fb_speed -= 3
                 self._screen.show_text('Fireball speed goes up by 3!')                
 
-                # make vortex appear
-                self._screen.show_text('A swirling vortex appears nearby, and you can smell a hint of pepperoni...')
-                Vortex().register(self._screen._q,20).materialize(self._screen,48,48)
+                self._screen._bus.publish('pizza-eaten',thing)
 
             if thing.is_vortex():
                 self._screen.show_text('You feel the next slice of pizza calling to you through the vortex.')
                 self._screen.show_text('You take a deep breath and step through.')
+                self._screen._exit = thing.leads_to()
                 self._screen._DONE = True;
 
 
 
+#
+# Spreading fire
+#
+# A fire started by a fireball doesn't stop at the tile or thing
+# it hit: FireSpread is a cellular automaton over the level grid
+# that lets it spread to neighboring trees and bushes (the tiles
+# in lvl.FLAMMABLES) and flammable things (doors, rats).
+#
+# It only ever looks at the cells currently on fire. Every `freq`
+# ticks each burning cell sets each flammable neighbor on fire
+# with probability `chance`, and after `rounds` such steps burns
+# out, leaving ash. A burning tile shows flames until then. Only
+# the cells that catch fire or burn out get redrawn, so a step
+# costs time in proportion to the size of the fire, not of the
+# level (a few hundred burning trees in a 500x500 forest take
+# well under a millisecond).
+#
+# The dice come from the world's 'fire' stream (see Screen.rng)
+# and burning cells are visited in level order, so fires replay
+# exactly.
+#
+FLAMES = 'sprites/N_big_fireball.gif'
+
+class FireSpread (object):
+    def __init__ (self,screen,chance=0.3,rounds=3):
+        self._screen = screen
+        self._chance = chance
+        self._rounds = rounds
+        self._burning = {}      # level index -> steps left to burn
+
+    def register (self,q,freq=10):
+        self._freq = freq
+        q.enqueue(freq,self)
+        return self
+
+    def num_burning (self):
+        return len(self._burning)
+
+    def is_burning (self,x,y):
+        return self._screen._level._pos(x,y) in self._burning
+
+    # set cell (x,y) on fire (the things there are burnt by the caller)
+    def ignite (self,x,y):
+        level = self._screen._level
+        ind = level._pos(x,y)
+        if ind in self._burning:
+            return
+        self._burning[ind] = self._rounds
+        if level._bits[ind] & TILE_FUEL:
+            self.redraw(ind)
+
+    # redraw the (unburnt) tile at level index ind as it looks now
+    def redraw (self,ind):
+        scr = self._screen
+        tile = scr._level._map[ind]
+        scr.repaint_tile(ind,FLAMES if ind in self._burning else lvl.SPRITES[tile])
+
+    def event (self,q):
+        if self._burning:
+            self.step()
+        q.enqueue(self._freq,self)
+
+    def step (self):
+        scr = self._screen
+        level = scr._level
+        bits = level._bits
+        burning = self._burning
+        rng = scr.rng('fire')
+        chance = self._chance
+        width,height = level._width,level._height
+        current = sorted(burning)
+
+        # spread to the neighbors
+        for ind in current:
+            x,y = ind % width, ind // width
+            for nx,ny in ((x,y-1),(x-1,y),(x+1,y),(x,y+1)):
+                if not (0 <= nx < width and 0 <= ny < height):
+                    continue
+                n = nx + ny*width
+                if n in burning:
+                    continue
+                fuel = [t for t in scr.things_at(nx,ny) if t.is_flammable()]
+                if (fuel or bits[n] & TILE_FUEL) and rng.random() < chance:
+                    self.ignite(nx,ny)
+                    for t in fuel:
+                        t.burn()
+
+        # and burn out
+        for ind in current:
+            burning[ind] -= 1
+            if not burning[ind]:
+                del burning[ind]
+                if bits[ind] & TILE_FUEL:
+                    scr.burn_tile(ind % width, ind // width)
+
+    # for Screen.snapshot/restore
+    def snapshot_state (self):
+        return sorted(self._burning.items())
+
+    def restore_state (self,state,objs):
+        old = self._burning
+        self._burning = dict(state)
+        for ind in set(old) ^ set(self._burning):
+            # (tiles that burnt out or grew back are already redrawn)
+            if self._screen._level._map[ind]:
+                self.redraw(ind)
+
+
 
 #############################################################
 # 
@@ -1018,28 +2014,166 @@ class Player (Character):
 # implements a specific map -- perhaps of Olin?
 #
 class Level (object):
-    def __init__ (self, num):
-        # size = LEVEL_WIDTH * LEVEL_HEIGHT
-        # the_map = [0] * size
-        # for i in range(100):
-        #     the_map[random.randrange(size)] = 1
-        # for i in range(50):
-        #     the_map[random.randrange(size)] = 2
-        the_map = lvl.LEVELS[num]
+    # (the_map, if given, is the map to use instead of level num's in
+    # levels.py: as it was left, see LevelManager, or generated, see
+    # levelgen.py; width and height are its size in tiles)
+    def __init__ (self, num, the_map=None, width=LEVEL_WIDTH, height=LEVEL_HEIGHT):
+        # copy, so burning tiles doesn't change the level for good
+        if the_map is None:
+            the_map = list(lvl.LEVELS[num])
+        self._num = num
         self._map = the_map
+        self._width = width
+        self._height = height
+        # collision category bits of every tile
+        bits = dict((tile,tile_bits(tile)) for tile in set(the_map))
+        self._bits = array.array('B',map(bits.__getitem__,the_map))
 
     def _pos (self,x,y):
-        return x + (y*LEVEL_WIDTH);
+        return x + (y*self._width);
+
+    # put a different tile at level index ind
+    def change (self,ind,tile):
+        self._map[ind] = tile
+        self._bits[ind] = tile_bits(tile)
 
     # return the tile value at a given tile position in the level
     def tile (self,x,y):
         return self._map[self._pos(x,y)]
 
     def ind_to_pos (self, ind):
-        x = ind % LEVEL_WIDTH
-        y = (ind - x) / LEVEL_WIDTH
+        x = ind % self._width
+        y = (ind - x) / self._width
         return (x*TILE_SIZE,y*TILE_SIZE)
 
+#
+# Loading the next level
+#
+# Making a Level copies its map out of levels.py and works out the
+# collision bits of every tile, which on a big map takes long
+# enough to notice; a made-up level (see GENERATED_LEVELS) has its
+# whole map generated first. A LevelLoader does that (make_level)
+# on a background thread: the LevelManager starts one for the level
+# behind a vortex as soon as the vortex opens, and while the player
+# walks over to it, the game loop has the loader cut the new
+# level's tile sprites out of the atlas, one per tick (Tk only
+# works from its own thread). At the transition, only the canvas
+# work of the new Screen is left.
+#
+class LevelLoader (object):
+    def __init__ (self,num):
+        self._num = num
+        self._level = None
+        self._sprites = None    # sprite files still to cut out
+        self._error = None
+        self._thread = None
+        self.seconds = None     # how long the loading took
+
+    def start (self):
+        self._thread = threading.Thread(target=self.run,name='level loader')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    # (on the loader thread)
+    def run (self):
+        started = time.time()
+        try:
+            level = make_level(self._num)
+            self._sprites = sorted(set(lvl.SPRITES[t] for t in set(level._map) if t))
+            self._level = level
+        except Exception:
+            self._error = sys.exc_info()[1]
+        self.seconds = time.time() - started
+
+    def done (self):
+        return self._thread is not None and not self._thread.is_alive()
+
+    # cut out one more sprite if the level is loaded; False once
+    # there's nothing left to do
+    def warm (self):
+        if not self.done():
+            return True
+        atlas = sprite_atlas()
+        while self._sprites:
+            pic = self._sprites.pop()
+            if atlas is not None and pic in atlas and pic not in atlas.photos:
+                atlas.photo(pic)
+                return True
+        return False
+
+    # the Level, once the loader is done with it
+    def level (self):
+        if self._thread is None:
+            self.run()
+        else:
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._level
+
+#
+# Game events
+#
+# Things that happen in the world are published on the screen's
+# EventBus (scr._bus) under a topic, together with what they
+# happened to:
+#
+#   'entity-died'   a llama or the player died (the thing)
+#   'tile-burned'   a tile burnt down to ash ((x,y))
+#   'item-taken'    the player picked something up (the thing)
+#   'pizza-eaten'   the player ate a slice of pizza (the slice)
+#   'vortex-opened' a vortex appeared (the vortex)
+#
+# Level scripts subscribe to topics instead of checking the world
+# every time something might have changed. Things can also join a
+# named group; the bus counts the members of every group and how
+# many of them died, so "all the llamas of the fortress are dead"
+# is a comparison of two numbers.
+#
+# Subscriptions belong to the screen (the level script makes them
+# once), the group counts are saved with Screen.snapshot.
+#
+class EventBus (object):
+    def __init__ (self):
+        self._subscribers = {}  # topic -> callbacks
+        self._members = {}      # group -> things that joined it
+        self._dead = {}         # group -> how many of them died
+        self.subscribe('entity-died',self.count_death)
+
+    def subscribe (self,topic,callback):
+        self._subscribers.setdefault(topic,[]).append(callback)
+
+    def unsubscribe (self,topic,callback):
+        self._subscribers[topic].remove(callback)
+
+    def publish (self,topic,subject=None):
+        for callback in tuple(self._subscribers.get(topic,())):
+            callback(subject)
+
+    def join (self,thing,group):
+        thing._group = group
+        self._members[group] = self._members.get(group,0) + 1
+        return thing
+
+    def count_death (self,thing):
+        if thing._group is not None:
+            self._dead[thing._group] = self._dead.get(thing._group,0) + 1
+
+    # how many members of the group are still alive
+    def alive (self,group):
+        return self._members.get(group,0) - self._dead.get(group,0)
+
+    # for Screen.snapshot/restore
+    def snapshot_state (self):
+        return (dict(self._members),dict(self._dead))
+
+    def restore_state (self,state):
+        members,dead = state
+        self._members = dict(members)
+        self._dead = dict(dead)
+
+
 #
 # A Screen is a representation of the level displayed in the 
 # viewport, with a representation for all the tiles and a 
@@ -1056,8 +2190,43 @@ class Level (object):
 # Like, a lot of them.
 #
 
+# the plain-data attributes of a thing (no sprites, no screen), as
+# saved by Screen.snapshot
+PURE_TYPES = (bool, int, float, str, type(None))
+
+def is_pure (value):
+    if isinstance(value,tuple):
+        return all(is_pure(v) for v in value)
+    return isinstance(value,PURE_TYPES)
+
+# (plus the attributes kept in ENTITIES, but not the entity id and
+# spatial index bookkeeping, which belong to this process and screen)
+STORED = ('_x','_y','_walkable','_takable','_flammable','_burnt','_facing','_health')
+UNSAVED = ('_eid','_indexed_by','_seq')
+
+def slots (cls):
+    return [k for c in cls.__mro__ for k in c.__dict__.get('__slots__',())
+            if k != '__weakref__']
+
+def pure_state (thing):
+    state = {}
+    for k in slots(type(thing)):
+        if k not in UNSAVED and hasattr(thing,k):
+            v = getattr(thing,k)
+            if is_pure(v):
+                state[k] = v
+    for k in STORED:
+        if hasattr(thing,k):
+            state[k] = getattr(thing,k)
+    state['class'] = type(thing).__name__
+    return state
+
+
 class Screen (object):
-    def __init__ (self,level,window,q,p,cx,cy):
+    _sids = itertools.count(1)  # 0 means "on no screen" in ENTITIES
+
+    def __init__ (self,level,window,q,p,cx,cy,seed=0):
+        self._sid = next(Screen._sids)
         self._q = q
         self._player = p
         self._level = level
@@ -1066,10 +2235,23 @@ class Screen (object):
         self._cy = cy    #  of the screen
         self._map_elts = {}
         self._things = []
+        self._at = {}       # (x,y) -> things there, see index()
+        self._watch = {}    # (x,y) -> projectiles to tell about changes there
+        self._added = 0     # things added so far
         self.initial_llamas = []
         self.ded_llamas = []
+        self._lod = None    # optional LlamaLOD scheduler
+        self._fire = None   # optional FireSpread
+        self._next = None   # LevelLoader of the next level, once started
+        self._exit = None   # number of the level the player left for
+        self._bus = EventBus()
+        self._projectiles = ProjectilePool(self)
         self._DONE = False
-
+        self._LOST = False
+        self._seed = seed
+        self._rngs = {}     # named random streams, see rng()
+        self._checkpoint_due = False    # take a snapshot after this tick
+        self._unbuilt = self.tiles_outward(cy)  # None once all tiles are built
 
         # Out-of-bounds is black
         out = Rectangle(Point(0,0),Point(WINDOW_WIDTH,WINDOW_HEIGHT))
@@ -1081,28 +2263,109 @@ class Screen (object):
         dy = (cy - (VIEWPORT_HEIGHT-1)/2) * TILE_SIZE
 
         # Background is lightgreen
-        bg = Rectangle(Point(-dx,-dy),Point(TILE_SIZE*(LEVEL_WIDTH)-dx,TILE_SIZE*(LEVEL_HEIGHT)-dy))
+        bg = Rectangle(Point(-dx,-dy),Point(TILE_SIZE*(level._width)-dx,TILE_SIZE*(level._height)-dy))
         bg.setFill("lightgreen")
         bg.setOutline("lightgreen")
         bg.draw(window)
         self._map_elts[-1] = bg
 
-        # Tiles
-        for ind,cell in enumerate(self._level._map):
-            if cell:
-                sx,sy = self._level.ind_to_pos(ind)
-
-                pic = lvl.SPRITES[cell]
-                elt = Image(Point(sx-dx+TILE_SIZE/2, sy-dy+TILE_SIZE/2), pic)
-
-                elt.draw(window)
+        # Tiles in view (and one more all around); the others come a
+        # slice at a time, see build_tiles
+        level_map = self._level._map
+        for y in range(max(0,cy-VIEWPORT_HEIGHT//2-1),min(level._height,cy+VIEWPORT_HEIGHT//2+2)):
+            for x in range(max(0,cx-VIEWPORT_WIDTH//2-1),min(level._width,cx+VIEWPORT_WIDTH//2+2)):
+                ind = self._level._pos(x,y)
+                cell = level_map[ind]
+                if cell:
+                    sx,sy = self._level.ind_to_pos(ind)
+
+                    pic = lvl.SPRITES[cell]
+                    elt = sprite_image(Point(sx-dx+TILE_SIZE/2, sy-dy+TILE_SIZE/2), pic)
+
+                    elt.draw(window)
+
+                    self._map_elts[ind] = elt
+
+    #
+    # Building the tiles
+    #
+    # A screen starts out with only the tiles in view, so the first
+    # frame doesn't wait for the whole level. The game loop builds
+    # the rest with build_tiles(), TILE_SLICE per tick, going out row
+    # by row from the start; tiles that scroll into view (or burn)
+    # before their turn are built right away.
+    #
+
+    # indices of the (non-empty) tiles, row cy first, then the rows
+    # above and below it further and further away
+    def tiles_outward (self,cy):
+        level_map = self._level._map
+        width,height = self._level._width,self._level._height
+        for d in range(max(cy,height-cy)+1):
+            for y in ((cy-d,cy+d) if d else (cy,)):
+                if 0 <= y < height:
+                    for ind in range(y*width,(y+1)*width):
+                        if level_map[ind]:
+                            yield ind
+
+    # build up to n more tiles; True once all of them are
+    def build_tiles (self,n=TILE_SLICE):
+        if self._unbuilt is None:
+            return True
+        level_map = self._level._map
+        for ind in self._unbuilt:
+            if ind not in self._map_elts and level_map[ind]:
+                self.place_tile(ind,lvl.SPRITES[level_map[ind]])
+                n -= 1
+                if n == 0:
+                    return False
+        self._unbuilt = None
+        return True
 
-                self._map_elts[ind] = elt
+    # build the missing tiles in view from (x,y)
+    def build_view (self,x,y):
+        level_map = self._level._map
+        width,height = self._level._width,self._level._height
+        for ty in range(max(0,y-VIEWPORT_HEIGHT//2),min(height,y+VIEWPORT_HEIGHT//2+1)):
+            for tx in range(max(0,x-VIEWPORT_WIDTH//2),min(width,x+VIEWPORT_WIDTH//2+1)):
+                ind = self._level._pos(tx,ty)
+                if level_map[ind] and ind not in self._map_elts:
+                    self.place_tile(ind,lvl.SPRITES[level_map[ind]])
 
     # return the tile value at a given tile position
     def tile (self,x,y):
         return self._level.tile(x,y)
 
+    # Everything random in the world draws from a named stream
+    # seeded from the world's seed, so the same seed and the same
+    # input always replay the same game (and adding rats doesn't
+    # change what the llamas do)
+    def seed_for (self,stream):
+        return (self._seed * 1000003 ^ zlib.crc32(stream.encode())) & 0xffffffff
+
+    def rng (self,stream):
+        r = self._rngs.get(stream)
+        if r is None:
+            r = self._rngs[stream] = random.Random(self.seed_for(stream))
+        return r
+
+    # a digest of the game state (not the sprites), for checking
+    # that two runs ended up in the same place
+    def state_hash (self):
+        p = self._player
+        state = [self._q.tick(), self._DONE, self._LOST,
+                 list(self._level._map),
+                 (p._x, p._y, p._facing, p._health, p._max_health,
+                  p._fb_range, p._fb_speed, p._fb_power,
+                  [t.name() for t in p._inventory])]
+        for t in self._things:
+            state.append((type(t).__name__, t.name(), t.position(), t.is_burnt(),
+                          getattr(t,'_facing',None), getattr(t,'_health',None)))
+        for when,obj in self._q._contents:
+            state.append((when, type(obj).__name__,
+                          obj.position() if isinstance(obj,Thing) else None))
+        return hashlib.sha1(repr(state).encode()).hexdigest()
+
     # return the graphics object at a given tile position in the level
     def tile_object (self,x,y):
         return self._map_elts[self._level._pos(x,y)]
@@ -1113,11 +2376,21 @@ class Screen (object):
             cx = self._cx
             cy = self._cy
         # first, move object into given position
-        item.sprite().move((x-(cx-(VIEWPORT_WIDTH-1)/2))*TILE_SIZE,
-                           (y-(cy-(VIEWPORT_HEIGHT-1)/2))*TILE_SIZE)
-        item.sprite().draw(self._window)
+        sprite = item.sprite()
+        dx = (x-(cx-(VIEWPORT_WIDTH-1)/2))*TILE_SIZE
+        dy = (y-(cy-(VIEWPORT_HEIGHT-1)/2))*TILE_SIZE
+        if sprite.canvas:
+            # a hidden sprite kept for reuse (see ProjectilePool)
+            anchor = sprite.getAnchor()
+            sprite.move(TILE_SIZE/2+dx-anchor.getX(),TILE_SIZE/2+dy-anchor.getY())
+            self._window.itemconfig(sprite.id,state='normal')
+            sprite.canvas.tag_raise(sprite.id)
+        else:
+            sprite.move(dx,dy)
+            sprite.draw(self._window)
         # then, add to list of all objects
         self._things.append(item)
+        self.track(item)
 
         if item.is_llama():
             self.initial_llamas.append(item)
@@ -1125,6 +2398,99 @@ class Screen (object):
     def delete (self,item):
         item.sprite().undraw()
         self._things.remove(item)
+        self.untrack(item)
+
+    # like delete, but leave the sprite on the canvas, hidden, so
+    # add() can show it again
+    def hide (self,item):
+        self._window.itemconfig(item.sprite().id,state='hidden')
+        self._things.remove(item)
+        self.untrack(item)
+
+    #
+    # Where things are
+    #
+    # Every thing on the screen is listed in a spatial index, a dict
+    # from tile position to the things on that tile, which follows
+    # them around as their _x and _y change. It's in the order the
+    # things were added (their _seq), like _things, so that finding
+    # "the" thing on a tile gives the same answer as a scan of
+    # _things would.
+    #
+
+    def track (self,item):
+        ENTITIES.screen[item._eid] = self._sid
+        item._seq = self._added
+        self._added += 1
+        item._indexed_by = self
+        self.index(item)
+
+    def untrack (self,item):
+        self.unindex(item)
+        item._indexed_by = None
+        ENTITIES.screen[item._eid] = 0
+
+    def index (self,item):
+        pos = (item._x,item._y)
+        at = self._at.get(pos)
+        if at is None:
+            self._at[pos] = [item]
+        else:
+            at.append(item)
+            at.sort(key=lambda t: t._seq)
+        if self._watch and item._kind != EntityStore.PROJECTILE:
+            self.changed(pos[0],pos[1])
+
+    def unindex (self,item):
+        pos = (item._x,item._y)
+        at = self._at[pos]
+        at.remove(item)
+        if not at:
+            del self._at[pos]
+        if self._watch and item._kind != EntityStore.PROJECTILE:
+            self.changed(pos[0],pos[1])
+
+    # Projectiles in analytic flight watch the tiles on their path
+    # and plan again when something changes there
+
+    def watch (self,p,cells):
+        p._watched = cells
+        for cell in cells:
+            self._watch.setdefault(cell,[]).append(p)
+
+    def unwatch (self,p):
+        for cell in p._watched:
+            watchers = self._watch[cell]
+            watchers.remove(p)
+            if not watchers:
+                del self._watch[cell]
+        p._watched = []
+
+    # something on tile (x,y) changed (a thing came or went, a tile
+    # burnt...); projectiles don't stop each other, so their own
+    # comings and goings don't count
+    def changed (self,x,y):
+        watchers = self._watch.get((x,y))
+        if watchers:
+            for p in list(watchers):
+                if p._watched:
+                    p.replan()
+
+    # the things on tile (x,y)
+    def things_at (self,x,y):
+        return self._at.get((x,y),())
+
+    # the first thing on tile (x,y), or False
+    def thing_at (self,x,y):
+        at = self._at.get((x,y))
+        return at[0] if at else False
+
+    # whole-world queries, answered from ENTITIES
+    def burnt_things (self):
+        return ENTITIES.select(self._sid,EntityStore.BURNT)
+
+    def llamas_within (self,x,y,r):
+        return ENTITIES.select(self._sid,kind=EntityStore.LLAMA,box=(x-r,y-r,x+r,y+r))
 
     # helper method to get at underlying window
     def window (self):
@@ -1133,13 +2499,17 @@ class Screen (object):
     # shift viewport when player moves
     def shift_viewport (self, dx, dy):
         # Move tiles in the specified direction
+        px = self._player._x
         for key in self._map_elts:
             tile = self._map_elts[key]
             tile.move(dx*TILE_SIZE,dy*TILE_SIZE)
             
             # Push down if over right sidepanel
             if key > -1:
-                self.raise_or_lower_tile(key)
+                self.raise_or_lower_tile(key,px)
+
+        if self._unbuilt is not None:
+            self.build_view(px,self._player._y)
 
         # Move Things as well so they appear to not move
         for thing in self._things:
@@ -1147,14 +2517,17 @@ class Screen (object):
                 thing.shift(dx*TILE_SIZE,dy*TILE_SIZE)
 
    
-    def raise_or_lower_tile (self, ind):
+    # (px is the player's x, if the caller already has it at hand)
+    def raise_or_lower_tile (self, ind, px=None):
         p = self._player
+        if px is None:
+            px = p._x
         tile_x,tile_y = self._level.ind_to_pos(ind)
         tile_x = tile_x/TILE_SIZE
         tile_y = tile_y/TILE_SIZE
 
         tile = self.tile_object(tile_x,tile_y)
-        x_dist = tile_x - p._x
+        x_dist = tile_x - px
         if x_dist > (VIEWPORT_WIDTH-1)/2:
             self.lower_tile(tile)
         else:
@@ -1168,6 +2541,210 @@ class Screen (object):
         tile.canvas.tag_lower(tile.id)
 
 
+    #
+    # Snapshots
+    #
+    # snapshot() packs the pure game state -- tiles, things, the
+    # player, llama bookkeeping, random streams and pending events --
+    # into a compact blob that holds no sprites or other Tk objects.
+    # restore() puts a snapshot back into this screen: things and
+    # tiles whose looks didn't change keep their sprites and are just
+    # moved into place, and only the others get new sprites.
+    #
+    # Both must be called between ticks, not from inside an event.
+    #
+
+    def snapshot (self):
+        p = self._player
+        queue = []
+        services = {}
+        for when,obj in self._q._contents:
+            if isinstance(obj,Thing):
+                queue.append((when,obj._uid))
+            else:
+                queue.append((when,type(obj).__name__))
+                if hasattr(obj,'snapshot_state'):
+                    services[type(obj).__name__] = obj.snapshot_state()
+        level_map = self._level._map
+        state = {
+            'map': list(level_map),
+            'size': (self._level._width,self._level._height),
+            'ash': [i for i in self._map_elts if i >= 0 and not level_map[i]],
+            'player': p._uid,
+            'things': [pure_state(t) for t in self._things],
+            'inventory': [pure_state(t) for t in p._inventory],
+            'initial_llamas': [l._uid for l in self.initial_llamas],
+            'ded_llamas': [l._uid for l in self.ded_llamas],
+            'groups': self._bus.snapshot_state(),
+            'queue': queue,
+            'services': services,
+            'rngs': dict((name,r.getstate()) for name,r in self._rngs.items()),
+            'tick': self._q._tick,
+            'done': self._DONE,
+            'lost': self._LOST,
+        }
+        return zlib.compress(pickle.dumps(state,2),1)
+
+    def restore (self,blob):
+        self.restore_state(Screen.unpack(blob))
+
+    @staticmethod
+    def unpack (blob):
+        return pickle.loads(zlib.decompress(blob))
+
+    def restore_state (self,state):
+        p = self._player
+        old_px,old_py = p._x,p._y
+        live = dict((t._uid,t) for t in self._things + p._inventory)
+        old_pos = dict((t._uid,(t._x,t._y)) for t in self._things if t is not p)
+        old_pos[state['player']] = (old_px,old_py)
+        # (the snapshot may come from another screen's player)
+        live[state['player']] = live.pop(p._uid)
+        px,py = [(t['_x'],t['_y']) for t in state['things'] if t['_uid'] == state['player']][0]
+
+        # Scroll the tiles so the player is back in the middle
+        self._projectiles.settle()
+        self._watch = {}
+        for t in self._things:
+            self.untrack(t)
+        self._things = []
+        p._x,p._y = px,py
+        if (px,py) != (old_px,old_py):
+            self.shift_viewport(old_px-px,old_py-py)
+
+        # Tiles that burnt (or un-burnt) since the snapshot
+        level_map = self._level._map
+        new_map = state['map']
+        ash = set(state['ash'])
+        old_ash = set(i for i in self._map_elts if i >= 0 and not level_map[i])
+        changed = ash ^ old_ash
+        changed.update(i for i in range(len(new_map)) if new_map[i] != level_map[i])
+        for ind in changed:
+            self._level.change(ind,new_map[ind])
+            elt = self._map_elts.pop(ind,None)
+            if elt:
+                elt.undraw()
+            if new_map[ind]:
+                self.place_tile(ind,lvl.SPRITES[new_map[ind]])
+            elif ind in ash:
+                self.place_tile(ind,'sprites/ash.gif')
+
+        # Things, in the same order as before
+        objs = {}
+        def revive (t,on_screen):
+            obj = live.pop(t['_uid'],None)
+            look = None
+            if obj is None or type(obj).__name__ != t['class']:
+                cls = globals()[t['class']]
+                obj = cls.__new__(cls)
+                obj.new_entity()
+                obj._sprite = None
+            elif obj._uid in old_pos:
+                look = (obj._burnt,obj.sprite_file())
+            for k,v in t.items():
+                if k != 'class':
+                    setattr(obj,k,v)
+            obj._screen = self
+            if on_screen and look and look == (obj._burnt,obj.sprite_file()):
+                # same looks, just move the sprite into place
+                ox,oy = old_pos[obj._uid]
+                obj._sprite.move(((obj._x-px)-(ox-old_px))*TILE_SIZE,
+                                 ((obj._y-py)-(oy-old_py))*TILE_SIZE)
+            else:
+                if look:
+                    obj._sprite.undraw()
+                if on_screen:
+                    obj._sprite = obj.new_sprite()
+                    self.place(obj._sprite,obj._x,obj._y)
+                    obj._sprite.draw(self._window)
+            objs[obj._uid] = obj
+            return obj
+
+        self._things = [revive(t,True) for t in state['things']]
+        for t in self._things:
+            self.track(t)
+        inventory = [revive(t,False) for t in state['inventory']]
+        for obj in live.values():
+            if obj._uid in old_pos:
+                obj._sprite.undraw()
+        for t in self._things:
+            t.raise_or_lower_sprite(False)
+        p.raise_sprite()
+
+        # Player's side panel
+        p.update_health()
+        p.set_inventory(inventory)
+
+        self.initial_llamas = [objs[uid] for uid in state['initial_llamas']]
+        self.ded_llamas = [objs[uid] for uid in state['ded_llamas']]
+        self._bus.restore_state(state['groups'])
+
+        # Pending events; services like CheckInput stay the same objects
+        services = dict((type(obj).__name__,obj) for when,obj in self._q._contents
+                        if not isinstance(obj,Thing))
+        self._q._contents = [[when,objs[ref] if ref in objs else services[ref]]
+                             for when,ref in state['queue']
+                             if ref in objs or ref in services]
+        for name,service_state in state['services'].items():
+            if name in services:
+                services[name].restore_state(service_state,objs)
+        self._q._tick = state['tick']
+
+        self._rngs = {}
+        for name,rng_state in state['rngs'].items():
+            self.rng(name).setstate(rng_state)
+        self._projectiles.restored()
+
+        self._DONE = state['done']
+        self._LOST = state['lost']
+        self._window.update()
+
+    # move an undrawn sprite (sitting at the origin) to tile (x,y)
+    def place (self,sprite,x,y):
+        p = self._player
+        sprite.move((x-(p._x-(VIEWPORT_WIDTH-1)/2))*TILE_SIZE,
+                    (y-(p._y-(VIEWPORT_HEIGHT-1)/2))*TILE_SIZE)
+
+    # burn the tile at (x,y) down to ash
+    def burn_tile (self,x,y):
+        ind = self._level._pos(x,y)
+        self._level.change(ind,0)
+        self.repaint_tile(ind,'sprites/ash.gif')
+        self.changed(x,y)
+        self._bus.publish('tile-burned',(x,y))
+
+    # a fireball hit the (flammable) tile at (x,y)
+    def set_fire (self,x,y):
+        if self._fire:
+            self._fire.ignite(x,y)
+        else:
+            self.burn_tile(x,y)
+
+    # draw a new tile image at level index ind
+    def place_tile (self,ind,pic):
+        width = self._level._width
+        x,y = ind % width, ind // width
+        elt = sprite_image(Point(TILE_SIZE/2,TILE_SIZE/2),pic)
+        self.place(elt,x,y)
+        elt.draw(self._window)
+        self._map_elts[ind] = elt
+        self.raise_or_lower_tile(ind)
+        return elt
+
+    # show pic on the tile at level index ind, keeping its canvas
+    # item (undrawing one scans the list of everything in the window)
+    def repaint_tile (self,ind,pic):
+        elt = self._map_elts.get(ind)
+        if elt is None:
+            # (not built yet)
+            return self.place_tile(ind,pic)
+        img = sprite_image(Point(0,0),pic).img
+        self._window.itemconfig(elt.id,image=img)
+        elt.img = img
+        Image.imageCache[elt.imageId] = img     # keep the photo alive
+        return elt
+
+
     def show_text (self, text):
         # White box as a background
         bg = Rectangle(Point(0,WINDOW_HEIGHT-50), Point(WINDOW_WIDTH,WINDOW_HEIGHT))
@@ -1190,9 +2767,15 @@ class Screen (object):
 # with some timing information. I found this super useful to 
 # debug tricky event-based problems.
 #
-def log (message):
+# Pass the arguments separately, log('%s moving',self), so nothing
+# gets formatted unless DEBUG is on; the printing happens on a
+# background thread (see logger.py).
+#
+LOG = logger.Logger(logger.DEBUG)
+
+def log (message,*args):
     if DEBUG:
-        print time.strftime("[%H:%M:%S]",time.localtime()),message
+        LOG.debug(message,*args)
 
 
 
@@ -1207,6 +2790,27 @@ def log (message):
 class EventQueue (object):
     def __init__ (self):
         self._contents = []
+        self._tick = 0
+        self._counts = None   # dispatches per event class, if counting
+        self._profiler = None # see profiler.py
+
+    # start counting dispatched events per class
+    def count_events (self):
+        self._counts = {}
+
+    def counts (self):
+        return self._counts
+
+    # time every dispatched event with an EventProfiler
+    def set_profiler (self,profiler):
+        self._profiler = profiler
+
+    def profiler (self):
+        return self._profiler
+
+    # number of ticks so far
+    def tick (self):
+        return self._tick
 
     # list kept ordered by time left before firing
     def enqueue (self,when,obj):
@@ -1225,11 +2829,28 @@ class EventQueue (object):
         
     def dequeue_if_ready (self):
         acted = self.ready()
+        counts = self._counts
+        prof = self._profiler
+        if prof is not None and not prof.enabled:
+            prof = None
+        dispatched = 0
         while self.ready():
             entry = self._contents.pop(0)
-            entry[1].event(self)
+            if counts is not None:
+                name = type(entry[1]).__name__
+                counts[name] = counts.get(name,0) + 1
+            if prof is None:
+                entry[1].event(self)
+            else:
+                start = profiler.clock()
+                entry[1].event(self)
+                prof.record(entry[1],profiler.clock()-start)
+                dispatched += 1
         for entry in self._contents:
             entry[0] -= 1
+        self._tick += 1
+        if prof is not None:
+            prof.tick(dispatched,len(self._contents))
 
 
 # A simple event class that checks for user input.
@@ -1253,13 +2874,19 @@ DIRECTIONS = {
     (0,1): 'Down'
 }
 
+# the four steps, in a fixed order for random choices
+STEPS = ((-1,0),(1,0),(0,-1),(0,1))
+
 class CheckInput (object):
-    def __init__ (self,window,player):
+    def __init__ (self,window,player,recorder=None):
         self._player = player
         self._window = window
+        self._recorder = recorder   # see replay.py
 
     def event (self,q):
         key = self._window.checkKey()
+        if key and self._recorder:
+            self._recorder.record(q.tick(),key)
 
         if key == 'q':
             self._window.close()
@@ -1273,8 +2900,22 @@ class CheckInput (object):
             self._player.interact()
         if key == 'space':
             self._player.shoot()
+        if key == 'p':
+            toggle_profiling(q)
         q.enqueue(1,self)
 
+# Switch the event profiler on or off; the first time, also have
+# it report at exit
+def toggle_profiling (q,path=None):
+    prof = q.profiler()
+    if prof is None:
+        prof = profiler.EventProfiler().report_at_exit(path or PROFILE_FILE)
+        q.set_profiler(prof)
+    else:
+        prof.enabled = not prof.enabled
+    log('event profiling %s','on' if prof.enabled else 'off')
+    return prof
+
 #
 # Create the right-side panel that can be used to display interesting
 # information to the player
@@ -1306,6 +2947,69 @@ def create_panel (window):
     fg.setFill("white")
     fg.draw(window)
 
+#
+# Optional performance HUD at the bottom of the panel, showing
+# whether the engine keeps up: the actual tick rate, how long the
+# work of a tick takes (frame time; mean and worst since the last
+# refresh), how many ticks overran TICK_SECONDS, the length of the
+# event queue, and how many things are on the screen and items on
+# the canvas.
+#
+# The game loop calls tick() once per tick, which only adds up a
+# few numbers. A few times a second the HUD changes the text of
+# its lines (drawn once, up front); the window shows them at the
+# next update, which CheckInput does every tick anyway.
+#
+HUD_REFRESH = 0.25      # seconds between refreshes
+
+class PerfHUD (object):
+    _LINES = 6
+
+    def __init__ (self,window,scr):
+        self._window = window
+        self._scr = scr
+        self._lines = []
+        for i in range(self._LINES):
+            fg = Text(Point(WINDOW_WIDTH+WINDOW_RIGHTPANEL/2,WINDOW_HEIGHT-20*(self._LINES-i)),'')
+            fg.setSize(11)
+            fg.setFill('white')
+            fg.draw(window)
+            self._lines.append(fg)
+        self._overruns = 0
+        self.reset(time.time())
+
+    def reset (self,now):
+        self._since = now
+        self._ticks = 0
+        self._work = 0.0
+        self._worst = 0.0
+
+    # account for one tick whose work took `work` seconds
+    def tick (self,now,work):
+        self._ticks += 1
+        self._work += work
+        if work > self._worst:
+            self._worst = work
+        if work > TICK_SECONDS:
+            self._overruns += 1
+        if now - self._since >= HUD_REFRESH:
+            self.refresh(now)
+
+    def refresh (self,now):
+        scr = self._scr
+        n = self._ticks or 1
+        texts = (
+            '%.0f ticks/s' % (self._ticks/(now-self._since)),
+            'frame %.1f ms (max %.1f)' % (1000*self._work/n,1000*self._worst),
+            '%d overruns' % self._overruns,
+            '%d queued events' % len(scr._q._contents),
+            '%d things' % len(scr._things),
+            '%d canvas items' % len(self._window.items),
+        )
+        for fg,text in zip(self._lines,texts):
+            fg.setText(text)
+        self.reset(now)
+
 
 def sign (x):
     return (x > 0) - (x < 0)
@@ -1321,46 +3025,273 @@ def sign (x):
 #
 
 
-def play_level_0 (window):
-    level = Level(0)
+# Build the world of level 0 in the window and return its Screen;
+# the event queue is at scr._q and the player at scr._player
+#
+# (level is the Level to use, if a LevelLoader already made it,
+# player the player coming from another level, and dormant the
+# unpacked snapshot of level 0 as the player left it, to take the
+# things and events from instead of placing them anew; see
+# LevelManager)
+def build_level_0 (window,seed=0,recorder=None,level=None,player=None,dormant=None):
+    if level is None:
+        level = Level(0)
     log ("level created")
 
     q = EventQueue()
 
-    p = Player("...what's your name, bub?...", 'Right', 3, 3, 10, 0)
+    p = player or Player("...what's your name, bub?...", 'Right', 3, 3, 10, 0)
     px = 4
     py = 10
 
-    scr = Screen(level,window,q,p,px,py)
+    scr = Screen(level,window,q,p,px,py,seed)
     log ("screen created")
 
-    Door("a dry, wooden door with no doorknob").materialize(scr,11,10)
-    BarricadeDoor("the front door of the llamas' spikey fortress").materialize(scr,40,44)
+    bx,by = (40,44)
+    if dormant is None:
+        Door("a dry, wooden door with no doorknob").materialize(scr,11,10)
+        BarricadeDoor("the front door of the llamas' spikey fortress").materialize(scr,bx,by)
+
+        Felix("Halp! Bad llamas haz take my nommy pizza! They go path!").materialize(scr,12,9)
+
+        l1x,l1y = (39,43)
+        l2x,l2y = (39,45)
+        l = Llama('Left',0,1,l1x,l1y).register(q, 100).materialize(scr,l1x,l1y)
+        ll = Llama('Left',2,3,l2x,l2y).register(q, 100).materialize(scr,l2x,l2y)
+        scr._bus.join(l,'fortress')
+        scr._bus.join(ll,'fortress')
+
+    # Killing the fortress llamas opens its door
+    def fortress_falls (llama):
+        if llama._group == 'fortress' and not scr._bus.alive('fortress'):
+            for thing in list(scr.things_at(bx,by)):
+                if thing.is_barricade_door():
+                    thing.dematerialize()
+    scr._bus.subscribe('entity-died',fortress_falls)
+
+    if dormant is None:
+        Pizza('You take back the stolen slice of pizza. You feel your powers increasing.').materialize(scr,45,41)
+
+    # Eating it opens the way to the next level
+    def pizza_eaten (pizza):
+        scr.show_text('A swirling vortex appears nearby, and you can smell a hint of pepperoni...')
+        Vortex().register(q,20).materialize(scr,48,48)
+        scr._checkpoint_due = True
+    scr._bus.subscribe('pizza-eaten',pizza_eaten)
+
+    create_panel(window)
 
-    Felix("Halp! Bad llamas haz take my nommy pizza! They go path!").materialize(scr,12,9)
+    p.materialize(scr,px,py)
 
-    l1x,l1y = (39,43)
-    l2x,l2y = (39,45)
-    l = Llama('Left',0,1,l1x,l1y).register(q, 100).materialize(scr,l1x,l1y)
-    ll = Llama('Left',2,3,l2x,l2y).register(q, 100).materialize(scr,l2x,l2y)
+    # Put llamas far away from the player to sleep
+    scr._lod = LlamaLOD(scr).register(q)
 
-    Pizza('You take back the stolen slice of pizza. You feel your powers increasing.').materialize(scr,45,41)
+    # Let fires spread through the woods
+    scr._fire = FireSpread(scr).register(q)
 
-    create_panel(window)
+    q.enqueue(1,CheckInput(window,p,recorder))
+
+    if dormant is not None:
+        scr.restore_state(dormant)
+
+    return scr
+
+
+# Made-up levels (see levelgen.py), by number: the arguments of
+# levelgen.generate, and 'back', the level the vortex that opens
+# where the pizza was leads to (by default the next)
+GENERATED_LEVELS = {
+    1: {'width': 100, 'height': 100, 'seed': 1, 'llamas': 0.0005, 'enclosures': 0.3,
+        'back': 0},
+}
+
+# the levelgen.Generated making level num (levelgen imports this
+# module, so it's only imported once a made-up level is needed)
+def generated_level (num):
+    import levelgen
+    return levelgen.generated(num,**GENERATED_LEVELS[num])
+
+# the Level of level num as it starts, made by its LevelLoader
+def make_level (num):
+    if num in GENERATED_LEVELS:
+        return generated_level(num).level()
+    return Level(num)
 
-    p.materialize(scr,px,py)
 
-    q.enqueue(1,CheckInput(window,p))
+# Level 1 is made up, with a vortex back to level 0
+def build_level_1 (window,seed=0,recorder=None,level=None,player=None,dormant=None):
+    return generated_level(1).build(window,seed,recorder,level,player,dormant)
 
-    # print scr._things
 
-    while not scr._DONE:
-        # Grab the next event from the queue if it's ready
-        q.dequeue_if_ready()
-        # Time unit = 10 milliseconds
-        time.sleep(0.01)
+# The function building each level, by number
+LEVEL_SCRIPTS = [build_level_0, build_level_1]
 
-    bg = Rectangle(Point(0,0),Point(TILE_SIZE*(LEVEL_WIDTH),TILE_SIZE*(LEVEL_HEIGHT)))
+# remove everything from the window
+def clear_window (window):
+    for item in window.items:
+        if isinstance(item,Image):
+            Image.imageCache.pop(item.imageId,None)
+        item.canvas = None
+        item.id = None
+    window.items = []
+    window.delete('all')
+
+#
+# Going from level to level
+#
+# The LevelManager takes the player through vortices, and back.
+# A level the player leaves goes dormant: all that's kept of it is
+# its snapshot (see Screen.snapshot) -- the map with its burnt
+# tiles, the things, the dead llamas, the pending events with their
+# ticks to go, the random streams -- compressed, without a single
+# sprite, and with its events suspended since its queue is gone.
+# Coming back builds a Screen for the map as it was left (not from
+# lvl.LEVELS) and restores the rest from the snapshot; a level never
+# visited is built by its script, with the Level from the loader
+# started when the vortex opened, if it's done.
+#
+# The player goes along: their health, powers and inventory are
+# theirs, not the level's.
+#
+class LevelManager (object):
+    def __init__ (self,window,seed=0):
+        self._window = window
+        self._seed = seed
+        self._dormant = {}      # level number -> snapshot blob
+
+    # take charge of scr, the level being played
+    def adopt (self,scr):
+        scr._bus.subscribe('vortex-opened',lambda vortex: self.preload(scr,vortex.leads_to()))
+        return scr
+
+    # start loading level num for scr, unless it's dormant or doesn't exist
+    def preload (self,scr,num):
+        if scr._next is None and num not in self._dormant and num < len(LEVEL_SCRIPTS):
+            scr._next = LevelLoader(num).start()
+
+    def is_dormant (self,num):
+        return num in self._dormant
+
+    # bytes kept for the dormant levels
+    def dormant_size (self):
+        return sum(len(blob) for blob in self._dormant.values())
+
+    # leave scr for level num and return the new level's Screen
+    def enter (self,scr,num):
+        started = time.time()
+        p = scr._player
+        carried = dict((k,v) for k,v in pure_state(p).items()
+                       if k not in ('_x','_y','_facing','class'))
+        inventory = list(p._inventory)
+        blob = self._dormant.pop(num,None)
+        scr._exit = None
+        self._dormant[scr._level._num] = scr.snapshot()
+
+        dormant = level = None
+        loader = scr._next
+        if blob is not None:
+            dormant = Screen.unpack(blob)
+            level = Level(num,dormant['map'],*dormant['size'])
+            how = 'woken up'
+        elif loader is not None and loader._num == num:
+            level = loader.level()
+            how = 'preloaded in %.1f ms' % (1000*loader.seconds)
+        else:
+            how = 'not preloaded'
+        clear_window(self._window)
+        # (a new sprite: the old one is still where the last level's
+        # view had moved it, and the new Screen would move it again)
+        p._sprite = p.new_sprite()
+        scr = self.adopt(LEVEL_SCRIPTS[num](self._window,self._seed,None,level,p,dormant))
+
+        # (the snapshot had the player as they were back then)
+        for k,v in carried.items():
+            setattr(p,k,v)
+        p.update_health()
+        p.set_inventory(inventory)
+        scr._DONE = False
+        self._window.update()
+        log('level %d shown %.1f ms after the transition (%s, %d bytes dormant)',
+            num,1000*(time.time()-started),how,self.dormant_size())
+        return scr
+
+
+def play_level_0 (window,seed=None,recorder=None,profile=None,hud=False):
+    if seed is None:
+        seed = random.randrange(1 << 31)
+    log('playing with seed %d',seed)
+    started = time.time()
+    levels = LevelManager(window,seed)
+    scr = levels.adopt(build_level_0(window,seed,recorder))
+    window.update()
+    log('first frame after %.1f ms (%d tiles built)',1000*(time.time()-started),len(scr._map_elts)-1)
+    q = scr._q
+    if profile:
+        toggle_profiling(q,profile)
+    hud = PerfHUD(window,scr) if hud else None
+
+    # where to start over after dying
+    checkpoint = scr.snapshot()
+
+    try:
+        while True:
+            while not scr._DONE:
+                start = time.time()
+                # Grab the next event from the queue if it's ready
+                q.dequeue_if_ready()
+                scr._projectiles.tween()
+                if scr._unbuilt is not None and scr.build_tiles():
+                    log('all %d tiles built after %.1f ms',len(scr._map_elts)-1,1000*(time.time()-started))
+                if scr._next is not None:
+                    scr._next.warm()
+                if scr._checkpoint_due:
+                    checkpoint = scr.snapshot()
+                    scr._checkpoint_due = False
+                if hud:
+                    now = time.time()
+                    hud.tick(now,now-start)
+                # Time unit = 10 milliseconds
+                time.sleep(TICK_SECONDS)
+
+            if not scr._LOST:
+                # Through the vortex to the next level, if there is
+                # one (a recording ends here)
+                num = scr._exit
+                if recorder or num is None or num >= len(LEVEL_SCRIPTS):
+                    break
+                started = time.time()
+                prof = q.profiler()
+                scr = levels.enter(scr,num)
+                q = scr._q
+                if prof is not None:
+                    q.set_profiler(prof)
+                hud = PerfHUD(window,scr) if hud else None
+                checkpoint = scr.snapshot()
+                continue
+
+            t = Text(Point(WINDOW_WIDTH/2,WINDOW_HEIGHT/2),'YOU LOST!')
+            t.setSize(36)
+            t.setTextColor('red')
+            t.draw(window)
+            if not recorder:
+                # (a recording ends at the first death)
+                hint = Text(Point(WINDOW_WIDTH/2,WINDOW_HEIGHT/2+40),'press r to try again')
+                hint.setSize(16)
+                hint.setTextColor('red')
+                hint.draw(window)
+            key = window.getKey()
+            if key != 'r' or recorder:
+                time.sleep(.5)
+                exit(0)
+            hint.undraw()
+            t.undraw()
+            scr.restore(checkpoint)
+    finally:
+        # also on 'q', which exits from inside the loop
+        if recorder:
+            recorder.save(scr)
+
+    bg = Rectangle(Point(0,0),Point(WINDOW_WIDTH+WINDOW_RIGHTPANEL,WINDOW_HEIGHT))
     bg.setFill('black')
     bg.setOutline('black')
     bg.draw(window)
@@ -1375,16 +3306,40 @@ def play_level_0 (window):
 
 
 def main ():
+    # pizza_quest.py [--record FILE] records the session for replay.py
+    recorder = None
+    if '--record' in sys.argv:
+        import replay
+        seed = random.randrange(1 << 31)
+        recorder = replay.InputRecorder(sys.argv[sys.argv.index('--record')+1],seed)
+
+    # pizza_quest.py [--profile FILE] profiles events from the start
+    profile = None
+    if '--profile' in sys.argv:
+        profile = sys.argv[sys.argv.index('--profile')+1]
+
+    # pizza_quest.py [--hud] shows the performance HUD in the panel
+    hud = '--hud' in sys.argv
 
     window = GraphWin("Olinland Redux", 
                       WINDOW_WIDTH+WINDOW_RIGHTPANEL, WINDOW_HEIGHT,
                       autoflush=False)
 
+    # pizza_quest.py [--latency FILE] times key presses until they
+    # show on screen (see latency.py)
+    if '--latency' in sys.argv:
+        import latency
+        latency.LatencyProbe().install(window).report_at_exit(
+            sys.argv[sys.argv.index('--latency')+1])
+
 
-    play_level_0(window)
+    play_level_0(window,recorder.seed() if recorder else None,recorder,profile,hud)
 
 
 
 if __name__ == '__main__':
+    # (replay.py, levelgen.py, ... import pizza_quest: let that be
+    # this module, not a second copy with its own classes and store)
+    sys.modules['pizza_quest'] = sys.modules[__name__]
     main()
     
\ No newline at end of file
@@ -0,0 +1,164 @@
+############################################################
+#
+# Event profiling
+#
+# An EventProfiler attached to the EventQueue times every event()
+# it dispatches and groups the times by class (Llama, Fireball,
+# Spitball, Vortex, CheckInput, Rat, ...). Once per tick it also
+# notes how many events ran and how long the queue was.
+#
+# Everything goes into histograms with power-of-two buckets, so
+# recording is a few additions and the memory used doesn't grow
+# with the length of the session.
+#
+# Profile a game with
+#
+#   python pizza_quest.py --profile profile.json
+#   python simulate.py --ticks 20000 --profile profile.json
+#
+# or press 'p' while playing to switch profiling on and off. At
+# exit the profiler prints a summary table and saves everything
+# as JSON:
+#
+#   {"ticks": 20000, "seconds": 0.41,
+#    "events": {"Llama": {"count": 312, "total_s": 0.0041,
+#                         "mean_us": 13.1, "max_us": 85.2,
+#                         "p50_us": 16, "p99_us": 128,
+#                         "histogram_us": [[2, 5], [4, 12], ...]},
+#               ...},
+#    "events_per_tick": [[1, 18000], [2, 1700], ...],
+#    "queue_length": [[4, 19000], [8, 1000]]}
+#
+# A histogram is a list of [upper bound, count] pairs: the bucket
+# [2, 5] holds the 5 values at least 1 and below 2.
+#
+
+from __future__ import print_function
+
+import sys
+import json
+import time
+import atexit
+
+# a fine-grained clock where there is one
+clock = getattr(time,'perf_counter',time.time)
+
+BUCKETS = 32
+
+
+def bucket (n):
+    return min(int(n).bit_length(),BUCKETS-1)
+
+
+class Histogram (object):
+    def __init__ (self):
+        self._counts = [0] * BUCKETS
+        self._n = 0
+
+    def add (self,value):
+        self._counts[bucket(value)] += 1
+        self._n += 1
+
+    def count (self):
+        return self._n
+
+    # upper bound of the bucket holding the q-th quantile
+    def quantile (self,q):
+        seen = 0
+        for i,c in enumerate(self._counts):
+            seen += c
+            if c and seen >= q*self._n:
+                return 1 << i
+        return 0
+
+    def pairs (self):
+        return [[1 << i,c] for i,c in enumerate(self._counts) if c]
+
+
+class EventStats (object):
+    def __init__ (self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.micros = Histogram()
+
+    def add (self,seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.micros.add(seconds * 1e6)
+
+    def summary (self):
+        return {
+            'count': self.count,
+            'total_s': self.total,
+            'mean_us': 1e6 * self.total / self.count,
+            'max_us': 1e6 * self.max,
+            'p50_us': self.micros.quantile(0.5),
+            'p99_us': self.micros.quantile(0.99),
+            'histogram_us': self.micros.pairs(),
+        }
+
+
+class EventProfiler (object):
+    def __init__ (self,enabled=True):
+        self.enabled = enabled
+        self._events = {}       # class name -> EventStats
+        self._ticks = 0
+        self._per_tick = Histogram()
+        self._queue = Histogram()
+
+    # called by EventQueue.dequeue_if_ready
+    def record (self,obj,seconds):
+        name = type(obj).__name__
+        stats = self._events.get(name)
+        if stats is None:
+            stats = self._events[name] = EventStats()
+        stats.add(seconds)
+
+    def tick (self,dispatched,queued):
+        self._ticks += 1
+        self._per_tick.add(dispatched)
+        self._queue.add(queued)
+
+    def summary (self):
+        return {
+            'ticks': self._ticks,
+            'seconds': sum(s.total for s in self._events.values()),
+            'events': dict((name,s.summary()) for name,s in self._events.items()),
+            'events_per_tick': self._per_tick.pairs(),
+            'queue_length': self._queue.pairs(),
+        }
+
+    def table (self):
+        summary = self.summary()
+        total = summary['seconds'] or 1
+        lines = ['%d ticks profiled, %.3f s in events' % (summary['ticks'],summary['seconds']),
+                 '%-12s %8s %10s %9s %8s %8s %9s %6s' % ('event','count','total ms','mean us',
+                                                           'p50 us','p99 us','max us','%')]
+        events = summary['events']
+        for name in sorted(events,key=lambda n: -events[n]['total_s']):
+            e = events[name]
+            lines.append('%-12s %8d %10.2f %9.1f %8d %8d %9.1f %6.1f' % (
+                name,e['count'],1000*e['total_s'],e['mean_us'],e['p50_us'],
+                e['p99_us'],e['max_us'],100*e['total_s']/total))
+        lines.append('events per tick (<n: ticks): '+
+                     ', '.join('<%d: %d' % (b,c) for b,c in summary['events_per_tick']))
+        lines.append('queue length    (<n: ticks): '+
+                     ', '.join('<%d: %d' % (b,c) for b,c in summary['queue_length']))
+        return '\n'.join(lines)
+
+    def save (self,path):
+        with open(path,'w') as f:
+            json.dump(self.summary(),f,indent=2,sort_keys=True)
+
+    def report (self,path,out=sys.stderr):
+        print(self.table(),file=out)
+        self.save(path)
+        print('profile saved to '+path,file=out)
+
+    # print the table and save the JSON when the program ends
+    def report_at_exit (self,path):
+        atexit.register(self.report,path)
+        return self
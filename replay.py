@@ -0,0 +1,122 @@
+############################################################
+#
+# Input recording and replay
+#
+# Every world is seeded (see Screen.rng), so a session is fully
+# determined by its seed and the keys CheckInput saw on each
+# tick. InputRecorder logs those (tick, key) pairs and saves them
+# with the seed, the final tick and a hash of the final world
+# state. replay() re-runs the session headless and checks that it
+# ends in exactly the same state.
+#
+# Record a session with
+#
+#   python pizza_quest.py --record session.pqr
+#   python simulate.py --ticks 5000 --record session.pqr
+#
+# and replay it with
+#
+#   python replay.py session.pqr
+#
+# File layout (little endian):
+#
+#   'PQR1'
+#   uint32 length of the JSON header, JSON header
+#   one (uint32 tick, uint8 key index) pair per key press
+#
+# Replays are exact on the same Python version the session was
+# recorded on (the random module differs between 2 and 3).
+#
+
+from __future__ import print_function
+
+import sys
+import json
+import struct
+import platform
+
+MAGIC = b'PQR1'
+PRESS = struct.Struct('<IB')
+
+
+class InputRecorder (object):
+    def __init__ (self,path,seed):
+        self._path = path
+        self._seed = seed
+        self._presses = []
+
+    def seed (self):
+        return self._seed
+
+    def record (self,tick,key):
+        self._presses.append((tick,key))
+
+    # write the recording, ending with the current state of scr
+    def save (self,scr):
+        import pizza_quest
+        write(self._path,self._seed,self._presses,scr._q.tick(),scr.state_hash(),
+              pizza_quest.ANALYTIC_PROJECTILES)
+
+
+def write (path,seed,presses,ticks,state_hash,analytic=False):
+    keys = sorted(set(key for tick,key in presses))
+    header = json.dumps({
+        'seed': seed,
+        'ticks': ticks,
+        'hash': state_hash,
+        'keys': keys,
+        'analytic': analytic,
+        'python': platform.python_version(),
+    }).encode()
+    index = dict((key,i) for i,key in enumerate(keys))
+    with open(path,'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I',len(header)))
+        f.write(header)
+        f.write(b''.join(PRESS.pack(tick,index[key]) for tick,key in presses))
+
+
+# returns (header, [(tick, key), ...])
+def read (path):
+    with open(path,'rb') as f:
+        data = f.read()
+    if data[:4] != MAGIC:
+        raise ValueError(path+' is not a Pizza Quest recording')
+    (n,) = struct.unpack_from('<I',data,4)
+    header = json.loads(data[8:8+n].decode())
+    keys = header['keys']
+    presses = []
+    for offset in range(8+n,len(data),PRESS.size):
+        tick,i = PRESS.unpack_from(data,offset)
+        presses.append((tick,keys[i]))
+    return header,presses
+
+
+# re-run a recorded session headless; returns (matched, header, final hash)
+def replay (path):
+    import simulate
+    header,presses = read(path)
+    simulate.pq.ANALYTIC_PROJECTILES = header.get('analytic',False)
+    scr = simulate.make_world(header['seed'])
+    simulate.run(scr,header['ticks'],simulate.ScriptedInput(presses))
+    final = scr.state_hash()
+    return final == header['hash'],header,final
+
+
+def main ():
+    if len(sys.argv) != 2:
+        print('usage: python replay.py <recording>')
+        sys.exit(2)
+    matched,header,final = replay(sys.argv[1])
+    print('seed %d, %d ticks, recorded on Python %s' % (header['seed'],header['ticks'],header['python']))
+    if matched:
+        print('replay matches: '+final)
+    else:
+        print('replay DIVERGED')
+        print('  recorded: '+header['hash'])
+        print('  replayed: '+final)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+############################################################
+#
+# Headless fast-forward simulation
+#
+# Builds the world of level 0 without a window (see headless.py)
+# and drives its event queue as fast as possible for a number of
+# ticks, feeding it random or scripted keyboard input. Reports
+# ticks per second, events dispatched per type, projectile pool
+# reuse and peak memory.
+#
+#   python simulate.py [--ticks 10000] [--seed 0]
+#                      [--input random|<script file>] [--json]
+#                      [--analytic] [--record session.pqr]
+#                      [--profile profile.json]
+#   python simulate.py --check [--seed 0]
+#
+# --check doesn't simulate anything, it takes the player from level
+# 0 to level 1 and back, twice (see LevelManager), and fails unless
+# they come back where they left, sprite and all.
+#
+# A script file has one "<tick> <key>" pair per line, e.g.
+#
+#   10 Right
+#   11 Right
+#   40 space
+#
+# Other tools build on make_world() and run() from here.
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+
+# must be set before pizza_quest picks its graphics library
+os.environ['PIZZA_HEADLESS'] = '1'
+
+import pizza_quest as pq
+
+# keys a random player presses (never 'q', which quits)
+KEYS = ['Left','Right','Up','Down','space','e','f']
+
+
+# presses a random key on about `rate` of the ticks
+class RandomInput (object):
+    def __init__ (self,seed=0,rate=0.2):
+        self._rng = random.Random(seed)
+        self._rate = rate
+
+    def key (self,tick):
+        if self._rng.random() < self._rate:
+            return self._rng.choice(KEYS)
+        return ''
+
+
+# plays back (tick, key) pairs
+class ScriptedInput (object):
+    def __init__ (self,pairs):
+        self._keys = dict(pairs)
+
+    @classmethod
+    def load (cls,path):
+        pairs = []
+        with open(path) as f:
+            for line in f:
+                line = line.split('#')[0].strip()
+                if line:
+                    tick,key = line.split()
+                    pairs.append((int(tick),key))
+        return cls(pairs)
+
+    def key (self,tick):
+        return self._keys.get(tick,'')
+
+
+# build a headless level 0 world and return its Screen
+def make_world (seed=0,recorder=None):
+    pq.DEBUG = False
+    window = pq.GraphWin("Pizza Quest (headless)",
+                         pq.WINDOW_WIDTH+pq.WINDOW_RIGHTPANEL, pq.WINDOW_HEIGHT,
+                         autoflush=False)
+    return pq.build_level_0(window,seed,recorder)
+
+
+# run the world for up to `ticks` ticks (stopping early when the
+# level is done or lost) and return some statistics
+def run (scr,ticks,inputs):
+    q = scr._q
+    window = scr._window
+    if q.counts() is None:
+        q.count_events()
+
+    start = time.time()
+    first = q.tick()
+    while q.tick() - first < ticks and not scr._DONE:
+        key = inputs.key(q.tick())
+        if key:
+            window.lastKey = key
+        q.dequeue_if_ready()
+        scr.build_tiles()
+    elapsed = time.time() - start
+
+    ran = q.tick() - first
+    return {
+        'ticks': ran,
+        'seconds': elapsed,
+        'ticks_per_sec': ran/elapsed if elapsed else float('inf'),
+        'events': dict(q.counts()),
+        'projectiles': scr._projectiles.stats(),
+        'done': scr._DONE,
+        'lost': scr._LOST,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+# go from level 0 to level 1 and back, twice; returns what went
+# wrong (a carried Player used to keep its old sprite, which the
+# new Screen moved again, by 7 tiles each time)
+def check_levels (seed=0):
+    scr = make_world(seed)
+    p = scr._player
+    levels = pq.LevelManager(scr._window,seed)
+    left = (p._x,p._y)
+    anchor = p._sprite.getAnchor()
+    problems = []
+    for num in (1,0,1,0):
+        scr._exit = num
+        scr = levels.enter(scr,num)
+        if scr._level._num != num:
+            problems.append('went to level %d, not %d' % (scr._level._num,num))
+    if not levels.is_dormant(1):
+        problems.append('level 1 not dormant after leaving it')
+    if (p._x,p._y) != left:
+        problems.append('the player came back to %s, not %s' % ((p._x,p._y),left))
+    now = p._sprite.getAnchor()
+    if (now.x,now.y) != (anchor.x,anchor.y):
+        problems.append('the player sprite moved from (%g,%g) to (%g,%g)' %
+                        (anchor.x,anchor.y,now.x,now.y))
+    return problems
+
+
+def report (stats):
+    print('ticks:          %d%s' % (stats['ticks'],
+                                    ' (player died)' if stats['lost'] else
+                                    ' (level done)' if stats['done'] else ''))
+    print('wall time:      %.3f s' % stats['seconds'])
+    print('ticks/sec:      %.0f' % stats['ticks_per_sec'])
+    print('peak memory:    %.1f MB' % (stats['peak_rss_kb']/1024.0))
+    pool = stats['projectiles']
+    print('projectiles:    %d created, %d reused, peak %d in flight' % (pool['created'],pool['reused'],pool['peak']))
+    print('events dispatched:')
+    events = stats['events']
+    for name in sorted(events,key=lambda n: -events[n]):
+        print('  %-12s %8d' % (name,events[name]))
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='headless fast-forward simulation of level 0')
+    parser.add_argument('--ticks',type=int,default=10000)
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--input',default='random',
+                        help="'random' or a file of '<tick> <key>' lines")
+    parser.add_argument('--rate',type=float,default=0.2,
+                        help='fraction of ticks with a random key press')
+    parser.add_argument('--json',action='store_true',help='print the statistics as JSON')
+    parser.add_argument('--analytic',action='store_true',
+                        help='plan projectile flights ahead (see Projectile.plan)')
+    parser.add_argument('--record',metavar='FILE',help='record the session for replay.py')
+    parser.add_argument('--profile',metavar='FILE',
+                        help='time events per class and save the profile (see profiler.py)')
+    parser.add_argument('--check',action='store_true',
+                        help='only check going to level 1 and back')
+    args = parser.parse_args()
+    pq.ANALYTIC_PROJECTILES = args.analytic
+
+    if args.check:
+        problems = check_levels(args.seed)
+        for problem in problems:
+            print(problem)
+        print('levels 0 -> 1 -> 0 -> 1 -> 0: %s' % ('FAILED' if problems else 'ok'))
+        sys.exit(1 if problems else 0)
+
+    if args.input == 'random':
+        inputs = RandomInput(args.seed,args.rate)
+    else:
+        inputs = ScriptedInput.load(args.input)
+
+    recorder = None
+    if args.record:
+        import replay
+        recorder = replay.InputRecorder(args.record,args.seed)
+
+    scr = make_world(args.seed,recorder)
+    if args.profile:
+        pq.toggle_profiling(scr._q,args.profile)
+    stats = run(scr,args.ticks,inputs)
+    if recorder:
+        recorder.save(scr)
+
+    if args.json:
+        json.dump(stats,sys.stdout,indent=2,sort_keys=True)
+        print()
+    else:
+        report(stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+############################################################
+#
+# Stress scenarios
+#
+# Loads a level with more than it was made for -- llamas of each
+# tier, rats, projectiles in flight, spinning vortices -- at
+# random (but seeded) places, runs it for a fixed number of ticks
+# as fast as it goes, and reports how long the ticks took:
+#
+#   python stress.py scenarios/crossfire.json [--ticks 3000]
+#                    [--seed 0] [--window] [--json out.json]
+#                    [--baseline old.json]
+#
+#   scenario crossfire: level 0, seed 2, 3000 ticks (headless)
+#   spawned 1200 fireball, 20 rat, 1200 spitball
+#                   p50      p90      p99    p99.9      max     mean  (ms)
+#   tick          0.005    0.400    0.854    1.171    1.481    0.100
+#
+# Headless by default (see headless.py); --window plays it in a
+# Tk window, so the canvas work is timed too. Messages (the
+# description of what the player picks up, ...) aren't shown
+# either way, since showing one waits for a key. --json saves the
+# report, and --baseline compares with a report saved earlier, e.g.
+# by another version of the engine.
+#
+# A scenario is a JSON file:
+#
+#   {"name": "crossfire",
+#    "level": 0,
+#    "seed": 1,
+#    "ticks": 2000,
+#    "rate": 0.2,
+#    "spawn": [
+#      {"what": "llama", "tier": 2, "count": 20, "within": 10},
+#      {"what": "rat", "count": 20},
+#      {"what": "fireball", "count": 20, "range": 12, "every": 100},
+#      {"what": "vortex", "count": 4}]}
+#
+# "level" is a number in LEVEL_SCRIPTS, or the arguments of
+# levelgen.generate for a made-up level ({"width": 500, "height":
+# 500, "seed": 3}). "rate" is how often the random player presses
+# a key (0 for a player who doesn't move), and "health" the
+# player's health (1000000 by default, so the run lasts all its
+# ticks however bad it gets). Each spawn puts "count" of "what" on
+# free tiles "within" that many tiles of the player (anywhere on
+# the level if not given), and again every "every" ticks if given.
+# Also, per kind of thing:
+#
+#   llama     "tier" (0 dumb, 1 average, 2 smart), "freq" (100)
+#   rat       "freq" (10)
+#   fireball, spitball
+#             "range" (10), "power" (0), "speed" (5)
+#   vortex    "freq" (20)
+#
+# Everything not given is left to the scenario's random stream.
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+
+if '--window' not in sys.argv:
+    os.environ['PIZZA_HEADLESS'] = '1'
+
+import pizza_quest as pq
+import simulate
+from latency import clock, percentile
+lvl = pq.lvl
+
+HEALTH = 1000000
+
+PERCENTILES = (('p50',0.5),('p90',0.9),('p99',0.99),('p99.9',0.999))
+
+DEFAULTS = {
+    'llama': {'freq': 100},
+    'rat': {'freq': 10},
+    'fireball': {'range': 10,'power': 0,'speed': 5},
+    'spitball': {'range': 10,'power': 0,'speed': 5},
+    'vortex': {'freq': 20},
+}
+
+
+def load (path):
+    with open(path) as f:
+        scenario = json.load(f)
+    scenario.setdefault('name',os.path.splitext(os.path.basename(path))[0])
+    for spawn in scenario.get('spawn',[]):
+        if spawn.get('what') not in DEFAULTS:
+            raise SystemExit('%s: no such thing to spawn: %r (there are %s)' %
+                             (path,spawn.get('what'),', '.join(sorted(DEFAULTS))))
+    return scenario
+
+
+# a free tile for a new thing, within `within` tiles of the player
+def free_tile (scr,rng,within=None):
+    level = scr._level
+    p = scr._player
+    for tries in range(1000):
+        if within is None:
+            x,y = rng.randrange(level._width),rng.randrange(level._height)
+        else:
+            x = rng.randint(max(0,p._x-within),min(level._width-1,p._x+within))
+            y = rng.randint(max(0,p._y-within),min(level._height-1,p._y+within))
+        if level.tile(x,y) not in lvl.UNWALKABLES and not scr.things_at(x,y) \
+           and (x,y) != (p._x,p._y):
+            return x,y
+    return None
+
+
+# put one thing of spawn's kind at (x,y)
+def spawn_one (scr,rng,spawn,x,y):
+    what = spawn['what']
+    opts = dict(DEFAULTS[what],**spawn)
+    q = scr._q
+    if what == 'llama':
+        tier = opts['tier'] if 'tier' in opts else rng.randrange(3)
+        pq.Llama(rng.choice(pq.FACINGS),tier,1+tier,x,y).register(q,opts['freq']).materialize(scr,x,y)
+    elif what == 'rat':
+        pq.Rat('Rat','a restless rat').register(q,opts['freq']).materialize(scr,x,y)
+    elif what == 'vortex':
+        pq.Vortex().register(q,opts['freq']).materialize(scr,x,y)
+    else:
+        cls = pq.Fireball if what == 'fireball' else pq.Spitball
+        power = min(opts['power'],len(cls._POWER_IMGS)-1)
+        scr._projectiles.acquire(cls,rng.choice(pq.FACINGS),opts['range'],power).register(
+            q,opts['speed']).materialize(scr,x,y)
+
+
+# spawn's things, on tiles picked with rng; returns how many
+def spawn_all (scr,rng,spawn):
+    n = 0
+    for i in range(spawn.get('count',1)):
+        at = free_tile(scr,rng,spawn.get('within'))
+        if at is not None:
+            spawn_one(scr,rng,spawn,*at)
+            n += 1
+    return n
+
+
+# spawns again every `every` ticks (an event in the level's queue)
+class Respawn (object):
+    def __init__ (self,scr,rng,spawn,counts):
+        self._scr = scr
+        self._rng = rng
+        self._spawn = spawn
+        self._counts = counts
+
+    def event (self,q):
+        what = self._spawn['what']
+        self._counts[what] = self._counts.get(what,0) + spawn_all(self._scr,self._rng,self._spawn)
+        q.enqueue(self._spawn['every'],self)
+
+
+# build the scenario's level in window, with its things; returns
+# the Screen and how many of each thing were spawned
+def build (scenario,window,seed=None):
+    if seed is None:
+        seed = scenario.get('seed',0)
+    level = scenario.get('level',0)
+    if isinstance(level,dict):
+        import levelgen
+        scr = levelgen.script(levelgen.generate(**level))(window,seed)
+    else:
+        scr = pq.LEVEL_SCRIPTS[level](window,seed)
+
+    # Screen.show_text waits for a key press, which in a window
+    # would be timed as part of the tick
+    scr.show_text = lambda text: None
+
+    p = scr._player
+    p._health = p._max_health = scenario.get('health',HEALTH)
+    p.update_health()
+
+    rng = random.Random(seed)
+    counts = {}
+    for spawn in scenario.get('spawn',[]):
+        what = spawn['what']
+        counts[what] = counts.get(what,0) + spawn_all(scr,rng,spawn)
+        if spawn.get('every'):
+            scr._q.enqueue(spawn['every'],Respawn(scr,rng,spawn,counts))
+    return scr,counts
+
+
+# run scr for up to `ticks` ticks like the game loop does, without
+# the sleeps (or the level change when the player steps into a
+# vortex); returns the time each tick took, in seconds
+def run (scr,ticks,inputs):
+    q = scr._q
+    window = scr._window
+    if q.counts() is None:
+        q.count_events()
+    times = []
+    first = q.tick()
+    while q.tick() - first < ticks and not scr._DONE:
+        key = inputs.key(q.tick())
+        if key:
+            window.lastKey = key
+        start = clock()
+        q.dequeue_if_ready()
+        scr._projectiles.tween()
+        if scr._unbuilt is not None:
+            scr.build_tiles()
+        times.append(clock() - start)
+        if scr._exit is not None:
+            scr._exit = None
+            scr._DONE = False
+    return times
+
+
+def summary (times):
+    ms = [1000*t for t in times]
+    s = dict((name,percentile(ms,q)) for name,q in PERCENTILES)
+    s['max'] = max(ms)
+    s['mean'] = sum(ms) / len(ms)
+    return s
+
+
+def show (report,baseline=None,out=sys.stdout):
+    level = report['level']
+    if isinstance(level,dict):
+        level = 'generated %dx%d' % (level['width'],level['height'])
+    print('scenario %s: level %s, seed %d, %d ticks (%s)%s' %
+          (report['scenario'],level,report['seed'],report['ticks'],report['graphics'],
+           ' (player died)' if report['lost'] else ' (level done)' if report['done'] else ''),file=out)
+    spawned = report['spawned']
+    print('spawned ' + ', '.join('%d %s' % (spawned[what],what) for what in sorted(spawned)),file=out)
+    columns = [name for name,q in PERCENTILES] + ['max','mean']
+    print('%-10s' % '' + ''.join('%9s' % c for c in columns) + '  (ms)',file=out)
+    print('%-10s' % 'tick' + ''.join('%9.3f' % report['ms'][c] for c in columns),file=out)
+    if baseline:
+        print('%-10s' % 'baseline' + ''.join('%9.3f' % baseline['ms'][c] for c in columns),file=out)
+        print('%-10s' % 'change' + ''.join('%+8.0f%%' % (100.0*(report['ms'][c]-baseline['ms'][c])/baseline['ms'][c])
+                                           if baseline['ms'][c] else '%9s' % '-' for c in columns),file=out)
+    events = report['events']
+    print('events dispatched:',file=out)
+    for name in sorted(events,key=lambda n: -events[n]):
+        print('  %-12s %8d' % (name,events[name]),file=out)
+
+
+def main ():
+    parser = argparse.ArgumentParser(description='run a level loaded with a stress scenario')
+    parser.add_argument('scenario',help='the scenario file (JSON)')
+    parser.add_argument('--ticks',type=int,help="instead of the scenario's")
+    parser.add_argument('--seed',type=int,help="instead of the scenario's")
+    parser.add_argument('--window',action='store_true',help='play it in a Tk window')
+    parser.add_argument('--json',metavar='FILE',help='save the report as JSON')
+    parser.add_argument('--baseline',metavar='FILE',help='compare with a report saved earlier')
+    args = parser.parse_args()
+
+    scenario = load(args.scenario)
+    seed = args.seed if args.seed is not None else scenario.get('seed',0)
+    ticks = args.ticks if args.ticks is not None else scenario.get('ticks',1000)
+
+    pq.DEBUG = False
+    window = pq.GraphWin("Pizza Quest (%s)" % scenario['name'],
+                         pq.WINDOW_WIDTH+pq.WINDOW_RIGHTPANEL, pq.WINDOW_HEIGHT,
+                         autoflush=False)
+    scr,counts = build(scenario,window,seed)
+    times = run(scr,ticks,simulate.RandomInput(seed,scenario.get('rate',0.2)))
+
+    report = {
+        'scenario': scenario['name'],
+        'level': scenario.get('level',0),
+        'seed': seed,
+        'ticks': len(times),
+        'python': platform.python_version(),
+        'graphics': 'window' if args.window else 'headless',
+        'spawned': counts,
+        'ms': summary(times),
+        'events': dict(scr._q.counts()),
+        'done': scr._DONE,
+        'lost': scr._LOST,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    show(report,baseline)
+    if args.json:
+        with open(args.json,'w') as f:
+            json.dump(report,f,indent=2,sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from graphics import *
 import time
+import latency
 
 tile_size = 24
 win_size = tile_size*5
@@ -76,6 +77,9 @@ class CheckInput (object):
         q.enqueue(1,self)
 
 def main():
+	# time key presses until they show (reported when 'q' quits)
+	latency.LatencyProbe().install(win).report_at_exit()
+
 	p = Player('p',win)
 	p.draw_initial()
 	